@@ -1,3 +1,7 @@
+from milk.startup import ImportTimer
+
+ImportTimer().install()
+
 from app import App
 
 if __name__ == '__main__':
@@ -6,6 +6,7 @@ from PyQt5.QtWidgets import QApplication
 
 from milk.cmm import Cmm
 from milk.conf import ResMap, Settings, signals
+from milk.startup import ImportTimer
 from milk.view.window import Window
 
 
@@ -38,4 +39,5 @@ class App(object):
 
     def run(self):
         self.window.show()
+        signals.logger_debug.emit(ImportTimer().uninstall().report())
         sys.exit(self.app.exec_())
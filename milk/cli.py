@@ -0,0 +1,294 @@
+"""
+Headless entry point of the Lua tools, for build servers and CI:
+
+    python -m milk.cli lua check PATH... [--limit N] [--fail-on-nested] [--packrat]
+    python -m milk.cli lua minify PATH... [--suffix] [--keep-comments] [--wrap-table] [--token-mode [--check-syntax]]
+    python -m milk.cli lua extract PATH...
+    python -m milk.cli lua encoding PATH... [--convert] [--dry-run [--diff]] [--export FILE.csv|FILE.json]
+    python -m milk.cli texture unpack PATH... [--out DIR] [--force] [--png-level N] [--optimize] [--raw] [--trim]
+
+Nothing here imports PyQt5, and the tool modules are only imported by the command that needs them.
+With `--format jsonl` every file is reported as one JSON object per line. The exit code is 0 when every file
+passed, 1 when any failed, and 2 on bad usage.
+"""
+import json
+import sys
+from argparse import ArgumentParser
+from os import environ
+from os.path import exists, expanduser, join
+from typing import Iterable, List
+
+from milk.scanner import FileIndex, scan_files
+
+EXIT_OK = 0
+EXIT_FAILED = 1
+EXIT_USAGE = 2
+
+LUA_EXTENSIONS = ('.lua',)
+
+
+def default_cache_dir():
+    # Cmm.app_cache_dir needs Qt, the CLI keeps its own cache unless told otherwise
+    return environ.get('MILK_CACHE_DIR') or join(expanduser('~'), '.cache', 'milk')
+
+
+def collect_files(paths: Iterable[str], extensions: Iterable[str]):
+    return [entry.path for entry in scan_files(paths, extensions)]
+
+
+class Reporter:
+    def __init__(self, fmt: str, stream=None):
+        self.fmt = fmt
+        self.stream = stream if stream is not None else sys.stdout
+        self.failed = 0
+
+    def emit(self, record: dict, ok: bool, text: str):
+        if not ok:
+            self.failed += 1
+        if self.fmt == 'jsonl':
+            self.stream.write(json.dumps(record, ensure_ascii=False))
+        else:
+            self.stream.write('{} {}'.format('OK ' if ok else 'BAD', text))
+        self.stream.write('\n')
+        self.stream.flush()
+
+    def exit_code(self):
+        return EXIT_FAILED if self.failed > 0 else EXIT_OK
+
+
+def lua_check(args, reporter: Reporter):
+    from milk.view.lua.lua_batch_checker import LuaBatchChecker
+    from milk.view.lua.lua_result_cache import LuaResultCache
+    from milk.view.lua.lua_syntax_checker import nested_cache_options
+
+    cache = None
+    if not args.no_cache:
+        where = join(args.cache_dir, 'lua', 'syntax.db')
+        cache = LuaResultCache(where, options=nested_cache_options(args.limit, args.packrat)).open()
+    checker = LuaBatchChecker(max_workers=args.jobs, cache=cache, packrat=args.packrat)
+    checker.start(collect_files(args.paths, LUA_EXTENSIONS), args.limit)
+    try:
+        while not checker.finished():
+            for result in checker.poll(wait=True):
+                nested = result.max_level > args.limit
+                record = {
+                    'file': result.filepath,
+                    'ok': result.ok,
+                    'max_level': result.max_level,
+                    'nested': [{'level': block.level, 'line': block.line} for block in result.blocks],
+                    'error': result.error,
+                }
+                text = '{} (max level {})'.format(result.filepath, result.max_level)
+                if result.error is not None:
+                    text = '{}: {}'.format(result.filepath, result.error)
+                reporter.emit(record, result.ok and not (nested and args.fail_on_nested), text)
+    finally:
+        checker.shutdown()
+
+
+def lua_minify(args, reporter: Reporter):
+    from milk.view.lua.lua_batch_minifier import LuaBatchMinifier, MinifyManifest, MinifyOptions
+
+    options = MinifyOptions(replace=not args.suffix, keep_comments=args.keep_comments, wrap_table=args.wrap_table,
+                            token_mode=args.token_mode, check_syntax=args.check_syntax)
+    manifest = None
+    if not args.no_cache:
+        manifest = MinifyManifest(join(args.cache_dir, 'lua', 'minify.json')).load()
+    minifier = LuaBatchMinifier(options, manifest, max_workers=args.jobs)
+    minifier.start(collect_files(args.paths, LUA_EXTENSIONS))
+    try:
+        while not minifier.finished():
+            for result in minifier.poll(wait=True):
+                record = {
+                    'file': result.source,
+                    'target': result.target,
+                    'ok': result.ok,
+                    'skipped': result.skipped,
+                    'error': result.error,
+                }
+                text = result.target
+                if result.skipped:
+                    text += ' (unchanged)'
+                elif result.error is not None:
+                    text = '{}: {}'.format(result.source, result.error)
+                reporter.emit(record, result.ok, text)
+    finally:
+        minifier.shutdown()
+
+
+def lua_extract(args, reporter: Reporter):
+    from milk.view.lua.lua_source_interpreter import LuaSourceExtractor
+
+    for where in collect_files(args.paths, LUA_EXTENSIONS):
+        try:
+            data = LuaSourceExtractor(where).parse()
+        except Exception as e:
+            error = '{}: {}'.format(e.__class__.__name__, e)
+            reporter.emit({'file': where, 'ok': False, 'error': error}, False, '{}: {}'.format(where, error))
+            continue
+        record = {'file': where, 'ok': True}
+        for kind, elements in data.items():
+            record[kind] = [{'line': line, 'content': content} for _, line, content in elements]
+        counts = ', '.join('{} {}'.format(len(elements), kind) for kind, elements in data.items())
+        reporter.emit(record, True, '{} ({})'.format(where, counts))
+
+
+def lua_encoding(args, reporter: Reporter):
+    from milk.cmm import Cmm
+    from milk.view.lua.encoding_detector import EncodingBatchDetector
+    from milk.view.lua.encoding_store import EncodingStore, export_report
+
+    store = None
+    index = None
+    if not args.no_cache:
+        store = EncodingStore(join(args.cache_dir, 'lua', 'encoding.db')).open()
+        # what the last scan of the same paths found, to drop the stored results of files removed since
+        index = FileIndex.under(join(args.cache_dir, 'lua'), args.paths, args.ext).load()
+    detector = EncodingBatchDetector(max_workers=args.jobs, store=store)
+    results = []
+    # streamed, the first files are detected while the rest of the tree is still listed
+    files = (entry.path for entry in scan_files(args.paths, args.ext, index=index))
+    detector.start(files, args.convert or args.dry_run, args.dry_run)
+    try:
+        while not detector.finished():
+            for result in detector.poll(wait=True):
+                results.append(result)
+                where = result.filepath
+                if result.encoding is None:
+                    reporter.emit({'file': where, 'ok': False, 'error': result.error}, False,
+                                  '{}: {}'.format(where, result.error))
+                    continue
+                ok = result.ok and (result.is_utf8 or result.converted)
+                record = {'file': where, 'ok': ok, 'encoding': result.encoding, 'confidence': result.confidence,
+                          'converted': result.converted}
+                if result.error is not None:
+                    record['error'] = result.error
+                converted = ', would convert' if args.dry_run else ', converted'
+                reporter.emit(record, ok, '{} ({}{})'.format(where, result.encoding,
+                                                             converted if result.converted else ''))
+                if args.diff and result.converted and args.format == 'text':
+                    for line_no, text in Cmm.utf8_conversion_diff(where, result.encoding):
+                        print('    {}: {}'.format(line_no, text))
+        if index is not None:
+            diff = index.diff()
+            store.forget(diff.removed)
+            index.save()
+            print('{} added, {} changed, {} removed since the last scan'.format(
+                len(diff.added), len(diff.changed), len(diff.removed)), file=sys.stderr)
+    finally:
+        detector.shutdown()
+    if args.export is not None:
+        results.sort(key=lambda r: r.filepath)
+        export_report(args.export, results)
+    cached = sum(1 for result in results if result.cached)
+    print('{} files, {} unchanged since the last run, in {:.2f}s'.format(len(results), cached, detector.elapsed()),
+          file=sys.stderr)
+
+
+def texture_unpack(args, reporter: Reporter):
+    from milk.image_output import ImageOutput
+    from milk.view.texture.batch_unpacker import find_atlases, TextureBatchUnpacker
+
+    output = ImageOutput('raw' if args.raw else 'png', args.png_level, args.optimize)
+    unpacker = TextureBatchUnpacker(max_workers=args.jobs, force=args.force, output=output, trim=args.trim)
+    unpacker.start(find_atlases(args.paths, args.out))
+    try:
+        while not unpacker.finished():
+            for result in unpacker.poll(wait=True):
+                record = {
+                    'file': result.plist_path,
+                    'texture': result.texture_path,
+                    'out': result.out_dir,
+                    'ok': result.ok,
+                    'skipped': result.skipped,
+                    'frames': result.frames,
+                    'failed': result.failed,
+                    'error': result.error,
+                }
+                text = '{} -> {} ({} frames{})'.format(result.plist_path, result.out_dir, result.frames,
+                                                       ', unchanged' if result.skipped else '')
+                if result.error is not None:
+                    text = '{}: {}'.format(result.plist_path, result.error)
+                reporter.emit(record, result.ok, text)
+    finally:
+        unpacker.shutdown()
+    summary = '{} atlases, {} frames in {:.2f}s, {:.0f} frames/s'.format(
+        unpacker.total(), unpacker.frames(), unpacker.elapsed(), unpacker.frames_per_second())
+    print(summary, file=sys.stderr)
+
+
+def create_parser():
+    parser = ArgumentParser(prog='python -m milk.cli', description='milk tools without the GUI')
+    tools = parser.add_subparsers(dest='tool', required=True)
+
+    lua = tools.add_parser('lua', help='Lua source tools')
+    lua_commands = lua.add_subparsers(dest='command', required=True)
+
+    def add_command(commands, name: str, handler, help_text: str):
+        command = commands.add_parser(name, help=help_text)
+        command.add_argument('paths', nargs='+', help='files or folders')
+        command.add_argument('--format', choices=('text', 'jsonl'), default='text', help='output format')
+        command.set_defaults(handler=handler)
+        return command
+
+    def add_pool_options(command):
+        command.add_argument('--jobs', type=int, default=None, help='worker processes, all cores by default')
+        command.add_argument('--cache-dir', default=default_cache_dir(), help='where results are cached')
+        command.add_argument('--no-cache', action='store_true', help='neither read nor write the cache')
+
+    check = add_command(lua_commands, 'check', lua_check, 'check syntax and block nesting')
+    check.add_argument('--limit', type=int, default=5, help='deepest allowed block nesting level')
+    check.add_argument('--fail-on-nested', action='store_true', help='fail files nested beyond the limit')
+    check.add_argument('--packrat', action='store_true',
+                       help='memoize while parsing, much faster on calls nested in call arguments, '
+                            'a little slower on other files')
+    add_pool_options(check)
+
+    minify = add_command(lua_commands, 'minify', lua_minify, 'minify sources')
+    minify.add_argument('--suffix', action='store_true', help='write <file>.min instead of replacing the file')
+    minify.add_argument('--keep-comments', action='store_true', help='keep comments')
+    minify.add_argument('--wrap-table', action='store_true', help='always write table keys')
+    minify.add_argument('--token-mode', action='store_true', help='only strip spaces and comments, much faster')
+    minify.add_argument('--check-syntax', action='store_true',
+                        help='with --token-mode, also parse every file before writing it (slower, more memory)')
+    add_pool_options(minify)
+
+    add_command(lua_commands, 'extract', lua_extract, 'list functions, comments and strings')
+
+    encoding = add_command(lua_commands, 'encoding', lua_encoding, 'detect (and convert to utf-8) file encodings')
+    encoding.add_argument('--ext', nargs='+', default=list(LUA_EXTENSIONS), help='file extensions to scan')
+    encoding.add_argument('--convert', action='store_true', help='convert non utf-8 files to utf-8')
+    encoding.add_argument('--dry-run', action='store_true', help='only report the files --convert would convert')
+    encoding.add_argument('--diff', action='store_true', help='with --dry-run, list the lines which would change')
+    encoding.add_argument('--export', default=None, help='also write the results to a .csv or .json file')
+    add_pool_options(encoding)
+
+    texture = tools.add_parser('texture', help='texture atlas tools')
+    texture_commands = texture.add_subparsers(dest='command', required=True)
+
+    unpack = add_command(texture_commands, 'unpack', texture_unpack, 'save the frames of plist atlases as pictures')
+    unpack.add_argument('--out', default=None, help='output folder, next to each plist by default')
+    unpack.add_argument('--jobs', type=int, default=None, help='worker processes, all cores by default')
+    unpack.add_argument('--force', action='store_true', help='also unpack atlases unpacked since they last changed')
+    unpack.add_argument('--png-level', type=int, choices=range(10), default=6, metavar='0-9',
+                        help='png compression level, 1 is much faster and only a little larger')
+    unpack.add_argument('--optimize', action='store_true', help='smallest png files, slowest')
+    unpack.add_argument('--raw', action='store_true', help='write uncompressed .rgba files instead of png')
+    unpack.add_argument('--trim', action='store_true',
+                        help='cut off the fully transparent border of each frame, add --force to redo unpacked atlases')
+    return parser
+
+
+def main(argv: List[str] = None):
+    args = create_parser().parse_args(argv)
+    missing = [path for path in args.paths if not exists(path)]
+    if missing:
+        print('No such file or folder: {}'.format(', '.join(missing)), file=sys.stderr)
+        return EXIT_USAGE
+    reporter = Reporter(args.format)
+    args.handler(args, reporter)
+    return reporter.exit_code()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
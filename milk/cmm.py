@@ -1,20 +1,57 @@
-from os import listdir, makedirs, sep
-from os.path import dirname, isdir, join, realpath, splitext
+from codecs import BOM_UTF8, getincrementaldecoder, getincrementalencoder
+from os import fdopen, listdir, makedirs, remove, replace, sep, stat
+from os.path import basename, dirname, exists, isdir, join, realpath, splitext
 from random import randint
-from shutil import rmtree
+from shutil import copymode, rmtree
 from sys import executable
+from tempfile import mkstemp
 from traceback import format_exc, print_exc
 
-import cchardet
-from PyQt5.QtCore import QStandardPaths, QUrl
-from PyQt5.QtGui import QColor, QDesktopServices
-
 try:
     from collections import Iterable
 except (AttributeError, ImportError):
     from collections.abc import Iterable
 
+# bytes `Cmm.sniff_file_encoding` gives `cchardet` first, and the size of the reads after that
+ENCODING_SNIFF_SIZE = 32 * 1024
+ENCODING_CHUNK_SIZE = 1024 * 1024
+# below this the whole file is looked at
+ENCODING_MIN_CONFIDENCE = 0.6
+# bytes before the first non UTF-8 one also given to `cchardet`
+ENCODING_SNIFF_BACK = 256
+
+
+def _utf8_error_at(head: bytes, f, sniff_size: int):
+    """Offset of the first byte which is not UTF-8 in `head` and the rest of `f`, None when all of it is."""
+    if len(head) < sniff_size:
+        # the whole file
+        if head.isascii():
+            return None
+        try:
+            head.decode('utf-8')
+            return None
+        except UnicodeDecodeError as e:
+            return e.start
+    decoder = getincrementaldecoder('utf-8')()
+    offset = 0
+    chunk = head
+    while chunk:
+        pending = decoder.getstate()[0]
+        if pending or not chunk.isascii():
+            try:
+                decoder.decode(chunk, False)
+            except UnicodeDecodeError as e:
+                return max(0, offset - len(pending) + e.start)
+        offset += len(chunk)
+        chunk = f.read(ENCODING_CHUNK_SIZE)
+    try:
+        decoder.decode(b'', True)
+    except UnicodeDecodeError:
+        return max(0, offset - len(decoder.getstate()[0]))
+    return None
 
+
+# PyQt5 and cchardet are imported by the methods using them, so the file helpers also load on headless hosts
 class Cmm:
     Iterable = Iterable
 
@@ -41,14 +78,17 @@ class Cmm:
 
     @staticmethod
     def local_cache_dir():
+        from PyQt5.QtCore import QStandardPaths
         return QStandardPaths.writableLocation(QStandardPaths.AppConfigLocation)
 
     @staticmethod
     def local_temp_dir():
+        from PyQt5.QtCore import QStandardPaths
         return QStandardPaths.writableLocation(QStandardPaths.TempLocation)
 
     @staticmethod
     def user_root_dir():
+        from PyQt5.QtCore import QStandardPaths
         return QStandardPaths.writableLocation(QStandardPaths.HomeLocation)
 
     @staticmethod
@@ -57,10 +97,12 @@ class Cmm:
 
     @staticmethod
     def user_picture_dir():
+        from PyQt5.QtCore import QStandardPaths
         return QStandardPaths.writableLocation(QStandardPaths.PicturesLocation)
 
     @staticmethod
     def user_document_dir():
+        from PyQt5.QtCore import QStandardPaths
         return QStandardPaths.writableLocation(QStandardPaths.DocumentsLocation)
 
     @staticmethod
@@ -70,6 +112,9 @@ class Cmm:
     # noinspection PyBroadException
     @staticmethod
     def open_external_file(url: str):
+        from PyQt5.QtCore import QUrl
+        from PyQt5.QtGui import QDesktopServices
+
         def on_start():
             filepath = QUrl("file:///" + realpath(url))
             QDesktopServices.openUrl(filepath)
@@ -78,6 +123,8 @@ class Cmm:
 
     @staticmethod
     def open_external_url(url: str):
+        from PyQt5.QtCore import QUrl
+        from PyQt5.QtGui import QDesktopServices
         QDesktopServices.openUrl(QUrl(url))
         # def on_start():
         #     QDesktopServices.openUrl(QUrl(url))
@@ -111,14 +158,46 @@ class Cmm:
 
     @staticmethod
     def random_color(alpha: int = 255):
+        from PyQt5.QtGui import QColor
         return QColor(randint(0, 255), randint(0, 255), randint(0, 255), alpha)
 
     @staticmethod
     def get_file_encoding(filepath: str):
+        return Cmm.sniff_file_encoding(filepath)[0]
+
+    @staticmethod
+    def sniff_file_encoding(filepath: str, sniff_size: int = ENCODING_SNIFF_SIZE):
+        """
+        (encoding, confidence) of `filepath`. Files which are valid UTF-8 are told by a decoding pass in chunks,
+        others by `cchardet` on `sniff_size` bytes from about where they stopped being UTF-8,
+        or on the whole file when that is not confident enough.
+        """
+        import cchardet
         with open(filepath, 'rb') as f:
-            encoding = cchardet.detect(f.read())['encoding']
-            encoding = 'utf-8' if encoding is None else encoding.lower()
-            return Cmm.format_file_encoding(encoding)
+            head = f.read(sniff_size)
+            if head.startswith(BOM_UTF8):
+                return 'utf-8-sig', 1.0
+            bad_at = _utf8_error_at(head, f, sniff_size)
+            if bad_at is None:
+                return 'utf-8', 1.0
+            # ascii before the first bad byte tells nothing, long generated files often start with pages of it
+            start = 0 if bad_at < sniff_size // 2 else bad_at - ENCODING_SNIFF_BACK
+            if start > 0:
+                f.seek(start)
+                head = f.read(sniff_size)
+            result = cchardet.detect(head)
+            confidence = result['confidence'] or 0
+            if (start == 0 and len(head) < sniff_size) or confidence >= ENCODING_MIN_CONFIDENCE:
+                return Cmm.format_file_encoding(result['encoding'] or 'utf-8'), confidence
+            f.seek(0)
+            detector = cchardet.UniversalDetector()
+            for chunk in iter(lambda: f.read(ENCODING_CHUNK_SIZE), b''):
+                detector.feed(chunk)
+                if detector.done:
+                    break
+            detector.close()
+            result = detector.result
+            return Cmm.format_file_encoding(result['encoding'] or 'utf-8'), result['confidence'] or 0
 
     @staticmethod
     def format_file_encoding(encoding: str):
@@ -130,20 +209,70 @@ class Cmm:
         return encoding
 
     @staticmethod
-    def convert_file_encoding_to_utf8(filepath: str):
-        with open(filepath, 'rb+') as f:
-            content = f.read()
-            encoding = cchardet.detect(content)['encoding']
-            result = Cmm.format_file_encoding(encoding)
-            try:
-                if result != 'utf-8':
-                    content = content.decode(encoding).encode('utf8')
-                    f.seek(0)
-                    f.write(content)
-                return result, True
-            except (UnicodeDecodeError, UnicodeEncodeError) as e:
-                print(e)
-                return result, False
+    def convert_file_encoding_to_utf8(filepath: str, encoding: str = None, dry_run: bool = False):
+        """
+        Rewrite `filepath` from `encoding`, sniffed when not given, to utf-8 and return (encoding, error),
+        the error being None when it converted, otherwise a message for the caller to report.
+        The file is decoded and encoded in chunks into a temporary file next to it which then replaces it,
+        so memory use does not grow with the file, and the file is left as it was when anything fails
+        or it was changed meanwhile. With `dry_run` the file is only decoded, to tell whether it would convert.
+        """
+        if encoding is None:
+            encoding = Cmm.sniff_file_encoding(filepath)[0]
+        if Cmm.is_utf8_encoding(encoding):
+            return encoding, None
+        try:
+            decoder = getincrementaldecoder(encoding)()
+            encoder = getincrementalencoder('utf-8')()
+        except LookupError as e:
+            return encoding, '{}: {}'.format(e.__class__.__name__, e)
+
+        before = stat(filepath)
+        temp = None
+        try:
+            with open(filepath, 'rb') as src:
+                if dry_run:
+                    for chunk in iter(lambda: src.read(ENCODING_CHUNK_SIZE), b''):
+                        decoder.decode(chunk)
+                    decoder.decode(b'', True)
+                    return encoding, None
+                fd, temp = mkstemp(prefix='.' + basename(filepath) + '.', suffix='.tmp',
+                                   dir=dirname(realpath(filepath)))
+                with fdopen(fd, 'wb') as dst:
+                    for chunk in iter(lambda: src.read(ENCODING_CHUNK_SIZE), b''):
+                        dst.write(encoder.encode(decoder.decode(chunk)))
+                    dst.write(encoder.encode(decoder.decode(b'', True), True))
+            copymode(filepath, temp)
+            after = stat(filepath)
+            if (after.st_size, after.st_mtime_ns) != (before.st_size, before.st_mtime_ns):
+                # written by someone else meanwhile, theirs wins
+                remove(temp)
+                return encoding, 'changed while converting, left as it is'
+            replace(temp, filepath)
+            return encoding, None
+        except (UnicodeDecodeError, UnicodeEncodeError) as e:
+            if temp is not None:
+                remove(temp)
+            return encoding, '{}: {}'.format(e.__class__.__name__, e)
+        except BaseException:
+            if temp is not None and exists(temp):
+                remove(temp)
+            raise
+
+    @staticmethod
+    def utf8_conversion_diff(filepath: str, encoding: str, limit: int = 100):
+        """
+        The lines converting `filepath` from `encoding` to utf-8 would change, as (line number, text),
+        at most `limit` of them; lines of ascii only are the same bytes in both.
+        """
+        changes = []
+        with open(filepath, 'r', encoding=encoding, newline='') as f:
+            for line_no, line in enumerate(f, 1):
+                if not line.isascii():
+                    changes.append((line_no, line.rstrip('\r\n')))
+                    if len(changes) >= limit:
+                        break
+        return changes
 
     @staticmethod
     def is_utf8_file(filepath: str):
@@ -166,3 +295,15 @@ class Cmm:
     def save_file_content(where: str, content: str):
         with open(where, 'w+', encoding='utf-8') as lf:
             lf.write(content)
+
+    @staticmethod
+    def save_file_content_atomic(where: str, content: str):
+        # write next to the target and swap it in, so a failed or interrupted write never leaves half a file
+        fd, temp = mkstemp(prefix='.' + basename(where) + '.', suffix='.tmp', dir=dirname(realpath(where)))
+        try:
+            with fdopen(fd, 'w', encoding='utf-8') as lf:
+                lf.write(content)
+            replace(temp, where)
+        except BaseException:
+            remove(temp)
+            raise
@@ -66,6 +66,13 @@ Lang = dict({
 
     "texture_unpacker:menu_file:item_file_save_all": "保存所有图片",
     "texture_unpacker:menu_file:item_file_save_one": "保存选中图片",
+    "texture_unpacker:menu_file:item_file_unpack_dir": "批量提取目录",
+
+    "texture_unpacker:menu_output": "输出格式",
+    "texture_unpacker:menu_output:item_png": "PNG（标准）",
+    "texture_unpacker:menu_output:item_png_fast": "PNG（快速）",
+    "texture_unpacker:menu_output:item_png_small": "PNG（最小）",
+    "texture_unpacker:menu_output:item_raw": "RGBA 原始数据（不压缩）",
 })
 
 
@@ -83,6 +90,9 @@ class LangUI:
     msg_atlas_not_found = "Spine Atlas 文件未找到，请检查目录是否正确"
     msg_all_extracted = "[{0}] 全部提取完成！"
     msg_one_extracted = "[{0}] 提取完成！"
+    msg_one_extracted_timing = "[{0}] 提取完成：写入{1}张，未变化{2}张，删除{3}张，耗时{4:.2f}秒"
+    msg_one_unchanged = "[{0}] 未变化，已跳过"
+    msg_all_extracted_timing = "[{0}] 全部提取完成：{1}个图集，{2}张图片，耗时{3:.2f}秒，{4:.0f}张/秒，页面解码{5}次"
 
     view_about_me = "关于我"
 
@@ -117,15 +127,24 @@ class LangUI:
     atlas_extractor_ui_edit_locate_dir = "请选择 Spine Atlas 所在目录"
     atlas_extractor_ui_edit_output_dir = "请选择碎图输出目录"
     atlas_extractor_ui_btn_parse = "提取"
+    atlas_extractor_ui_incremental = "增量提取（仅更新有变化的碎图）"
+    atlas_extractor_ui_lab_output_format = "输出格式"
 
     texture_unpacker_title = "Plist 合图提取器"
     texture_unpacker_ui_tip = "请在此处拖入 .png/.plist 文件"
+    texture_unpacker_ui_loading = "正在加载 {0} ..."
     texture_unpacker_ui_save_dir = "请选择图片保存位置"
     texture_unpacker_parse_fail = "[{0}] 解析 '{1}' 失败！"
     texture_unpacker_ui_btn_save = "保存"
     texture_unpacker_ui_btn_file = "文件"
     texture_unpacker_action_save_all = "保存所有图片"
     texture_unpacker_action_save_one = "保存选中图片"
+    texture_unpacker_progress = "{0} ({1}/{2})"
+    texture_unpacker_finished = "合图提取完成：{0}张图片，耗时{1:.2f}秒"
+    texture_unpacker_ui_unpack_dir = "请选择 .plist 合图所在目录"
+    texture_unpacker_batch_skipped = "未变化，跳过"
+    image_output_changed = "输出格式：{0}"
+    texture_unpacker_batch_finished = "批量提取完成：{0}个合图，{1}张图片，耗时{2:.2f}秒，{3:.0f}张/秒"
 
     translate_title = "离线翻译"
     translate_lang_zh = '中文'
@@ -160,6 +179,10 @@ class LangUI:
     lua_encoding_detection_file_not_found = "{} 不存在"
     lua_encoding_detection_convert_ok = "<成功>"
     lua_encoding_detection_convert_bad = "<失败>"
+    lua_encoding_detection_finished = "编码检测完成：{0}个文件（{2}个未变化，沿用上次结果），耗时{1:.2f}秒"
+    lua_encoding_detection_export = "导出报告"
+    lua_encoding_detection_export_title = "导出编码检测报告"
+    lua_encoding_detection_exported = "编码检测报告已导出：{}"
 
     lua_grammar_title = 'Lua语法检测'
     lua_grammar_nested_level = "<b>[嵌套层级 {}]</b>"
@@ -176,6 +199,10 @@ class LangUI:
     lua_minifier_replace = '替换源文件，否则保存到备份文件'
     lua_minifier_keep_comment = '保留注释'
     lua_minifier_wrap_table = '始终显示键值对'
+    lua_minifier_token_mode = '快速模式（仅移除空白和注释）'
+    lua_minifier_check_syntax = '快速模式下完整检查语法（较慢）'
+    lua_minifier_skipped = '未变更，跳过'
+    lua_minifier_finished = 'Lua代码简化完成：{}个文件，耗时{:.2f}秒'
 
     lua_extractor_title = 'Lua元素提取器'
     lua_extractor_file_at = "选择Lua文件"
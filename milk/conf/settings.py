@@ -286,13 +286,18 @@ class UserKey:
         log_error = "log_error"
         log_fatal = "log_fatal"
 
+    class ImageOutput:
+        preset = "image:output:preset"
+
     class SpineAtlasExtractor:
         atlas_locate_dir = "texture:spine:atlas:atlas_locate_dir"
         atlas_out_dir = "texture:spine:atlas:atlas_out_dir"
+        incremental = "texture:spine:atlas:incremental"
         window_rect = "texture:spine:atlas:window_rect"
 
     class TextureUnpacker:
         last_save_at = "texture:unpacker:last_save_at"
+        last_unpack_dir = "texture:unpacker:last_unpack_dir"
         window_rect = "texture:unpacker:window_rect"
 
     class Translator:
@@ -385,6 +385,16 @@ class GUI:
                 return chosen
         return None
 
+    @staticmethod
+    def dialog_for_file_saving(parent: QWidget, title: str, start: str, file_filter: str = 'Any Files(*.*)'):
+        start = start if len(start) > 0 else Cmm.user_document_dir()
+        chosen = QFileDialog.getSaveFileName(parent, title, start, file_filter)
+        if isinstance(chosen, tuple):
+            chosen = chosen[0]
+        if chosen and not isdir(chosen):
+            return chosen
+        return None
+
     @staticmethod
     def dialog_for_directory_selection(parent: QWidget, title: str, start: str):
         start = start if len(start) > 0 else Cmm.user_document_dir()
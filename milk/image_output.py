@@ -0,0 +1,93 @@
+import struct
+from io import BytesIO
+from os.path import splitext
+from typing import Dict
+
+from PIL import Image
+
+# magic, mode, width, height, then the pixels row by row
+RAW_HEADER = struct.Struct('<4s4sII')
+RAW_MAGIC = b'MILK'
+RAW_EXTENSION = '.rgba'
+PNG_EXTENSION = '.png'
+
+
+class ImageOutput:
+    """
+    How extracted pictures are written: `png` with a zlib `compress_level` from 0 (stored) to 9
+    and optionally `optimize`, or `raw`, the RGBA pixels after a small header, for pipelines which read
+    them back at once and would otherwise spend most of their time in deflate.
+    Instances are sent to the worker processes which encode them.
+    """
+
+    __slots__ = ('format', 'compress_level', 'optimize')
+
+    def __init__(self, format: str = 'png', compress_level: int = 6, optimize: bool = False):
+        if format not in ('png', 'raw'):
+            raise ValueError('Unknown output format: {}'.format(format))
+        self.format = format
+        self.compress_level = max(0, min(9, compress_level))
+        self.optimize = optimize
+
+    def __getstate__(self):
+        return tuple(getattr(self, key) for key in self.__slots__)
+
+    def __setstate__(self, state):
+        for key, value in zip(self.__slots__, state):
+            setattr(self, key, value)
+
+    @property
+    def extension(self):
+        return RAW_EXTENSION if self.format == 'raw' else PNG_EXTENSION
+
+    def signature(self):
+        """Changes whenever the written bytes may, for caches of outputs."""
+        if self.format == 'raw':
+            return 'raw'
+        return '{}:{}:{}'.format(self.format, self.compress_level, int(self.optimize))
+
+    def target(self, where: str):
+        """`where` with this output's extension, png names are kept as they are."""
+        if self.format == 'png':
+            return where
+        stem, ext = splitext(where)
+        return (stem if ext.lower() == PNG_EXTENSION else where) + self.extension
+
+    def encode(self, image: Image.Image):
+        if self.format == 'raw':
+            if image.mode != 'RGBA':
+                image = image.convert('RGBA')
+            return RAW_HEADER.pack(RAW_MAGIC, b'RGBA', image.width, image.height) + image.tobytes()
+        data = BytesIO()
+        image.save(data, 'png', compress_level=self.compress_level, optimize=self.optimize)
+        return data.getvalue()
+
+    def save(self, image: Image.Image, where: str):
+        """Write `image` at `where`, which already has the right extension, and return the bytes written."""
+        data = self.encode(image)
+        with open(where, 'wb') as f:
+            f.write(data)
+        return data
+
+
+def read_raw(where: str):
+    """A picture written by the `raw` output."""
+    with open(where, 'rb') as f:
+        magic, mode, width, height = RAW_HEADER.unpack(f.read(RAW_HEADER.size))
+        if magic != RAW_MAGIC:
+            raise ValueError('Not a raw picture: {}'.format(where))
+        return Image.frombytes(mode.decode('ascii'), (width, height), f.read())
+
+
+# choices of the views, by settings value
+OUTPUT_PRESETS: Dict[str, ImageOutput] = {
+    'png': ImageOutput('png', 6),
+    'png-fast': ImageOutput('png', 1),
+    'png-small': ImageOutput('png', 9, optimize=True),
+    'raw': ImageOutput('raw'),
+}
+DEFAULT_PRESET = 'png'
+
+
+def output_preset(name: str):
+    return OUTPUT_PRESETS.get(name, OUTPUT_PRESETS[DEFAULT_PRESET])
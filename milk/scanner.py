@@ -0,0 +1,255 @@
+"""
+Walk folders with `os.scandir`: hidden entries and those matching `IgnoreRules` are dropped when met,
+so ignored folders are never entered, files are yielded as soon as their folder is listed,
+and a `FileIndex` can keep (size, mtime) of what was found to tell what changed since the last scan.
+"""
+import re
+import sqlite3
+from hashlib import blake2b
+from os import makedirs, scandir, stat
+from os.path import abspath, basename, dirname, isdir, join, normpath
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+IGNORE_FILE = '.milkignore'
+
+
+def _pattern_regex(pattern: str):
+    out = []
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if pattern.startswith('**/', i):
+            out.append('(?:.*/)?')
+            i += 3
+            continue
+        if pattern.startswith('**', i):
+            out.append('.*')
+            i += 2
+            continue
+        if c == '*':
+            out.append('[^/]*')
+        elif c == '?':
+            out.append('[^/]')
+        elif c == '[':
+            end = pattern.find(']', i + 1)
+            if end < 0:
+                out.append(re.escape(c))
+            else:
+                body = pattern[i + 1:end]
+                out.append('[' + ('^' + body[1:] if body.startswith('!') else body) + ']')
+                i = end
+        else:
+            out.append(re.escape(c))
+        i += 1
+    return ''.join(out)
+
+
+class IgnoreRule:
+    __slots__ = ('pattern', 'negate', 'dir_only', 'regex')
+
+    def __init__(self, pattern: str, base: str = ''):
+        self.negate = pattern.startswith('!')
+        if self.negate:
+            pattern = pattern[1:]
+        self.dir_only = pattern.endswith('/')
+        pattern = pattern.rstrip('/')
+        # a slash anywhere but at the end ties the pattern to its folder `base`, otherwise it matches at any depth below
+        anchored = '/' in pattern
+        self.pattern = pattern.lstrip('/')
+        prefix = (re.escape(base + '/') if base else '') + ('' if anchored else '(?:.*/)?')
+        self.regex = re.compile(prefix + _pattern_regex(self.pattern) + r'\Z')
+
+    def matches(self, relative: str, is_dir: bool):
+        return (is_dir or not self.dir_only) and self.regex.match(relative) is not None
+
+
+class IgnoreRules:
+    """
+    `.gitignore` style patterns: `#` comments, `!` to include again, a trailing `/` for folders only,
+    `*`, `?`, `[...]` within a name and `**` across folders. Paths are relative to the scanned folder,
+    with `/` separators, patterns to the folder `base` they were given for, and the last matching pattern decides.
+    """
+
+    def __init__(self, patterns: Iterable[str] = (), base: str = ''):
+        self.rules: List[IgnoreRule] = []
+        self.extend(patterns, base)
+
+    def extend(self, patterns: Iterable[str], base: str = ''):
+        for line in patterns:
+            line = line.rstrip('\n').strip()
+            if line and not line.startswith('#'):
+                self.rules.append(IgnoreRule(line, base))
+        return self
+
+    @staticmethod
+    def load(where: str, base: str = ''):
+        rules = IgnoreRules()
+        try:
+            with open(where, 'r', encoding='utf-8') as f:
+                rules.extend(f, base)
+        except OSError:
+            pass
+        return rules
+
+    def ignored(self, relative: str, is_dir: bool):
+        ignored = False
+        for rule in self.rules:
+            if rule.negate == ignored and rule.matches(relative, is_dir):
+                ignored = not rule.negate
+        return ignored
+
+
+class IndexDiff:
+    def __init__(self, added: List[str], changed: List[str], removed: List[str]):
+        self.added = added
+        self.changed = changed
+        self.removed = removed
+
+    def __bool__(self):
+        return bool(self.added or self.changed or self.removed)
+
+
+class FileIndex:
+    """
+    (size, mtime_ns) of every file met by a scan, and of the scan before it when loaded from `where`,
+    a sqlite file. `diff` tells which files were added, changed or removed between the two, `save` keeps the new one.
+    """
+
+    def __init__(self, where: str = None):
+        self.where = where
+        self.previous: Dict[str, Tuple[int, int]] = dict()
+        self.current: Dict[str, Tuple[int, int]] = dict()
+
+    @staticmethod
+    def under(folder: str, paths: Iterable[str], extensions: Iterable[str] = ()):
+        """The index kept in `folder` for scans of `paths` with `extensions`, other scans do not touch it."""
+        h = blake2b(digest_size=8)
+        for path in sorted(normpath(abspath(path)) for path in paths):
+            h.update(path.encode('utf-8') + b'\0')
+        h.update(','.join(sorted(ext.lower() for ext in extensions)).encode('utf-8'))
+        return FileIndex(join(folder, 'index-{}.db'.format(h.hexdigest())))
+
+    def load(self):
+        if self.where is None:
+            return self
+        try:
+            with sqlite3.connect(self.where) as conn:
+                self.previous = {path: (size, mtime) for path, size, mtime in
+                                 conn.execute('SELECT path, size, mtime FROM files')}
+        except sqlite3.Error:
+            self.previous = dict()
+        return self
+
+    def record(self, path: str, size: int, mtime: int):
+        self.current[path] = (size, mtime)
+
+    def changed(self, path: str):
+        """Whether `path` was not seen by the previous scan as it is now."""
+        return self.previous.get(path) != self.current.get(path)
+
+    def diff(self):
+        added = [path for path in self.current if path not in self.previous]
+        changed = [path for path, key in self.current.items() if path in self.previous and self.previous[path] != key]
+        removed = [path for path in self.previous if path not in self.current]
+        return IndexDiff(added, changed, removed)
+
+    def save(self):
+        if self.where is None:
+            return
+        makedirs(dirname(self.where) or '.', exist_ok=True)
+        with sqlite3.connect(self.where) as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, size INTEGER, mtime INTEGER)')
+            conn.execute('DELETE FROM files')
+            conn.executemany('INSERT INTO files VALUES (?, ?, ?)',
+                             ((path, size, mtime) for path, (size, mtime) in self.current.items()))
+        self.previous = dict(self.current)
+
+
+class PathEntry:
+    """What `scandir` gives for a file named directly rather than found in a folder."""
+
+    __slots__ = ('path', 'name', '_stat')
+
+    def __init__(self, path: str):
+        self.path = path
+        self.name = basename(path)
+        self._stat = None
+
+    def is_file(self):
+        return True
+
+    def is_dir(self):
+        return False
+
+    def stat(self):
+        if self._stat is None:
+            self._stat = stat(self.path)
+        return self._stat
+
+
+def scan_files(paths: Iterable[str], extensions: Iterable[str] = (), ignore: IgnoreRules = None,
+               hidden: bool = False, index: FileIndex = None) -> Iterator:
+    """
+    The files under `paths`, folders in name order and each folder's files before its sub folders, like `os.walk`,
+    as `os.DirEntry`s whose `path` is normalized. Files named in `paths` are yielded as they are,
+    as `PathEntry`s, whatever their extension. `extensions` are compared case-insensitively, none means all.
+    Names starting with `.` are skipped unless `hidden`, and so are the paths `ignore` ignores
+    together with the `IGNORE_FILE` of each folder met, whose patterns are relative to that folder
+    and come before those of its sub folders, like `.gitignore` files. The stat of each file is taken
+    only when an `index` records it, and on Windows it comes with the listing anyway.
+    """
+    extensions = tuple(ext.lower() for ext in extensions)
+    for path in paths:
+        path = normpath(path)
+        if not isdir(path):
+            entry = PathEntry(path)
+            if index is not None:
+                info = entry.stat()
+                index.record(entry.path, info.st_size, info.st_mtime_ns)
+            yield entry
+            continue
+        yield from _scan_dir(path, '', extensions, ignore or IgnoreRules(), hidden, index)
+
+
+def _scan_dir(folder: str, relative: str, extensions: Tuple[str], rules: IgnoreRules, hidden: bool,
+              index: Optional[FileIndex]):
+    try:
+        with scandir(folder) as it:
+            entries = sorted(it, key=lambda e: e.name)
+    except OSError:
+        return
+    if any(entry.name == IGNORE_FILE for entry in entries):
+        # the folder's own patterns on top of those of the folders above, which are left as they are
+        local = IgnoreRules()
+        local.rules = rules.rules + IgnoreRules.load(join(folder, IGNORE_FILE), relative).rules
+        rules = local
+    folders = []
+    for entry in entries:
+        name = entry.name
+        if not hidden and name.startswith('.'):
+            continue
+        try:
+            # links to folders are not entered, like `os.walk`, a link back up would loop forever
+            is_dir = entry.is_dir(follow_symlinks=False)
+        except OSError:
+            continue
+        sub = relative + '/' + name if relative else name
+        if rules.rules and rules.ignored(sub, is_dir):
+            continue
+        if is_dir:
+            folders.append((entry.path, sub))
+        elif not extensions or name.lower().endswith(extensions):
+            try:
+                if not entry.is_file():
+                    continue
+            except OSError:
+                continue
+            if index is not None:
+                try:
+                    info = entry.stat()
+                except OSError:
+                    continue
+                index.record(entry.path, info.st_size, info.st_mtime_ns)
+            yield entry
+    for sub_folder, sub in folders:
+        yield from _scan_dir(sub_folder, sub, extensions, rules, hidden, index)
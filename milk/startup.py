@@ -0,0 +1,86 @@
+import builtins
+import sys
+from time import perf_counter
+from typing import List, Tuple
+
+
+class ImportTimer:
+    """
+    Measure the modules imported while the app starts, like `python -X importtime` but collected in-process,
+    so the breakdown can be written to the log of a frozen build as well.
+    Only first imports are timed, a module already in `sys.modules` costs nothing and is not recorded.
+    """
+
+    __instance = None
+
+    def __new__(cls):
+        if cls.__instance is None:
+            cls.__instance = object.__new__(cls)
+            cls.__instance._setup()
+        return cls.__instance
+
+    def _setup(self):
+        self.begin = perf_counter()
+        self.end = None
+        # (name, self seconds, cumulative seconds, depth)
+        self.records: List[Tuple[str, float, float, int]] = []
+        self._children: List[float] = []
+        self._import = None
+
+    def install(self):
+        if self._import is not None:
+            return self
+        self.begin = perf_counter()
+        self._import = builtins.__import__
+        builtins.__import__ = self._timed_import
+        return self
+
+    def uninstall(self):
+        if self._import is not None:
+            builtins.__import__ = self._import
+            self._import = None
+            self.end = perf_counter()
+        return self
+
+    @staticmethod
+    def _absolute_name(name, globals, level):
+        if level == 0 or not globals:
+            return name
+        package = globals.get('__package__') or ''
+        base = package.rsplit('.', level - 1)[0] if level > 1 else package
+        return base + '.' + name if name else base
+
+    @staticmethod
+    def _loaded(name, fromlist):
+        """`name` is imported, and so are the submodules `fromlist` may ask for, those are not seen by this hook."""
+        module = sys.modules.get(name)
+        return module is not None and all(item == '*' or hasattr(module, item) for item in fromlist or ())
+
+    def _timed_import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        absolute = self._absolute_name(name, globals, level)
+        if self._loaded(absolute, fromlist):
+            return self._import(name, globals, locals, fromlist, level)
+        depth = len(self._children)
+        self._children.append(0.0)
+        start = perf_counter()
+        try:
+            return self._import(name, globals, locals, fromlist, level)
+        finally:
+            cost = perf_counter() - start
+            children = self._children.pop()
+            if self._children:
+                self._children[-1] += cost
+            self.records.append((absolute, cost - children, cost, depth))
+
+    def elapsed(self):
+        end = self.end if self.end is not None else perf_counter()
+        return end - self.begin
+
+    def report(self, top: int = 20):
+        """The `top` slowest imports by self time, in the `-X importtime` layout (milliseconds)."""
+        lines = ['startup: {:.0f} ms, {} modules imported'.format(self.elapsed() * 1000, len(self.records)),
+                 'import time:  self [ms] | cumulative | imported package']
+        for name, own, cumulative, depth in sorted(self.records, key=lambda r: r[1], reverse=True)[:top]:
+            lines.append('import time: {:>10.1f} | {:>10.1f} | {}{}'.format(
+                own * 1000, cumulative * 1000, '  ' * depth, name))
+        return '\n'.join(lines)
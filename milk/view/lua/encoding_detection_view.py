@@ -1,14 +1,21 @@
-from os import walk
-from os.path import exists, isdir, isfile, join, normpath, splitext
+from html import escape
+from os.path import exists, isdir, isfile, join, normpath
+from typing import Iterable, List, Optional
 
 from PyQt5.QtCore import Qt
 from PyQt5.QtGui import QColor
 from PyQt5.QtWidgets import QTextEdit
 
 from milk.cmm import Cmm
-from milk.conf import LangUI, settings, StyleSheet, UIDef, UserKey
+from milk.conf import LangUI, settings, signals, StyleSheet, UIDef, UserKey
 from milk.gui import GUI
+from milk.scanner import scan_files
 from milk.thread_runner import ThreadRunner
+from .encoding_detector import EncodingBatchDetector, EncodingResult
+from .encoding_store import EncodingStore, export_report
+
+# lines added to the log at once when it is drawn again
+RENDER_BATCH = 512
 
 
 class _View(GUI.View):
@@ -23,6 +30,8 @@ class _View(GUI.View):
         self.ui_edit_only = GUI.create_line_edit(placeholder=".lua,.py,.js,...")
         self.ui_cb_convert = GUI.create_check_box(LangUI.lua_encoding_detection_convert_to_utf8)
         self.ui_cb_non_utf8 = GUI.create_check_box(LangUI.lua_encoding_detection_non_utf8_only)
+        self.ui_btn_export = GUI.create_push_btn(LangUI.lua_encoding_detection_export)
+        self.ui_btn_export.setEnabled(False)
         self.ui_tb_log = GUI.create_text_browser()
         self.ui_tb_log.setStyleSheet(StyleSheet.TextBrowser)
         self.ui_tb_log.setLineWrapMode(QTextEdit.NoWrap)
@@ -42,6 +51,7 @@ class _View(GUI.View):
             (
                 GUI.GridItem(self.ui_cb_convert, 1, 1),
                 GUI.GridItem(self.ui_cb_non_utf8, 2, 1),
+                GUI.GridItem(self.ui_btn_export, 3, 1),
             ),
             (
                 GUI.GridItem(self.ui_tb_log, 0, 4),
@@ -56,6 +66,10 @@ class EncodingDetectionView(_View):
 
         self.colors = [QColor('#ff6b81'), QColor('#6bddcd'), ]
         self.color_index: int = 0
+        self.detector: Optional[EncodingBatchDetector] = None
+        # results of the last run, in the order they came, what the log is drawn from and what is exported
+        self.results: List[EncodingResult] = []
+        self.convert = False
 
         self.setWindowTitle(LangUI.lua_encoding_detection_title)
         self.setMinimumSize(GUI.view_size())
@@ -69,10 +83,12 @@ class EncodingDetectionView(_View):
         self.ui_edit_choose.returnPressed.connect(self.on_detect)
         self.ui_edit_only.returnPressed.connect(self.on_detect)
         self.ui_act_choose.triggered.connect(self.on_choose_files)
-        self.ui_cb_non_utf8.toggled.connect(self.on_detect)
+        self.ui_cb_non_utf8.toggled.connect(self.render_all)
+        self.ui_btn_export.clicked.connect(self.on_export)
 
     def on_detect(self):
         self.ui_tb_log.clear()
+        self.results = []
         self.ui_tb_log.setFocus()
         self.start_detection(self.last_at())
 
@@ -85,11 +101,9 @@ class EncodingDetectionView(_View):
 
     def set_widgets_enabled(self, ok: bool):
         GUI.set_text_browser_selectable(self.ui_tb_log, ok)
-        widgets = [self.ui_edit_choose, self.ui_edit_only, self.ui_cb_convert, self.ui_cb_non_utf8]
+        widgets = [self.ui_edit_choose, self.ui_edit_only, self.ui_cb_convert]
         [w.setEnabled(ok) for w in widgets]
-
-    def set_next_color(self, color=None):
-        self.ui_tb_log.setTextColor(color if color is not None else self.next_color())
+        self.ui_btn_export.setEnabled(ok and len(self.results) > 0)
 
     def next_color(self):
         self.color_index += 1
@@ -98,59 +112,88 @@ class EncodingDetectionView(_View):
         return self.colors[self.color_index]
 
     def extensions(self):
-        extensions = self.ui_edit_only.text().split(',')
-        for i in range(len(extensions) - 1, -1, -1):
-            if len(extensions[i].strip()) <= 1:
-                extensions.pop(i)
-        return extensions
+        extensions = [ext.strip() for ext in self.ui_edit_only.text().split(',')]
+        return [ext for ext in extensions if len(ext) > 1]
+
+    def result_line(self, result: EncodingResult):
+        """The log line of `result` as html, None when it is filtered out."""
+        where = normpath(result.filepath)
+        if result.encoding is None:
+            return self.colored("[ {} ] {} {}".format('?', where, result.error), QColor(Qt.red))
+        if self.ui_cb_non_utf8.isChecked() and result.is_utf8:
+            return None
+        text = "[ {} ] {} ".format(result.encoding, where)
+        if self.convert:
+            text = text + (LangUI.lua_encoding_detection_convert_ok if result.ok else
+                           LangUI.lua_encoding_detection_convert_bad)
+        if result.is_utf8 is False or result.ok is False:
+            return self.colored(text, QColor(Qt.red))
+        return self.colored(text, self.next_color())
 
     @staticmethod
-    def meet_file_extensions(extensions: Cmm.Iterable[str], ext: str):
-        if len(extensions) == 0:
-            return True
-        return ext in extensions
-
-    def detect_one(self, where: str):
-        if self.ui_cb_convert.isChecked():
-            encoding, converted = Cmm.convert_file_encoding_to_utf8(where)
-            text = "[ {} ] {} ".format(encoding, normpath(where))
-            text = text + LangUI.lua_encoding_detection_convert_ok if converted else LangUI.lua_encoding_detection_convert_bad
-        else:
-            converted = True
-            encoding = Cmm.get_file_encoding(where)
-            text = "[ {} ] {} ".format(encoding, normpath(where))
-        output = True
-        is_utf8 = Cmm.is_utf8_encoding(encoding)
-        if self.ui_cb_non_utf8.isChecked():
-            output = not is_utf8
-        if output is True:
-            if is_utf8 is False or converted is False:
-                self.bad(text)
-            else:
-                self.ok(text)
-
-    def _detect_encoding(self, file_list: [str]):
-        file_list.reverse()
+    def colored(text: str, color: QColor):
+        return '<span style="color:{}">{}</span>'.format(color.name(), escape(text))
+
+    def render(self, results: List[EncodingResult]):
+        """Add the lines of `results` to the log as one block, and scroll once."""
+        lines = [line for line in map(self.result_line, results) if line is not None]
+        if lines:
+            self.ui_tb_log.append('<br>'.join(lines))
+            self.scrollToBottom()
+
+    def render_all(self):
+        self.ui_tb_log.clear()
+        for i in range(0, len(self.results), RENDER_BATCH):
+            self.render(self.results[i:i + RENDER_BATCH])
+
+    def _detect_encoding(self, file_list: Iterable[str]):
+        if self.detector is not None:
+            self.detector.shutdown(cancel=True)
+        self.convert = self.ui_cb_convert.isChecked()
+        detector = EncodingBatchDetector(store=EncodingStore().open())
+        detector.start(file_list, self.convert)
+        self.detector = detector
 
         def on_running():
-            if len(file_list) == 0:
-                self.set_widgets_enabled(True)
+            if self.detector is not detector:
                 runner.stop(tid)
                 return
-            where = file_list.pop()
-            self.detect_one(where)
+            results = detector.poll(limit=RENDER_BATCH)
+            self.results.extend(results)
+            self.render(results)
+            if detector.finished():
+                detector.shutdown()
+                self.detector = None
+                self.set_widgets_enabled(True)
+                cached = sum(1 for result in self.results if result.cached)
+                signals.logger_info.emit(LangUI.lua_encoding_detection_finished.format(
+                    detector.total(), detector.elapsed(), cached))
+                runner.stop(tid)
 
         runner = ThreadRunner()
         tid = runner.start(runner=on_running)
 
-    def ok(self, text: str):
-        self.set_next_color()
-        self.ui_tb_log.append(text)
-        self.scrollToBottom()
+    def on_export(self):
+        title = LangUI.lua_encoding_detection_export_title
+        start = join(self.last_at(), 'encoding-report.csv')
+        where = GUI.dialog_for_file_saving(self, title, start, 'CSV (*.csv);;JSON (*.json)')
+        if where is None:
+            return
+        try:
+            export_report(where, sorted(self.results, key=lambda r: r.filepath))
+        except OSError as e:
+            signals.logger_error.emit('{}: {}'.format(where, e))
+            return
+        signals.logger_info.emit(LangUI.lua_encoding_detection_exported.format(normpath(where)))
+
+    def closeEvent(self, event):
+        if self.detector is not None:
+            self.detector.shutdown(cancel=True)
+            self.detector = None
+        super(EncodingDetectionView, self).closeEvent(event)
 
     def bad(self, text: str):
-        self.set_next_color(Qt.red)
-        self.ui_tb_log.append(text)
+        self.ui_tb_log.append(self.colored(text, QColor(Qt.red)))
         self.scrollToBottom()
 
     def scrollToBottom(self):
@@ -161,24 +204,12 @@ class EncodingDetectionView(_View):
         if not exists(where):
             return
 
-        extensions = self.extensions()
-        file_list = []
-        if isdir(where):
-            for root, dirs, files in walk(where):
-                for file in files:
-                    filename = normpath(join(root, file))
-                    if Cmm.is_hiding_path(filename) is False:
-                        if self.meet_file_extensions(extensions, splitext(filename)[1]):
-                            file_list.append(filename)
-        elif isfile(where):
-            file_list.append(where)
-        else:
+        if not isdir(where) and not isfile(where):
             self.bad(LangUI.lua_encoding_detection_file_not_found.format(normpath(where)))
             return
 
-        if len(file_list) > 0:
-            self.set_widgets_enabled(False)
-            self._detect_encoding(file_list)
+        self.set_widgets_enabled(False)
+        self._detect_encoding(entry.path for entry in scan_files([where], self.extensions()))
 
     def on_choose_files(self):
         title = LangUI.lua_encoding_detection_folder_selection
@@ -0,0 +1,228 @@
+from concurrent.futures import Future, ProcessPoolExecutor
+from itertools import islice
+from os import cpu_count, stat
+from queue import Empty, SimpleQueue
+from threading import Lock, Thread
+from time import perf_counter
+from typing import Dict, Iterable, Iterator, List, Optional
+
+from milk.cmm import Cmm
+from .encoding_store import EncodingStore
+
+# below this many files the work is done in the submit thread, a process pool costs more to start
+INLINE_LIMIT = 32
+# files handed to a worker at once, most of them are small and read in one go
+BATCH_SIZE = 64
+
+
+class EncodingResult:
+    __slots__ = ('filepath', 'encoding', 'confidence', 'converted', 'error', 'size', 'mtime', 'cached')
+
+    def __init__(self, filepath: str, encoding: str = None, confidence: float = 0.0, converted: bool = False,
+                 error: str = None, size: int = None, mtime: int = None, cached: bool = False):
+        self.filepath = filepath
+        self.encoding = encoding
+        self.confidence = confidence
+        self.converted = converted
+        self.error = error
+        # of the file as it is after the detection, and converted when it was
+        self.size = size
+        self.mtime = mtime
+        self.cached = cached
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    @property
+    def is_utf8(self):
+        return Cmm.is_utf8_encoding(self.encoding)
+
+    def __getstate__(self):
+        return tuple(getattr(self, key) for key in self.__slots__)
+
+    def __setstate__(self, state):
+        for key, value in zip(self.__slots__, state):
+            setattr(self, key, value)
+
+
+def detect_one(filepath: str, convert: bool = False, dry_run: bool = False):
+    try:
+        info = stat(filepath)
+        encoding, confidence = Cmm.sniff_file_encoding(filepath)
+        converted = False
+        if convert and not Cmm.is_utf8_encoding(encoding):
+            encoding, error = Cmm.convert_file_encoding_to_utf8(filepath, encoding, dry_run)
+            if error is not None:
+                return EncodingResult(filepath, encoding, confidence,
+                                      error='cannot convert from {}: {}'.format(encoding, error),
+                                      size=info.st_size, mtime=info.st_mtime_ns)
+            converted = True
+            if not dry_run:
+                info = stat(filepath)
+        return EncodingResult(filepath, encoding, confidence, converted, size=info.st_size, mtime=info.st_mtime_ns)
+    except Exception as e:
+        return EncodingResult(filepath, error='{}: {}'.format(e.__class__.__name__, e))
+
+
+def detect_in_worker(files: List[str], convert: bool, dry_run: bool = False):
+    return [detect_one(filepath, convert, dry_run) for filepath in files]
+
+
+class EncodingBatchDetector:
+    """
+    Tell the encoding of many files with `Cmm.sniff_file_encoding`, and convert them to utf-8 on request,
+    `dry_run` only checks that they would convert.
+    Files go to a process pool in batches while more are still being listed, a few files are done
+    in the submit thread, results are collected by `poll` as they finish.
+    With an `EncodingStore`, files unchanged since they were stored are answered from it without being read,
+    unless they need converting, and what is detected is stored.
+    """
+
+    def __init__(self, max_workers: int = None, inline_limit: int = INLINE_LIMIT, store: EncodingStore = None):
+        self._max_workers = max_workers or cpu_count() or 1
+        self._inline_limit = inline_limit
+        self._store = store
+        self._dry_run = False
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._futures: Dict[Future, List[str]] = dict()
+        self._results: SimpleQueue = SimpleQueue()
+        self._lock = Lock()
+        self._total = 0
+        self._collected = 0
+        self._submitting = False
+        self._stopped = False
+        self._begin = 0.0
+
+    def start(self, files: Iterable[str], convert: bool = False, dry_run: bool = False):
+        """`files` may be any iterable, like paths from `scan_files`, the first are detected while it goes on."""
+        self._total = 0
+        self._collected = 0
+        self._submitting = True
+        self._dry_run = dry_run
+        self._begin = perf_counter()
+        Thread(target=self._submit, args=(files, convert, dry_run), daemon=True).start()
+
+    def _take(self, files: Iterator[str], count: int):
+        batch = list(islice(files, count))
+        with self._lock:
+            self._total += len(batch)
+        return batch
+
+    def _unchanged(self, batch: List[str], convert: bool):
+        """Answer the files of `batch` the store knows, and return the others."""
+        store = self._store
+        if store is None:
+            return batch
+        pending = []
+        for filepath in batch:
+            known, key = store.lookup(filepath)
+            if known is None or (convert and not Cmm.is_utf8_encoding(known[0])):
+                pending.append(filepath)
+                continue
+            encoding, confidence = known
+            self._results.put(EncodingResult(filepath, encoding, confidence, size=key[0], mtime=key[1], cached=True))
+        return pending
+
+    def _record(self, result: EncodingResult):
+        store = self._store
+        if store is None or result.error is not None or result.mtime is None:
+            return
+        if result.converted and not self._dry_run:
+            store.store(result.filepath, 'utf-8', 1.0, result.size, result.mtime)
+        else:
+            store.store(result.filepath, result.encoding, result.confidence, result.size, result.mtime)
+
+    def _submit(self, files: Iterable[str], convert: bool, dry_run: bool):
+        files = iter(files)
+        try:
+            # the store may answer most files, the pool only starts when more than a few are left to read
+            pending = []
+            batch = self._take(files, self._inline_limit + 1)
+            while batch and len(pending) <= self._inline_limit:
+                pending.extend(self._unchanged(batch, convert))
+                batch = self._take(files, BATCH_SIZE)
+            if not batch and len(pending) <= self._inline_limit:
+                for filepath in pending:
+                    if self._stopped:
+                        return
+                    result = detect_one(filepath, convert, dry_run)
+                    self._record(result)
+                    self._results.put(result)
+                return
+            while pending or batch:
+                while batch and len(pending) < BATCH_SIZE:
+                    pending.extend(self._unchanged(batch, convert))
+                    batch = self._take(files, BATCH_SIZE)
+                if not pending:
+                    break
+                chunk, pending = pending[:BATCH_SIZE], pending[BATCH_SIZE:]
+                with self._lock:
+                    if self._stopped:
+                        return
+                    if self._executor is None:
+                        self._executor = ProcessPoolExecutor(max_workers=self._max_workers)
+                    future = self._executor.submit(detect_in_worker, chunk, convert, dry_run)
+                    self._futures[future] = chunk
+                future.add_done_callback(self._on_done)
+        finally:
+            self._submitting = False
+
+    def _on_done(self, future: Future):
+        with self._lock:
+            batch = self._futures.pop(future, None)
+        if future.cancelled() or batch is None:
+            return
+        error = future.exception()
+        if error is not None:
+            error = '{}: {}'.format(error.__class__.__name__, error)
+            for filepath in batch:
+                self._results.put(EncodingResult(filepath, error=error))
+        else:
+            for result in future.result():
+                self._record(result)
+                self._results.put(result)
+
+    def poll(self, limit: int = 256, wait: bool = False):
+        results = []
+        while len(results) < limit:
+            try:
+                if wait and not results:
+                    results.append(self._results.get(timeout=0.1))
+                else:
+                    results.append(self._results.get_nowait())
+            except Empty:
+                break
+        self._collected += len(results)
+        return results
+
+    def run(self, files: Iterable[str], convert: bool = False, dry_run: bool = False):
+        """Detect all `files` and block until done, for headless use."""
+        self.start(files, convert, dry_run)
+        results = []
+        while not self.finished():
+            results.extend(self.poll(wait=True))
+        self.shutdown()
+        return results
+
+    def total(self):
+        return self._total
+
+    def collected(self):
+        return self._collected
+
+    def finished(self):
+        return not self._submitting and self._collected >= self._total
+
+    def elapsed(self):
+        return perf_counter() - self._begin
+
+    def shutdown(self, cancel: bool = False):
+        with self._lock:
+            self._stopped = True
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=not cancel, cancel_futures=cancel)
+        if self._store is not None:
+            self._store.close()
+            self._store = None
@@ -0,0 +1,123 @@
+import csv
+import json
+import sqlite3
+from os import makedirs, stat
+from os.path import dirname, join
+from threading import Lock
+from time import time
+from typing import Iterable, Optional, Tuple
+
+from milk.cmm import Cmm
+
+STORE_SCHEMA = 1
+STORE_MAX_ENTRIES = 500000
+# columns of an exported report, in order
+EXPORT_FIELDS = ('path', 'encoding', 'confidence', 'size', 'mtime', 'converted', 'cached', 'error')
+
+
+class EncodingStore:
+    """
+    Encoding and confidence of the files detected before, keyed by path and valid while the file keeps
+    the size and mtime it had then, in a sqlite file under the app cache dir.
+    Results the sniffing changes are dropped with a new `STORE_SCHEMA`, the least recently used entries
+    once there are more than `max_entries`.
+    """
+
+    def __init__(self, where: str = None, max_entries: int = STORE_MAX_ENTRIES):
+        self.where = where if where is not None else join(Cmm.app_cache_dir(), 'lua', 'encoding.db')
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def open(self):
+        makedirs(dirname(self.where), exist_ok=True)
+        self._conn = sqlite3.connect(self.where, check_same_thread=False)
+        self._conn.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS encodings ('
+                           'path TEXT PRIMARY KEY, encoding TEXT, confidence REAL, size INTEGER, mtime INTEGER, '
+                           'used REAL)')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS encodings_used ON encodings (used)')
+        row = self._conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+        if row is None or row[0] != str(STORE_SCHEMA):
+            self._conn.execute('DELETE FROM encodings')
+            self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('version', ?)", (str(STORE_SCHEMA),))
+        self._conn.commit()
+        return self
+
+    def lookup(self, filepath: str) -> Tuple[Optional[Tuple[str, float]], Optional[Tuple[int, int]]]:
+        """((encoding, confidence) when `filepath` is unchanged since it was stored, (size, mtime) it has now)."""
+        try:
+            info = stat(filepath)
+        except OSError:
+            return None, None
+        key = (info.st_size, info.st_mtime_ns)
+        with self._lock:
+            if self._conn is None:
+                return None, key
+            row = self._conn.execute('SELECT encoding, confidence, size, mtime FROM encodings WHERE path = ?',
+                                     (filepath,)).fetchone()
+            if row is not None and (row[2], row[3]) == key:
+                self._conn.execute('UPDATE encodings SET used = ? WHERE path = ?', (time(), filepath))
+                self.hits += 1
+                return (row[0], row[1]), key
+        self.misses += 1
+        return None, key
+
+    def store(self, filepath: str, encoding: str, confidence: float, size: int, mtime: int):
+        with self._lock:
+            if self._conn is None:
+                return
+            self._conn.execute('INSERT OR REPLACE INTO encodings (path, encoding, confidence, size, mtime, used) '
+                               'VALUES (?, ?, ?, ?, ?, ?)', (filepath, encoding, confidence, size, mtime, time()))
+
+    def forget(self, paths: Iterable[str]):
+        with self._lock:
+            if self._conn is None:
+                return
+            self._conn.executemany('DELETE FROM encodings WHERE path = ?', ((path,) for path in paths))
+
+    def evict(self):
+        with self._lock:
+            count = self._conn.execute('SELECT COUNT(*) FROM encodings').fetchone()[0]
+            if count > self.max_entries:
+                self._conn.execute('DELETE FROM encodings WHERE rowid IN '
+                                   '(SELECT rowid FROM encodings ORDER BY used ASC LIMIT ?)',
+                                   (count - self.max_entries,))
+
+    def close(self):
+        if self._conn is not None:
+            self.evict()
+            with self._lock:
+                self._conn.commit()
+                self._conn.close()
+                self._conn = None
+
+
+def report_rows(results: Iterable):
+    for result in results:
+        yield {
+            'path': result.filepath,
+            'encoding': result.encoding,
+            'confidence': round(result.confidence, 4),
+            'size': result.size,
+            'mtime': result.mtime,
+            'converted': result.converted,
+            'cached': result.cached,
+            'error': result.error,
+        }
+
+
+def export_report(where: str, results: Iterable):
+    """Write `EncodingResult`s to `where`, as JSON when it ends with `.json` and as CSV otherwise."""
+    rows = report_rows(results)
+    if where.lower().endswith('.json'):
+        with open(where, 'w', encoding='utf-8') as f:
+            json.dump(list(rows), f, ensure_ascii=False, indent=2)
+        return
+    # utf-8-sig, so Excel opens non-ascii paths as they are
+    with open(where, 'w', encoding='utf-8-sig', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=EXPORT_FIELDS)
+        writer.writeheader()
+        writer.writerows(rows)
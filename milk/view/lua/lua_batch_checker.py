@@ -0,0 +1,115 @@
+from concurrent.futures import Future, ProcessPoolExecutor
+from os import cpu_count
+from queue import Empty, SimpleQueue
+from threading import Lock, Thread
+from typing import Dict, List, Optional
+
+from .lua_result_cache import FileKey, LuaResultCache
+from .lua_syntax_checker import LuaSyntaxChecker, NESTED_LIMIT_LEVEL, NestedResult
+
+
+def check_nested_in_worker(filepath: str, limit_level: int, packrat: bool = False):
+    return LuaSyntaxChecker.check_nested_result(filepath, limit_level, packrat)
+
+
+class LuaBatchChecker:
+    """
+    Fan `LuaSyntaxChecker.check_nested` out to a process pool, results are collected by `poll` as they finish.
+    With a `LuaResultCache`, unchanged files are answered from the cache and never reach the pool.
+    `packrat` parses in packrat mode, see `LuaSyntaxChecker.check_nested_result`.
+    """
+
+    def __init__(self, max_workers: int = None, cache: LuaResultCache = None, packrat: bool = False):
+        self._max_workers = max_workers or cpu_count() or 1
+        self._cache = cache
+        self._packrat = packrat
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._futures: Dict[Future, (str, Optional[FileKey])] = dict()
+        self._results: SimpleQueue = SimpleQueue()
+        self._lock = Lock()
+        self._total = 0
+        self._collected = 0
+        self._stopped = False
+
+    def start(self, files: List[str], limit_level: int = NESTED_LIMIT_LEVEL):
+        self._total = len(files)
+        self._collected = 0
+        if self._total == 0:
+            return
+        Thread(target=self._submit, args=(files, limit_level), daemon=True).start()
+
+    def _submit(self, files: List[str], limit_level: int):
+        for where in files:
+            try:
+                if not self._submit_one(where, limit_level):
+                    return
+            except Exception as e:
+                # a file that never reaches the pool is still reported, or `finished` would never be true
+                self._results.put(NestedResult(where, False, error='{}: {}'.format(e.__class__.__name__, e)))
+
+    def _submit_one(self, where: str, limit_level: int):
+        """Answer `where` from the cache or hand it to the pool, False once shut down."""
+        with self._lock:
+            if self._stopped:
+                return False
+            cache = self._cache
+        key = None
+        if cache is not None:
+            result, key = cache.lookup(where)
+            if result is not None:
+                self._results.put(result)
+                return True
+        with self._lock:
+            if self._stopped:
+                return False
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=min(self._max_workers, self._total))
+            future = self._executor.submit(check_nested_in_worker, where, limit_level, self._packrat)
+            self._futures[future] = (where, key)
+        future.add_done_callback(self._on_done)
+        return True
+
+    def _on_done(self, future: Future):
+        with self._lock:
+            where, key = self._futures.pop(future, (None, None))
+            cache = self._cache
+        if future.cancelled():
+            return
+        error = future.exception()
+        if error is not None:
+            self._results.put(NestedResult(where, False, error='{}: {}'.format(error.__class__.__name__, error)))
+        else:
+            result = future.result()
+            if cache is not None:
+                cache.store(where, key, result)
+            self._results.put(result)
+
+    def poll(self, limit: int = 64, wait: bool = False):
+        results = []
+        while len(results) < limit:
+            try:
+                if wait and not results:
+                    results.append(self._results.get(timeout=0.1))
+                else:
+                    results.append(self._results.get_nowait())
+            except Empty:
+                break
+        self._collected += len(results)
+        return results
+
+    def total(self):
+        return self._total
+
+    def finished(self):
+        return self._collected >= self._total
+
+    def shutdown(self, cancel: bool = False):
+        with self._lock:
+            self._stopped = True
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=not cancel, cancel_futures=cancel)
+        with self._lock:
+            cache, self._cache = self._cache, None
+        if cache is not None:
+            cache.close()
@@ -0,0 +1,299 @@
+import json
+from concurrent.futures import Future, ProcessPoolExecutor
+from os import cpu_count, makedirs
+from os.path import abspath, dirname, join
+from queue import Empty, SimpleQueue
+from threading import Lock, Thread
+from time import perf_counter
+from typing import Dict, List, Optional
+
+from milk.cmm import Cmm
+from .lua_parser import LEXER_FAST
+from .lua_result_cache import FileKey
+from .lua_token_minifier import LuaTokenMinifier, MINIFIER_VERSION
+
+MANIFEST_SCHEMA = 1
+# below this many changed files the work is done in the submit thread, a process pool costs more to start
+INLINE_LIMIT = 8
+
+
+class MinifyOptions:
+    def __init__(self, replace: bool = True, keep_comments: bool = False, wrap_table: bool = False,
+                 token_mode: bool = False, check_syntax: bool = False):
+        self.replace = replace
+        self.keep_comments = keep_comments
+        self.wrap_table = wrap_table
+        self.token_mode = token_mode
+        # token mode only: also run the full parser before writing
+        self.check_syntax = check_syntax
+
+    def key(self):
+        if self.token_mode:
+            return 'token{}:comments={:d},check={:d}'.format(MINIFIER_VERSION, self.keep_comments, self.check_syntax)
+        return 'ast:comments={:d},wrap={:d}'.format(self.keep_comments, self.wrap_table)
+
+    def target_of(self, source: str):
+        return source if self.replace else source + '.min'
+
+
+class MinifyResult:
+    def __init__(self, source: str, target: str, ok: bool, skipped: bool = False, error: str = None,
+                 output: Optional[FileKey] = None):
+        self.source = source
+        self.target = target
+        self.ok = ok
+        self.skipped = skipped
+        self.error = error
+        self.output = output
+
+
+def minify_one(source: str, options: MinifyOptions):
+    target = options.target_of(source)
+    try:
+        encoding = Cmm.get_file_encoding(source)
+        if options.token_mode:
+            minifier = LuaTokenMinifier(keep_comments=options.keep_comments, check_syntax=options.check_syntax)
+            minifier.minify_file(source, target, encoding)
+        else:
+            from .lua_source_interpreter import LuaRestoreTree, LuaSourceInterpreter
+            # the tree is only read once, so it can share tokens and comment lists
+            root = LuaRestoreTree(source).root(LEXER_FAST, compact=True)
+            interpreter = LuaSourceInterpreter(bracket_table_field=options.wrap_table,
+                                               with_comments=options.keep_comments)
+            interpreter.interpret(root)
+            Cmm.save_file_content_atomic(target, interpreter.content())
+        output = FileKey.of(target)
+        output.ensure_digest(target)
+        return MinifyResult(source, target, True, output=output)
+    except Exception as e:
+        return MinifyResult(source, target, False, error='{}: {}'.format(e.__class__.__name__, e))
+
+
+def _entry_of(key: FileKey):
+    return {'size': key.size, 'mtime': key.mtime, 'digest': key.digest}
+
+
+class MinifyManifest:
+    """
+    What was minified last time: per source its content (size, mtime, digest), the output written and the options.
+    A source is only minified again when its content, its options or its output changed.
+    """
+
+    def __init__(self, where: str = None):
+        self.where = where if where is not None else join(Cmm.app_cache_dir(), 'lua', 'minify.json')
+        self._entries: Dict[str, dict] = dict()
+        self._lock = Lock()
+        self._dirty = False
+
+    def load(self):
+        try:
+            with open(self.where, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('schema') == MANIFEST_SCHEMA:
+                self._entries = data.get('files', dict())
+        except (OSError, ValueError):
+            self._entries = dict()
+        return self
+
+    @staticmethod
+    def _same(entry: dict, filepath: str):
+        try:
+            key = FileKey.of(filepath)
+        except OSError:
+            return False
+        if key.size != entry['size']:
+            return False
+        if key.mtime == entry['mtime']:
+            return True
+        if key.ensure_digest(filepath) == entry['digest']:
+            # touched but not changed, remember the new mtime so the digest is not needed next time
+            entry['mtime'] = key.mtime
+            return True
+        return False
+
+    def is_fresh(self, source: str, options: MinifyOptions):
+        source = abspath(source)
+        with self._lock:
+            entry = self._entries.get(source)
+            if entry is None or entry['options'] != options.key():
+                return False
+            if entry['target'] != abspath(options.target_of(source)):
+                return False
+            return self._same(entry['source'], source) and self._same(entry['output'], entry['target'])
+
+    def record(self, result: MinifyResult, options: MinifyOptions):
+        source = abspath(result.source)
+        with self._lock:
+            self._dirty = True
+            if not result.ok:
+                self._entries.pop(source, None)
+                return
+            if abspath(result.target) == source:
+                # replaced in place, what is there now is the output
+                source_key = result.output
+            else:
+                source_key = FileKey.of(source)
+                source_key.ensure_digest(source)
+            self._entries[source] = {
+                'options': options.key(),
+                'target': abspath(result.target),
+                'source': _entry_of(source_key),
+                'output': _entry_of(result.output),
+            }
+
+    def save(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            makedirs(dirname(self.where), exist_ok=True)
+            Cmm.save_file_content_atomic(self.where, json.dumps({'schema': MANIFEST_SCHEMA, 'files': self._entries}))
+            self._dirty = False
+
+
+class LuaBatchMinifier:
+    """
+    Minify many Lua files: unchanged ones are skipped by the manifest, a handful of changed ones are done inline,
+    more are fanned out to a process pool. Results are collected by `poll` as they finish.
+    """
+
+    def __init__(self, options: MinifyOptions, manifest: MinifyManifest = None, max_workers: int = None,
+                 inline_limit: int = INLINE_LIMIT):
+        self.options = options
+        self._manifest = manifest
+        self._max_workers = max_workers or cpu_count() or 1
+        self._inline_limit = inline_limit
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._futures: Dict[Future, str] = dict()
+        self._results: SimpleQueue = SimpleQueue()
+        self._lock = Lock()
+        self._total = 0
+        self._collected = 0
+        self._stopped = False
+        self._begin = 0.0
+
+    def start(self, files: List[str]):
+        self._total = len(files)
+        self._collected = 0
+        self._begin = perf_counter()
+        if self._total == 0:
+            return
+        Thread(target=self._submit, args=(files,), daemon=True).start()
+
+    def _submit(self, files: List[str]):
+        stale = []
+        for where in files:
+            try:
+                with self._lock:
+                    if self._stopped:
+                        return
+                    manifest = self._manifest
+                if manifest is not None and manifest.is_fresh(where, self.options):
+                    self._results.put(MinifyResult(where, self.options.target_of(where), True, skipped=True))
+                else:
+                    stale.append(where)
+            except Exception as e:
+                self._on_error(where, e)
+
+        # a handful of files are done inline, the pool costs more than it saves
+        workers = 0 if len(stale) <= self._inline_limit else min(self._max_workers, len(stale))
+        for where in stale:
+            try:
+                if not self._submit_one(where, workers):
+                    return
+            except Exception as e:
+                self._on_error(where, e)
+
+    def _submit_one(self, where: str, workers: int):
+        """Minify `where` inline, or hand it to a pool of `workers` when there are any, False once shut down."""
+        with self._lock:
+            if self._stopped:
+                return False
+            if workers > 0:
+                if self._executor is None:
+                    self._executor = ProcessPoolExecutor(max_workers=workers)
+                future = self._executor.submit(minify_one, where, self.options)
+                self._futures[future] = where
+        if workers > 0:
+            future.add_done_callback(self._on_done)
+        else:
+            self._on_result(minify_one(where, self.options))
+        return True
+
+    def _on_error(self, where: str, error: Exception):
+        # a file that never reaches `minify_one` is still reported, or `finished` would never be true
+        self._results.put(MinifyResult(where, self.options.target_of(where), False,
+                                       error='{}: {}'.format(error.__class__.__name__, error)))
+
+    def _on_done(self, future: Future):
+        with self._lock:
+            where = self._futures.pop(future, None)
+        if future.cancelled():
+            return
+        error = future.exception()
+        if error is not None:
+            self._on_result(MinifyResult(where, self.options.target_of(where), False, error=str(error)))
+        else:
+            self._on_result(future.result())
+
+    def _on_result(self, result: MinifyResult):
+        try:
+            if self._manifest is not None:
+                self._manifest.record(result, self.options)
+        except OSError:
+            # the source is gone since, it is minified again next time
+            pass
+        self._results.put(result)
+
+    def poll(self, limit: int = 64, wait: bool = False):
+        results = []
+        while len(results) < limit:
+            try:
+                if wait and not results:
+                    results.append(self._results.get(timeout=0.1))
+                else:
+                    results.append(self._results.get_nowait())
+            except Empty:
+                break
+        self._collected += len(results)
+        return results
+
+    def run(self, files: List[str]):
+        """Minify all `files` and block until done, for headless use."""
+        self.start(files)
+        results = []
+        while not self.finished():
+            results.extend(self.poll(wait=True))
+        self.shutdown()
+        return results
+
+    def total(self):
+        return self._total
+
+    def finished(self):
+        return self._collected >= self._total
+
+    def elapsed(self):
+        return perf_counter() - self._begin
+
+    def shutdown(self, cancel: bool = False):
+        with self._lock:
+            self._stopped = True
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=not cancel, cancel_futures=cancel)
+        if self._manifest is not None:
+            self._manifest.save()
+
+
+if __name__ == '__main__':
+    import sys
+    from os import walk
+
+    at = sys.argv[1]
+    lua_files = [join(r, f) for r, _, fs in walk(at) for f in fs if f.endswith('.lua')]
+    manifest_at = join(at, '.minify.json')
+    for run in range(2):
+        minifier = LuaBatchMinifier(MinifyOptions(replace=False, token_mode=True), MinifyManifest(manifest_at).load())
+        done = minifier.run(lua_files)
+        print('run {}: {} files, {} skipped, {} failed, {:.3f}s'.format(
+            run, len(done), sum(r.skipped for r in done), sum(not r.ok for r in done), minifier.elapsed()))
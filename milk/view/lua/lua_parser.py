@@ -0,0 +1,13 @@
+from luaparser import ast
+from luaparser.astnodes import Chunk
+
+LEXER_ANTLR = 'antlr'
+LEXER_FAST = 'fast'
+
+
+def parse(source: str, lexer: str = LEXER_ANTLR, packrat: bool = False, compact: bool = False) -> Chunk:
+    """
+    Parse Lua source to a Chunk with `luaparser.ast.parse`. The lexer, the packrat mode and the compact mode
+    are `luaparser.builder.Builder`'s.
+    """
+    return ast.parse(source, lexer, compact, packrat)
@@ -0,0 +1,163 @@
+import pickle
+import sqlite3
+from functools import lru_cache
+from hashlib import blake2b
+from os import makedirs, stat, walk
+from os.path import dirname, join, relpath
+from threading import Lock
+from time import time
+from typing import Optional, Tuple
+
+from milk.cmm import Cmm
+
+# bumped whenever cached results change shape, e.g. NestedResult gaining `error`
+CACHE_SCHEMA = 2
+CACHE_MAX_ENTRIES = 100000
+CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+
+@lru_cache(maxsize=None)
+def luaparser_version():
+    """
+    Version of the luaparser actually imported, with a digest of its sources: the app runs the modified copy
+    under thirds/py-lua-parser, whose version number says nothing about the local changes.
+    """
+    import luaparser
+    h = blake2b(digest_size=8)
+    root = dirname(luaparser.__file__)
+    for parent, dirs, files in walk(root):
+        dirs[:] = sorted(d for d in dirs if d != 'tests' and not d.startswith('__'))
+        for name in sorted(files):
+            if name.endswith('.py'):
+                h.update(relpath(join(parent, name), root).encode('utf-8'))
+                with open(join(parent, name), 'rb') as f:
+                    h.update(f.read())
+    return '{}+{}'.format(getattr(luaparser, '__version__', 'unknown'), h.hexdigest())
+
+
+def file_digest(filepath: str):
+    h = blake2b(digest_size=16)
+    with open(filepath, 'rb') as f:
+        while True:
+            chunk = f.read(1 << 20)
+            if not chunk:
+                break
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class FileKey:
+    def __init__(self, size: int, mtime: int, digest: Optional[str] = None):
+        self.size = size
+        self.mtime = mtime
+        self.digest = digest
+
+    @staticmethod
+    def of(filepath: str):
+        st = stat(filepath)
+        return FileKey(st.st_size, st.st_mtime_ns)
+
+    def ensure_digest(self, filepath: str):
+        if self.digest is None:
+            self.digest = file_digest(filepath)
+        return self.digest
+
+
+class LuaResultCache:
+    """
+    On-disk cache of `LuaSyntaxChecker.check_nested_result` outcomes.
+
+    Entries are keyed by path and validated by size + mtime first, the content digest is only computed
+    when those differ. `options` tells apart results of different settings, parser backend included.
+    The whole cache is dropped when the schema or the luaparser sources change, and the least recently used entries are evicted once it grows beyond the entry/byte limits.
+    """
+
+    def __init__(self, where: str = None, options: str = '',
+                 max_entries: int = CACHE_MAX_ENTRIES, max_bytes: int = CACHE_MAX_BYTES):
+        self.where = where if where is not None else join(Cmm.app_cache_dir(), 'lua', 'syntax.db')
+        self.options = options
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def open(self):
+        makedirs(dirname(self.where), exist_ok=True)
+        self._conn = sqlite3.connect(self.where, check_same_thread=False)
+        self._conn.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS results ('
+                           'path TEXT, options TEXT, size INTEGER, mtime INTEGER, digest TEXT, '
+                           'used REAL, result BLOB, PRIMARY KEY (path, options))')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS results_used ON results (used)')
+        version = '{}:{}'.format(CACHE_SCHEMA, luaparser_version())
+        row = self._conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+        if row is None or row[0] != version:
+            self._conn.execute('DELETE FROM results')
+            self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('version', ?)", (version,))
+        self._conn.commit()
+        return self
+
+    def lookup(self, filepath: str) -> Tuple[Optional[object], Optional[FileKey]]:
+        try:
+            key = FileKey.of(filepath)
+        except OSError:
+            return None, None
+
+        with self._lock:
+            if self._conn is None:
+                return None, key
+            row = self._conn.execute('SELECT size, mtime, digest, result FROM results WHERE path = ? AND options = ?',
+                                     (filepath, self.options)).fetchone()
+        if row is not None:
+            size, mtime, digest, result = row
+            hit = size == key.size and mtime == key.mtime
+            if not hit and size == key.size:
+                hit = key.ensure_digest(filepath) == digest
+            if hit:
+                key.digest = digest
+                with self._lock:
+                    if self._conn is None:
+                        return None, key
+                    self._conn.execute('UPDATE results SET mtime = ?, used = ? WHERE path = ? AND options = ?',
+                                       (key.mtime, time(), filepath, self.options))
+                self.hits += 1
+                return pickle.loads(result), key
+        self.misses += 1
+        return None, key
+
+    def store(self, filepath: str, key: Optional[FileKey], result):
+        if key is None:
+            return
+        try:
+            key.ensure_digest(filepath)
+        except OSError:
+            return
+        with self._lock:
+            if self._conn is None:
+                return
+            self._conn.execute('INSERT OR REPLACE INTO results (path, options, size, mtime, digest, used, result) '
+                               'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                               (filepath, self.options, key.size, key.mtime, key.digest, time(),
+                                pickle.dumps(result, pickle.HIGHEST_PROTOCOL)))
+
+    def evict(self):
+        with self._lock:
+            count, total = self._conn.execute('SELECT COUNT(*), COALESCE(SUM(LENGTH(result)), 0) FROM results').fetchone()
+            if count <= self.max_entries and total <= self.max_bytes:
+                return
+            drop = max(count - self.max_entries, 0)
+            if total > self.max_bytes:
+                # evict proportionally down to 3/4 of the byte limit, least recently used first
+                drop = max(drop, count - int(count * self.max_bytes * 0.75 / total))
+            self._conn.execute('DELETE FROM results WHERE rowid IN '
+                               '(SELECT rowid FROM results ORDER BY used ASC LIMIT ?)', (drop,))
+
+    def close(self):
+        if self._conn is not None:
+            self.evict()
+            with self._lock:
+                self._conn.commit()
+                self._conn.close()
+                self._conn = None
@@ -3,7 +3,9 @@ from typing import Union
 from luaparser.ast import *
 from luaparser.astnodes import *
 
-from cmm import Cmm
+from milk.cmm import Cmm
+from .lua_parser import LEXER_ANTLR, parse as parse_lua
+from .lua_visitor import LuaTreeVisitor
 
 
 class LuaSourceWriter:
@@ -104,9 +106,6 @@ class LuaSourceInterpreter:
                     prefix = '\n' + '\t' * (self._writer.current_index() + 1)
                     self._writer.append_value(prefix)
 
-                fmt = '【head】\n    kind    = {}\n    last    = {}\n    prefix  = {}\n    comment = {}'
-                print(fmt.format(kind, repr(last), repr(prefix), [c.s for c in node.comments]))
-
                 self._writer.append_value(prefix.join([c.s for c in node.comments]))
                 if kind == 1:
                     self._writer.cal_indent(-1)
@@ -130,9 +129,6 @@ class LuaSourceInterpreter:
                     prefix = '\n' + '\t' * self._writer.current_index()
                     self._writer.append_value(prefix)
 
-                fmt = '【tail】\n    kind    = {}\n    last    = {}\n    prefix  = {}\n    comment = {}'
-                print(fmt.format(kind, repr(last), repr(prefix), [c.s for c in node.tail_comments]))
-
                 self._writer.append_value(prefix.join([c.s for c in node.tail_comments]))
                 if kind == 1:
                     self._writer.cal_indent(-1)
@@ -546,8 +542,8 @@ class LuaRestoreTree:
         with open(self.file_at, 'r', encoding=self._encoding()) as fp:
             return fp.read()
 
-    def root(self):
-        return parse(self._content())
+    def root(self, lexer: str = LEXER_ANTLR, compact: bool = False):
+        return parse_lua(self._content(), lexer, compact=compact)
 
     def parse(self):
         root = self.root()
@@ -566,7 +562,7 @@ class LuaRestoreTree:
             def to_list(self):
                 return self.head + self.tail
 
-        class Visitor(ASTRecursiveVisitor):
+        class Visitor(LuaTreeVisitor):
             def __init__(self):
                 self.current_id = None
                 self.all_block_comments = {}
@@ -611,7 +607,7 @@ class LuaSourceExtractor(LuaRestoreTree):
             def data(self):
                 return self.name, str(self.line), self.content,
 
-        class ElementVisitor(ASTRecursiveVisitor):
+        class ElementVisitor(LuaTreeVisitor):
             def __init__(self):
                 super(ElementVisitor, self).__init__()
                 self._functions: List[Element] = []
@@ -1,10 +1,19 @@
 from typing import List, Optional
 
-from luaparser.ast import ASTRecursiveVisitor, parse, SyntaxException, to_lua_source
+from luaparser.ast import SyntaxException, to_lua_source
 from luaparser.astnodes import Block
 
 from milk.cmm import Cmm
-from milk.conf import LangUI
+from .lua_parser import LEXER_FAST, parse
+from .lua_visitor import LuaTreeVisitor
+
+NESTED_LIMIT_LEVEL = 5
+NESTED_LEVEL_TITLE = '-- nested level: {}\n'
+
+
+def nested_cache_options(limit_level: int = NESTED_LIMIT_LEVEL, packrat: bool = False):
+    """`LuaResultCache` options of `check_nested_result` outcomes, with the parser backend they come from."""
+    return 'nested:{}:lexer={},compact=1,packrat={:d}'.format(limit_level, LEXER_FAST, packrat)
 
 
 def block_statements(node: Block):
@@ -23,11 +32,43 @@ class WrapBlock:
             d.setdefault("parent", id(self.parent))
         return d
 
-    def source(self):
-        return [LangUI.lua_grammar_nested_level.format(self.level), to_lua_source(self.node), '\n']
+    def source(self, title: str = NESTED_LEVEL_TITLE):
+        return [title.format(self.level), to_lua_source(self.node), '\n']
+
+
+class NestedBlock:
+    """A picklable snapshot of a block, safe to send back from a worker process."""
+
+    def __init__(self, level: int, line: Optional[int], start_char: Optional[int], stop_char: Optional[int],
+                 text: str):
+        self.level = level
+        self.line = line
+        self.start_char = start_char
+        self.stop_char = stop_char
+        self.text = text
+
+    @staticmethod
+    def from_wrap_block(block: WrapBlock):
+        node = block.node
+        return NestedBlock(block.level, node.line, node.start_char, node.stop_char, to_lua_source(node))
+
+    def source(self, title: str = NESTED_LEVEL_TITLE):
+        return [title.format(self.level), self.text, '\n']
 
 
-class NestedVisitor(ASTRecursiveVisitor):
+class NestedResult:
+    """Outcome of `LuaSyntaxChecker.check_nested_result`, the blocks only keep those beyond the limit level."""
+
+    def __init__(self, filepath: str, ok: bool, max_level: int = 0, blocks: List[NestedBlock] = None,
+                 error: str = None):
+        self.filepath = filepath
+        self.ok = ok
+        self.max_level = max_level
+        self.blocks = blocks if blocks is not None else []
+        self.error = error
+
+
+class NestedVisitor(LuaTreeVisitor):
 
     def __init__(self, max_nested: int = 5):
         super(NestedVisitor, self).__init__()
@@ -76,7 +117,7 @@ class LuaSyntaxChecker:
     @staticmethod
     def check_by_source(src: str):
         try:
-            tree = parse(src)
+            tree = parse(src, LEXER_FAST, compact=True)
             return True, tree
         except (SyntaxException, Exception) as e:
             print({"msg": str(e), "type": e.__class__.__name__})
@@ -104,3 +145,24 @@ class LuaSyntaxChecker:
         except (SyntaxException, UnicodeDecodeError, Exception) as e:
             print(e)
             return False, None
+
+    @staticmethod
+    def check_nested_result(filepath: str, limit_level: int = NESTED_LIMIT_LEVEL, packrat: bool = False):
+        """
+        `packrat` memoizes the rules the parser backtracks over: it pays off on calls nested in the arguments
+        of calls, like `f(function() g(function() ... end) end)`, and costs a little on everything else.
+        """
+        # errors are returned with the result instead of printed, this also runs in workers and headless
+        try:
+            encoding = Cmm.get_file_encoding(filepath)
+            with open(filepath, 'r', encoding=encoding) as f:
+                tree = parse(f.read(), LEXER_FAST, packrat=packrat, compact=True)
+            visitor = NestedVisitor()
+            visitor.visit(tree)
+        except (OSError, SyntaxException, UnicodeDecodeError, Exception) as e:
+            return NestedResult(filepath, False, error='{}: {}'.format(e.__class__.__name__, e))
+        block_in_levels = visitor.block_in_levels
+        blocks = []
+        for block_list in reversed(block_in_levels[limit_level + 1:]):
+            blocks.extend([NestedBlock.from_wrap_block(block) for block in block_list])
+        return NestedResult(filepath, True, len(block_in_levels) - 1, blocks)
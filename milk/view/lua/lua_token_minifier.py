@@ -0,0 +1,297 @@
+import re
+from os import close, remove, replace
+from os.path import abspath, dirname
+from tempfile import mkstemp
+from typing import Iterator, TextIO, Tuple
+
+from luaparser.builder import SyntaxException
+from luaparser.fastlexer import SCANNER
+
+from .lua_parser import LEXER_FAST, parse
+
+CHUNK_SIZE = 1 << 20
+# bumped whenever the same source minifies to something else, outputs of an older version are redone
+MINIFIER_VERSION = 2
+
+# an opening long bracket, which only lexes as a long string/comment once its closing bracket has been read
+_LONG_OPEN = re.compile(r'(?:--)?\[=*\[')
+
+_LINE_BREAKS = ('NEWLINE', 'COMMENT', 'STRING')
+
+# what Lua's own lexer still reads into a numeral, `1then` is a malformed number to luac, not `1` and `then`
+_NUMERAL_TAIL = re.compile(r'[A-Za-z0-9_.]')
+
+# text that has to follow a token before it is taken as complete, `0x`, `1e` or `[==` may still grow
+_LOOKAHEAD = 256
+
+
+# what closes each opener, `for` and `while` become a `do` block once their `do` was read
+_CLOSERS = {'(': ')', '[': ']', '{': '}', 'function': 'end', 'if': 'end', 'do': 'end', 'repeat': 'until'}
+_LOOPS = ('for', 'while')
+
+
+class LuaMinifyError(Exception):
+    pass
+
+
+class BlockBalance:
+    """
+    Brackets and block keywords of the token stream, in constant time per token: unclosed or stray brackets,
+    `end` and `until` are caught without parsing, statements like `x = = 1` are not, see `LuaTokenMinifier.check`.
+    """
+
+    def __init__(self):
+        self.openers = []
+
+    def feed(self, kind: str, text: str, line: int):
+        if kind == 'OP':
+            if text in '([{':
+                self.openers.append((text, line))
+            elif text in ')]}':
+                self._close(text, line)
+        elif kind == 'NAME':
+            if text == 'do' and self.openers and self.openers[-1][0] in _LOOPS:
+                self.openers[-1] = ('do', self.openers[-1][1])
+            elif text in _CLOSERS or text in _LOOPS:
+                self.openers.append((text, line))
+            elif text == 'end' or text == 'until':
+                self._close(text, line)
+            elif text in ('then', 'else', 'elseif') and (not self.openers or self.openers[-1][0] != 'if'):
+                raise LuaMinifyError('line {}: {!r} outside of an if statement'.format(line, text))
+
+    def _close(self, text: str, line: int):
+        if not self.openers:
+            raise LuaMinifyError('line {}: unexpected {!r}'.format(line, text))
+        opener, at = self.openers.pop()
+        if _CLOSERS.get(opener) != text:
+            raise LuaMinifyError('line {}: {!r} expected to close {!r} of line {}, got {!r}'.format(
+                line, _CLOSERS.get(opener, 'do'), opener, at, text))
+
+    def finish(self):
+        if self.openers:
+            opener, at = self.openers[-1]
+            raise LuaMinifyError('line {}: {!r} is not closed'.format(at, opener))
+
+
+def scan_chunks(reader: TextIO, chunk_size: int = CHUNK_SIZE) -> Iterator[Tuple[str, str]]:
+    """
+    Scan Lua source read from `reader` into (kind, text) pairs, kinds being the group names of `SCANNER`.
+    At most about two chunks are held at a time, a token is only cut out once enough text after it has been read,
+    tokens longer than a chunk grow the buffer until they are complete.
+    """
+    buffer = ''
+    pos = 0
+    eof = False
+    while True:
+        if not eof and len(buffer) - pos < chunk_size:
+            chunk = reader.read(chunk_size)
+            if chunk:
+                buffer = buffer[pos:] + chunk
+                pos = 0
+            else:
+                eof = True
+        if pos >= len(buffer):
+            return
+
+        m = SCANNER.match(buffer, pos)
+        kind = m.lastgroup
+        if not eof:
+            incomplete = len(buffer) - m.end() < _LOOKAHEAD or kind == 'ERROR'
+            if not incomplete and kind in ('LINE_COMMENT', 'OP'):
+                incomplete = _LONG_OPEN.match(buffer, pos) is not None
+            if incomplete:
+                chunk = reader.read(chunk_size)
+                if chunk:
+                    buffer = buffer[pos:] + chunk
+                    pos = 0
+                else:
+                    eof = True
+                continue
+
+        yield kind, m.group()
+        pos = m.end()
+
+
+def needs_space(left: str, right: str):
+    """Whether the two tokens would lex differently once written next to each other, by `SCANNER` or by luac."""
+    m = SCANNER.match(left + right)
+    if m.end() != len(left) or m.lastgroup == 'ERROR':
+        return True
+    return m.lastgroup == 'NUMBER' and _NUMERAL_TAIL.match(right) is not None
+
+
+class LuaTokenMinifier:
+    """
+    Minify Lua source on the token stream, without building an AST: spaces, line breaks and (optionally) comments
+    are dropped, and a single separator is only written where the adjacent tokens would otherwise merge.
+
+    The separator is a line break if the original gap had one, which also keeps a line break before `(`,
+    where dropping it could turn two statements into a call.
+
+    Unbalanced brackets and blocks are rejected while the tokens stream by, see `BlockBalance`. With `check_syntax`,
+    `minify_file` also parses the whole source first and rejects what the AST minifier would, at the cost of
+    memory growing with the file and about the time of the AST minifier.
+    """
+
+    def __init__(self, keep_comments: bool = False, chunk_size: int = CHUNK_SIZE, check_syntax: bool = False):
+        self.keep_comments = keep_comments
+        self.chunk_size = chunk_size
+        self.check_syntax = check_syntax
+
+    @staticmethod
+    def check(content: str):
+        """Raise `LuaMinifyError` unless `content` parses."""
+        try:
+            parse(content, LEXER_FAST, compact=True)
+        except SyntaxException as e:
+            raise LuaMinifyError(str(e)) from e
+
+    def minify(self, reader: TextIO, writer: TextIO):
+        pending = []
+        pending_size = 0
+        last = None
+        last_kind = None
+        line_break = False
+        first = True
+        line = 1
+        balance = BlockBalance()
+        for kind, text in scan_chunks(reader, self.chunk_size):
+            if kind == 'ERROR':
+                raise LuaMinifyError('line {}: unexpected symbol {!r}'.format(line, text))
+            balance.feed(kind, text, line)
+            if kind in _LINE_BREAKS:
+                line += text.count('\n')
+
+            if kind == 'NEWLINE':
+                line_break = True
+                first = False
+                continue
+            if kind == 'SPACE':
+                continue
+            if kind == 'SHEBANG':
+                # only meaningful as the very first line
+                if first:
+                    pending.append(text)
+                    last, last_kind = text, 'LINE_COMMENT'
+                first = False
+                continue
+            if kind in ('COMMENT', 'LINE_COMMENT') and not self.keep_comments:
+                continue
+            first = False
+
+            if last is not None:
+                if last_kind == 'LINE_COMMENT':
+                    pending.append('\n')
+                elif last_kind != 'STRING' and last_kind != 'COMMENT' and needs_space(last, text):
+                    pending.append('\n' if line_break else ' ')
+                elif line_break and text == '(':
+                    pending.append('\n')
+            pending.append(text)
+            pending_size += len(text)
+            last, last_kind = text, kind
+            line_break = False
+
+            if pending_size >= self.chunk_size:
+                writer.write(''.join(pending))
+                pending.clear()
+                pending_size = 0
+
+        balance.finish()
+        if last_kind == 'LINE_COMMENT':
+            pending.append('\n')
+        writer.write(''.join(pending))
+
+    def minify_file(self, source: str, target: str, encoding: str = 'utf-8'):
+        """Minify `source` into `target` (utf-8), through a temporary file that replaces `target` when complete."""
+        if self.check_syntax:
+            with open(source, 'r', encoding=encoding, newline='') as reader:
+                self.check(reader.read())
+        fd, temp = mkstemp(prefix='.minify-', suffix='.tmp', dir=dirname(abspath(target)))
+        close(fd)
+        try:
+            with open(source, 'r', encoding=encoding, newline='') as reader:
+                with open(temp, 'w', encoding='utf-8', newline='') as writer:
+                    self.minify(reader, writer)
+            replace(temp, target)
+        except BaseException:
+            remove(temp)
+            raise
+
+
+if __name__ == '__main__':
+    import sys
+    from io import StringIO
+    from os import walk
+    from os.path import isdir, join
+    from time import perf_counter
+
+    from luaparser import ast
+
+    try:
+        # a real Lua, which also rejects what the grammar lets through, like `1then`
+        from lupa import LuaRuntime
+
+        lua_error = LuaRuntime().eval('function(s) local _, e = load(s) return e end')
+    except ImportError:
+        lua_error = None
+
+    def lua_files(where: str):
+        if not isdir(where):
+            return [where]
+        return [join(r, f) for r, _, fs in walk(where) for f in fs if f.endswith('.lua')]
+
+    def minify_text(src: str, keep_comments: bool = False, chunk_size: int = CHUNK_SIZE):
+        out = StringIO()
+        LuaTokenMinifier(keep_comments, chunk_size).minify(StringIO(src), out)
+        return out.getvalue()
+
+    # same AST as the source by the ANTLR lexer, whatever the chunk size, on the given files or a generated sample
+    if len(sys.argv) > 1:
+        sources = []
+        for arg in sys.argv[1:]:
+            for path in lua_files(arg):
+                with open(path, encoding='utf-8', errors='replace') as f:
+                    sources.append((path, f.read()))
+    else:
+        row = 'do local v{0} = t[ [[k{0}]] ] - -{0} .. "s{0}" -- row {0}\n(f)(v{0}) --[==[ long\ncomment ]==]\n' \
+              'if v{0} == {0} then v{0} = {0} and 0x{0} or {0}.5 end for i = 1, {0} do end end\n'
+        sources = [('<sample>', 'function t(a, ...) return a end\n' + ''.join(row.format(i) for i in range(5000)))]
+
+    checked = failed = 0
+    token_cost = ast_cost = 0.0
+    for where, src in sources:
+        try:
+            expected = ast.to_lua_source(ast.parse(src))
+        except Exception:
+            continue
+        checked += 1
+        for keep_comments, chunk_size in ((False, CHUNK_SIZE), (True, CHUNK_SIZE), (False, 7)):
+            text = minify_text(src, keep_comments, chunk_size)
+            if ast.to_lua_source(ast.parse(text)) != expected:
+                failed += 1
+                print('different AST:', where, keep_comments, chunk_size)
+            elif lua_error is not None and lua_error(text) is not None:
+                failed += 1
+                print('rejected by Lua:', where, keep_comments, chunk_size, lua_error(text))
+
+        begin = perf_counter()
+        minify_text(src)
+        token_cost += perf_counter() - begin
+        begin = perf_counter()
+        ast.to_lua_source(ast.parse(src))
+        ast_cost += perf_counter() - begin
+
+    # the token stream rejects what is unbalanced, only the full check what is balanced but does not parse
+    for bad, check in (('x = "abc', minify_text), ('if x then y()', minify_text), ('f(a]', minify_text),
+                       ('return end', minify_text), ('repeat x() end', minify_text), ('x = 1 then', minify_text),
+                       ('x = = 1', LuaTokenMinifier.check)):
+        try:
+            check(bad)
+            print('accepted:', bad)
+            failed += 1
+        except LuaMinifyError:
+            pass
+
+    print('{} sources, {} failed, checked by {}'.format(checked, failed, 'ANTLR and Lua' if lua_error else 'ANTLR'))
+    print('token minifier {:.3f}s, parse + print {:.3f}s, {:.1f}x'.format(
+        token_cost, ast_cost, ast_cost / max(token_cost, 1e-9)))
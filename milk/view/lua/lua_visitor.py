@@ -0,0 +1,91 @@
+from luaparser.ast import ASTRecursiveVisitor
+
+
+class LuaTreeVisitor(ASTRecursiveVisitor):
+    """
+    The base of milk's visitors. `luaparser`'s `ASTRecursiveVisitor` walks with an explicit stack and handlers
+    resolved once per (visitor class, node class), so deeply nested sources do not hit the recursion limit.
+    """
+
+
+if __name__ == '__main__':
+    import sys
+    from time import perf_counter
+
+    from luaparser.astnodes import Node
+
+    from milk.view.lua.lua_parser import LEXER_FAST, parse
+
+    class RecursiveVisitor:
+        """What `ASTRecursiveVisitor` was before it walked with a stack, to compare the order of the events."""
+
+        def _call(self, prefix: str, node):
+            node_class = node.__class__
+            while node_class is not object:
+                handler = getattr(self, prefix + node_class.__name__, None)
+                if handler is not None:
+                    handler(node)
+                    return
+                node_class = node_class.__bases__[0]
+
+        def visit(self, node):
+            if isinstance(node, Node):
+                self._call('enter_', node)
+                for attr, child in node.attributes().items():
+                    if not attr.startswith('_'):
+                        self.visit(child)
+                self._call('exit_', node)
+            elif isinstance(node, (list, tuple)):
+                for child in node:
+                    self.visit(child)
+
+    class Recorder:
+        def __init__(self):
+            self.events = []
+
+        def enter_Node(self, node):
+            self.events.append(('enter', node.__class__.__name__, node.line))
+
+        def exit_Node(self, node):
+            self.events.append(('exit', node.__class__.__name__, node.line))
+
+        def enter_Block(self, node):
+            self.events.append(('enter block', len(node.body)))
+
+    class RecursiveRecorder(Recorder, RecursiveVisitor):
+        pass
+
+    class IterativeRecorder(Recorder, LuaTreeVisitor):
+        pass
+
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], encoding='utf-8', errors='replace') as f:
+            source = f.read()
+    else:
+        row = '{{id = {0}, name = "n{0}", pos = {{x = 1, y = 2}}, tags = {{"a", "b"}}}}, -- row {0}\n'
+        source = 'local function f(a) return g(a.b:c("x")) end\nreturn {\n' + ''.join(
+            row.format(i) for i in range(20000)) + '}\n'
+
+    for compact in (False, True):
+        tree = parse(source, LEXER_FAST, compact=compact)
+        costs = []
+        events = []
+        for visitor in (RecursiveRecorder(), IterativeRecorder()):
+            begin = perf_counter()
+            visitor.visit(tree)
+            costs.append(perf_counter() - begin)
+            events.append(visitor.events)
+        print('compact={}: {} events, same order: {}, recursive {:.3f}s, iterative {:.3f}s, {:.1f}x'.format(
+            compact, len(events[1]), events[0] == events[1], costs[0], costs[1], costs[0] / costs[1]))
+
+    # the builder itself recurses much deeper per level than the visitors, so only parse with a raised limit
+    limit = sys.getrecursionlimit()
+    sys.setrecursionlimit(20000)
+    deep = parse('x = ' + '{' * 400 + '}' * 400, LEXER_FAST)
+    sys.setrecursionlimit(limit)
+    for visitor in (RecursiveRecorder(), IterativeRecorder()):
+        try:
+            visitor.visit(deep)
+            print('{}: 400 nested tables visited'.format(visitor.__class__.__name__))
+        except RecursionError:
+            print('{}: RecursionError on 400 nested tables'.format(visitor.__class__.__name__))
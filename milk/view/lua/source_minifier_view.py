@@ -1,15 +1,14 @@
-from os import walk
-from os.path import exists, isdir, isfile, join, normpath, splitext
-from typing import List
-from traceback import format_exception_only
+from os.path import exists, isdir, isfile, splitext
+from typing import List, Optional
 
 from PyQt5.QtCore import Qt
 
 from milk.cmm import Cmm
 from milk.conf import LangUI, settings, StyleSheet, UIDef, UserKey, signals
 from milk.gui import GUI
+from milk.scanner import scan_files
 from milk.thread_runner import ThreadRunner
-from .lua_source_interpreter import LuaRestoreTree, LuaSourceInterpreter
+from .lua_batch_minifier import LuaBatchMinifier, MinifyManifest, MinifyOptions, MinifyResult
 
 
 class _View(GUI.View):
@@ -23,14 +22,21 @@ class _View(GUI.View):
         self.ui_check_replace = GUI.create_check_box(LangUI.lua_minifier_replace)
         self.ui_check_keep_comments = GUI.create_check_box(LangUI.lua_minifier_keep_comment)
         self.ui_check_wrap_table = GUI.create_check_box(LangUI.lua_minifier_wrap_table)
+        self.ui_check_token_mode = GUI.create_check_box(LangUI.lua_minifier_token_mode)
+        self.ui_check_syntax = GUI.create_check_box(LangUI.lua_minifier_check_syntax)
         self.ui_group_options_layout = GUI.create_horizontal_layout(self.ui_group_options)
         self.ui_group_options_layout.addWidget(self.ui_check_replace)
         self.ui_group_options_layout.addWidget(self.ui_check_keep_comments)
         self.ui_group_options_layout.addWidget(self.ui_check_wrap_table)
+        self.ui_group_options_layout.addWidget(self.ui_check_token_mode)
+        self.ui_group_options_layout.addWidget(self.ui_check_syntax)
         self.ui_group_options_layout.setAlignment(Qt.AlignLeft)
         self.ui_check_replace.setChecked(True)
         self.ui_check_keep_comments.setChecked(False)
         self.ui_check_wrap_table.setChecked(False)
+        self.ui_check_token_mode.setChecked(False)
+        self.ui_check_syntax.setChecked(False)
+        self.ui_check_syntax.setEnabled(False)
         self.ui_tb_log = GUI.create_text_browser()
         self.ui_tb_log.setStyleSheet(StyleSheet.TextBrowser)
 
@@ -54,6 +60,8 @@ class SourceMinifierView(_View):
     def __init__(self):
         super(SourceMinifierView, self).__init__()
 
+        self.batch_minifier: Optional[LuaBatchMinifier] = None
+
         self.setWindowTitle(LangUI.lua_minifier_title)
         self.setMinimumSize(640, 480)
         self.setup_window_code(UIDef.LuaMinifier.value)
@@ -67,6 +75,7 @@ class SourceMinifierView(_View):
     def setup_ui_signals(self):
         self.ui_btn_start.clicked.connect(self.on_start_minifier)
         self.ui_act_folder.triggered.connect(self.on_select_folder)
+        self.ui_check_token_mode.toggled.connect(self.on_token_mode_toggled)
 
     @staticmethod
     def lua_minifier_folder_at(at: str = None):
@@ -82,6 +91,12 @@ class SourceMinifierView(_View):
             self.lua_minifier_folder_at(chosen)
             self.on_start_minifier()
 
+    def on_token_mode_toggled(self, checked: bool):
+        # tables are written as in the source when the AST is not rebuilt
+        self.ui_check_wrap_table.setEnabled(not checked)
+        # the AST path always parses, token mode only when asked to
+        self.ui_check_syntax.setEnabled(checked)
+
     def on_start_minifier(self):
         self.ui_tb_log.clear()
         self.start_check(self.lua_minifier_folder_at())
@@ -97,12 +112,7 @@ class SourceMinifierView(_View):
 
         file_list = []
         if isdir(where):
-            for root, dirs, files in walk(where):
-                for file in files:
-                    filename = normpath(join(root, file))
-                    if Cmm.is_hiding_path(filename) is False:
-                        if self.meet_extension(filename):
-                            file_list.append(filename)
+            file_list = [entry.path for entry in scan_files([where], ('.lua',))]
         elif isfile(where):
             if self.meet_extension(where):
                 file_list.append(where)
@@ -119,35 +129,42 @@ class SourceMinifierView(_View):
         self.ui_group_options.setEnabled(ok)
 
     def check_all(self, files: List[str]):
-        files.reverse()
+        options = MinifyOptions(replace=self.ui_check_replace.isChecked(),
+                                keep_comments=self.ui_check_keep_comments.isChecked(),
+                                wrap_table=self.ui_check_wrap_table.isChecked(),
+                                token_mode=self.ui_check_token_mode.isChecked(),
+                                check_syntax=self.ui_check_syntax.isChecked())
+        minifier = LuaBatchMinifier(options, MinifyManifest().load())
+        minifier.start(files)
+        self.batch_minifier = minifier
 
         def on_running():
-            if len(files) == 0:
-                self.set_widgets_enabled(True)
+            if self.batch_minifier is not minifier:
                 runner.stop(tid)
                 return
-            where = files.pop()
-            self.check_one(where)
+            for result in minifier.poll():
+                self.check_one(result)
+            if minifier.finished():
+                minifier.shutdown()
+                signals.logger_info.emit(LangUI.lua_minifier_finished.format(minifier.total(), minifier.elapsed()))
+                self.batch_minifier = None
+                self.set_widgets_enabled(True)
+                runner.stop(tid)
 
         runner = ThreadRunner()
         tid = runner.start(runner=on_running)
 
-    # noinspection PyBroadException
-    def check_one(self, where: str):
-        target = where
-        if self.ui_check_replace.isChecked() is False:
-            target = where + '.min'
-        try:
-            root = LuaRestoreTree(where).root()
-            bracket_table_field = self.ui_check_wrap_table.isChecked()
-            with_comments = self.ui_check_keep_comments.isChecked()
-            interpreter = LuaSourceInterpreter(
-                bracket_table_field=bracket_table_field,
-                with_comments=with_comments)
-            interpreter.interpret(root)
-            text = interpreter.content()
-            Cmm.save_file_content(target, text)
-            self.ui_tb_log.append('<p style="color:green;">{}: OK</p>'.format(target))
-        except Exception as e:
-            self.ui_tb_log.append('<p style="color:red;">{}: Bad</p>'.format(target))
-            signals.logger_error.emit('\n'.join(format_exception_only(e)))
+    def check_one(self, result: MinifyResult):
+        if result.skipped:
+            self.ui_tb_log.append('<p style="color:gray;">{}: {}</p>'.format(result.target, LangUI.lua_minifier_skipped))
+        elif result.ok:
+            self.ui_tb_log.append('<p style="color:green;">{}: OK</p>'.format(result.target))
+        else:
+            self.ui_tb_log.append('<p style="color:red;">{}: Bad</p>'.format(result.target))
+            signals.logger_error.emit(result.error)
+
+    def closeEvent(self, event):
+        if self.batch_minifier is not None:
+            self.batch_minifier.shutdown(cancel=True)
+            self.batch_minifier = None
+        super(SourceMinifierView, self).closeEvent(event)
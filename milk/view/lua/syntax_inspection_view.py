@@ -1,15 +1,17 @@
-from os import walk
-from os.path import exists, isdir, isfile, join, normpath, relpath, splitext
-from typing import List
+from os.path import exists, isdir, isfile, relpath, splitext
+from typing import List, Optional
 
 from PyQt5.QtCore import Qt
 from PyQt5.QtWidgets import QAbstractItemView, QHeaderView, QSplitter, QTableWidgetItem
 
 from milk.cmm import Cmm
-from milk.conf import LangUI, ResMap, settings, StyleSheet, UIDef, UserKey
+from milk.conf import LangUI, ResMap, settings, signals, StyleSheet, UIDef, UserKey
 from milk.gui import GUI
+from milk.scanner import scan_files
 from thread_runner import ThreadRunner
-from .lua_syntax_checker import LuaSyntaxChecker
+from .lua_batch_checker import LuaBatchChecker
+from .lua_result_cache import LuaResultCache
+from .lua_syntax_checker import nested_cache_options, NESTED_LIMIT_LEVEL, NestedResult
 
 
 class _View(GUI.View):
@@ -63,6 +65,7 @@ class SyntaxInspectionView(_View):
         super(SyntaxInspectionView, self).__init__()
 
         self.row_info = []
+        self.batch_checker: Optional[LuaBatchChecker] = None
 
         self.setWindowTitle(LangUI.lua_grammar_title)
         self.setMinimumSize(640, 480)
@@ -95,6 +98,7 @@ class SyntaxInspectionView(_View):
             self.on_start_check()
 
     def on_start_check(self):
+        self.row_info.clear()
         self.ui_table_files.clearContents()
         self.ui_table_files.setRowCount(0)
         self.start_check(self.lua_grammar_folder_at())
@@ -112,12 +116,7 @@ class SyntaxInspectionView(_View):
 
         file_list = []
         if isdir(where):
-            for root, dirs, files in walk(where):
-                for file in files:
-                    filename = normpath(join(root, file))
-                    if Cmm.is_hiding_path(filename) is False:
-                        if self.meet_extension(filename):
-                            file_list.append(filename)
+            file_list = [entry.path for entry in scan_files([where], ('.lua',))]
         elif isfile(where):
             if self.meet_extension(where):
                 file_list.append(where)
@@ -133,50 +132,56 @@ class SyntaxInspectionView(_View):
         self.ui_btn_check.setEnabled(ok)
 
     def check_all(self, files: List[str]):
-        files.reverse()
+        cache = LuaResultCache(options=nested_cache_options(NESTED_LIMIT_LEVEL)).open()
+        checker = LuaBatchChecker(cache=cache)
+        checker.start(files, NESTED_LIMIT_LEVEL)
+        self.batch_checker = checker
 
         def on_running():
-            if len(files) == 0:
-                self.set_widgets_enabled(True)
+            if self.batch_checker is not checker:
                 runner.stop(tid)
                 return
-            where = files.pop()
-            self.check_one(where)
+            for result in checker.poll():
+                self.check_one(result)
+            if checker.finished():
+                checker.shutdown()
+                self.batch_checker = None
+                self.set_widgets_enabled(True)
+                runner.stop(tid)
 
         runner = ThreadRunner()
         tid = runner.start(runner=on_running)
 
-    def check_one(self, where: str):
-        ok, blocks = LuaSyntaxChecker.check_nested(where)
-
-        text = relpath(where, self.lua_grammar_folder_at())
+    def check_one(self, result: NestedResult):
+        ok = result.ok
+        text = relpath(result.filepath, self.lua_grammar_folder_at())
         icon = ResMap.img_correct if ok else ResMap.img_error
-        level_num = len(blocks)
-        level = str(level_num - 1) if ok else '0'
+        level = str(result.max_level) if ok else '0'
         item1 = GUI.create_table_item(text, icon=icon)
         item2 = GUI.create_table_item(level)
-        if level_num > 6:
+        if result.max_level > NESTED_LIMIT_LEVEL:
             item2.setBackground(Qt.red)
         row = self.ui_table_files.rowCount()
         self.ui_table_files.setRowCount(row + 1)
         self.ui_table_files.setItem(row, 0, item1)
         self.ui_table_files.setItem(row, 1, item2)
-        self.row_info.append((where, blocks,))
+        self.row_info.append((result.filepath, result.blocks,))
+        if result.error is not None:
+            signals.logger_error.emit('{}: {}'.format(result.filepath, result.error))
 
     def on_item_double_clicked(self, item: QTableWidgetItem):
         where, blocks = self.row_info[item.row()]
         print(item.row(), where)
         self.ui_tb_nested.clear()
         self.ui_tb_nested.hide()
-        limit_level = 5
-        start = limit_level + 1
-        if blocks is not None:
-            blocks = reversed(blocks[start:])
-            display = False
-            for block_list in blocks:
-                display = True
-                for block in block_list:
-                    for line in block.source():
-                        self.ui_tb_nested.append(line)
-            if display:
-                self.ui_tb_nested.show()
+        if len(blocks) > 0:
+            for block in blocks:
+                for line in block.source(LangUI.lua_grammar_nested_level):
+                    self.ui_tb_nested.append(line)
+            self.ui_tb_nested.show()
+
+    def closeEvent(self, event):
+        if self.batch_checker is not None:
+            self.batch_checker.shutdown(cancel=True)
+            self.batch_checker = None
+        super(SyntaxInspectionView, self).closeEvent(event)
@@ -0,0 +1,132 @@
+import json
+from hashlib import sha1
+from os import remove, replace, stat
+from os.path import join
+from typing import Dict, List
+
+from milk.image_output import PNG_EXTENSION
+from .atlas_parser import AtlasRegion
+
+MANIFEST_NAME = '.atlas-manifest.json'
+MANIFEST_VERSION = 1
+
+
+def file_hash(where: str):
+    digest = sha1()
+    with open(where, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def file_stamp(where: str):
+    """(size, mtime_ns) of `where`, None when it is missing."""
+    try:
+        info = stat(where)
+    except OSError:
+        return None
+    return info.st_size, info.st_mtime_ns
+
+
+def region_key(region: AtlasRegion, page_hash: str, output: str = ''):
+    """What an output is made of: its page content, every field of the region that changes its pixels
+    and the `ImageOutput.signature` it is written with."""
+    return sha1('{}|{}|{},{},{},{}|{}|{},{}|{},{}'.format(
+        output, page_hash, region.x, region.y, region.width, region.height, region.degrees,
+        region.offset_x, region.offset_y, region.orig_width, region.orig_height).encode()).hexdigest()
+
+
+class AtlasManifest:
+    """
+    What was extracted from an atlas into its output folder, stored in that folder as `MANIFEST_NAME`:
+    the hash of the atlas file and its number of outputs, how the outputs are written, the hash and stamp of each
+    page, and for each output the key it was made from, the hash of the written file and its stamp.
+    An output is rewritten only when its key changed or the file is not the one written,
+    and only outputs listed here are ever deleted.
+    """
+
+    def __init__(self, extension: str = PNG_EXTENSION, output: str = ''):
+        self.atlas_hash = ''
+        # outputs of the atlas, those which failed to be written are not in `outputs`
+        self.regions = -1
+        self.extension = extension
+        # `ImageOutput.signature` of the outputs
+        self.output = output
+        # page name -> [hash, size, mtime_ns]
+        self.pages: Dict[str, List] = dict()
+        # output name -> [key, hash, size, mtime_ns]
+        self.outputs: Dict[str, List] = dict()
+
+    @staticmethod
+    def load(dst_dir: str):
+        manifest = AtlasManifest()
+        try:
+            with open(join(dst_dir, MANIFEST_NAME), 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('version') == MANIFEST_VERSION:
+                manifest.atlas_hash = data.get('atlas', '')
+                manifest.regions = data.get('regions', -1)
+                manifest.extension = data.get('extension', PNG_EXTENSION)
+                manifest.output = data.get('output', '')
+                manifest.pages = data.get('pages', dict())
+                manifest.outputs = data.get('outputs', dict())
+        except (OSError, ValueError, AttributeError):
+            pass
+        return manifest
+
+    def save(self, dst_dir: str):
+        where = join(dst_dir, MANIFEST_NAME)
+        with open(where + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump({
+                'version': MANIFEST_VERSION,
+                'atlas': self.atlas_hash,
+                'regions': self.regions,
+                'extension': self.extension,
+                'output': self.output,
+                'pages': self.pages,
+                'outputs': self.outputs,
+            }, f, ensure_ascii=False)
+        replace(where + '.tmp', where)
+
+    def page_hash(self, name: str, where: str, previous: 'AtlasManifest'):
+        """Hash of the page at `where`, taken from `previous` while the file keeps its stamp."""
+        stamp = file_stamp(where)
+        known = previous.pages.get(name)
+        if stamp is not None and known is not None and tuple(known[1:]) == stamp:
+            page_hash = known[0]
+        else:
+            page_hash = file_hash(where)
+            stamp = file_stamp(where)
+        self.pages[name] = [page_hash, stamp[0], stamp[1]]
+        return page_hash
+
+    def complete(self, dst_dir: str):
+        """Every output of the atlas was written and is still there as written."""
+        return len(self.outputs) == self.regions and all(self.intact(dst_dir, name) for name in self.outputs)
+
+    def pages_unchanged(self, atlas_dir: str):
+        return all(file_stamp(join(atlas_dir, name)) == tuple(known[1:]) for name, known in self.pages.items())
+
+    def intact(self, dst_dir: str, name: str, key: str = None):
+        """The output `name` is there as written, and made from `key` when given."""
+        known = self.outputs.get(name)
+        if known is None or (key is not None and known[0] != key):
+            return False
+        return file_stamp(join(dst_dir, name + self.extension)) == tuple(known[2:])
+
+    def record(self, name: str, key: str, output_hash: str, stamp):
+        self.outputs[name] = [key, output_hash, stamp[0], stamp[1]]
+
+    def remove_stale(self, dst_dir: str, keep):
+        """Delete the outputs of this manifest which are not in `keep`, the number deleted."""
+        removed = 0
+        for name in list(self.outputs):
+            if name in keep:
+                continue
+            self.outputs.pop(name)
+            try:
+                remove(join(dst_dir, name + self.extension))
+                removed += 1
+            except OSError:
+                pass
+        return removed
@@ -0,0 +1,216 @@
+from os.path import dirname, join
+from typing import Dict, List, Optional, Tuple
+
+from PIL import Image
+
+
+class AtlasFormatError(ValueError):
+    pass
+
+
+class AtlasPage:
+    __slots__ = ('name', 'width', 'height', 'format', 'min_filter', 'mag_filter', 'repeat', 'pma', 'regions')
+
+    def __init__(self, name: str):
+        self.name = name
+        self.width = 0
+        self.height = 0
+        self.format = 'RGBA8888'
+        self.min_filter = 'Nearest'
+        self.mag_filter = 'Nearest'
+        self.repeat = 'none'
+        self.pma = False
+        # positions in `SpineAtlas.regions`
+        self.regions: List[int] = []
+
+
+class AtlasRegion:
+    """
+    A region as written by the Spine texture packer: `x, y, width, height` is its packed rect in the page with
+    width and height before rotation, `offset_x, offset_y` place it in its `orig` size, y counted from the bottom.
+    `degrees` is how far it was turned counter-clockwise when packed.
+    """
+
+    __slots__ = ('name', 'page', 'x', 'y', 'width', 'height', 'degrees', 'offset_x', 'offset_y',
+                 'orig_width', 'orig_height', 'index')
+
+    def __init__(self, name: str, page: int):
+        self.name = name
+        self.page = page
+        self.x = 0
+        self.y = 0
+        self.width = 0
+        self.height = 0
+        self.degrees = 0
+        self.offset_x = 0
+        self.offset_y = 0
+        self.orig_width = 0
+        self.orig_height = 0
+        self.index = -1
+
+    @property
+    def rotated(self):
+        return self.degrees in (90, 270)
+
+    @property
+    def crop_rect(self):
+        """(left, top, right, bottom) of the packed pixels in the page."""
+        w, h = (self.height, self.width) if self.rotated else (self.width, self.height)
+        return self.x, self.y, self.x + w, self.y + h
+
+    @property
+    def paste_at(self):
+        """Top left corner of the unrotated region in its `orig` size."""
+        return self.offset_x, self.orig_height - self.height - self.offset_y
+
+    @property
+    def output_name(self):
+        return self.name if self.index < 0 else '{}_{}'.format(self.name, self.index)
+
+    def __getstate__(self):
+        return tuple(getattr(self, key) for key in self.__slots__)
+
+    def __setstate__(self, state):
+        for key, value in zip(self.__slots__, state):
+            setattr(self, key, value)
+
+
+class SpineAtlas:
+    def __init__(self, where: str = None):
+        self.where = where
+        self.pages: List[AtlasPage] = []
+        self.regions: List[AtlasRegion] = []
+        # (name, index) -> position in `regions`
+        self.index: Dict[Tuple[str, int], int] = dict()
+
+    def find(self, name: str, index: int = -1) -> Optional[AtlasRegion]:
+        at = self.index.get((name, index))
+        return self.regions[at] if at is not None else None
+
+    def page_path(self, page: AtlasPage):
+        return join(dirname(self.where or ''), page.name)
+
+    def page_regions(self, page: AtlasPage):
+        return [self.regions[at] for at in page.regions]
+
+
+def _ints(values: List[str], count: int, line_no: int):
+    if len(values) < count:
+        raise AtlasFormatError('line {}: {} values expected'.format(line_no, count))
+    try:
+        return [int(value) for value in values[:count]]
+    except ValueError:
+        raise AtlasFormatError('line {}: integers expected'.format(line_no))
+
+
+def _entry(line: str):
+    key, sep, value = line.partition(':')
+    if not sep:
+        return None, None
+    return key.strip(), [value.strip() for value in value.split(',')]
+
+
+class AtlasParser:
+    """
+    Read Spine `.atlas` files of the 3.x and 4.x runtimes in one pass, as the runtimes themselves do:
+    a name after a blank line (or at the start) opens a page, other names open a region,
+    and `key: value, ...` lines set fields of the page or region above them, in any order.
+    """
+
+    @staticmethod
+    def parse(where: str, encoding: str = 'utf-8'):
+        with open(where, 'r', encoding=encoding) as f:
+            return AtlasParser.parse_lines(f, where)
+
+    @staticmethod
+    def parse_lines(lines, where: str = None):
+        atlas = SpineAtlas(where)
+        page: Optional[AtlasPage] = None
+        region: Optional[AtlasRegion] = None
+        for line_no, line in enumerate(lines, 1):
+            line = line.strip()
+            if not line:
+                page = None
+                region = None
+                continue
+            key, values = _entry(line)
+            if key is None:
+                if page is None:
+                    page = AtlasPage(line)
+                    atlas.pages.append(page)
+                    region = None
+                else:
+                    region = AtlasRegion(line, len(atlas.pages) - 1)
+                    page.regions.append(len(atlas.regions))
+                    atlas.regions.append(region)
+                continue
+            if page is None:
+                # header entries of 4.x files before the first page
+                continue
+            if region is None:
+                AtlasParser._page_entry(page, key, values, line_no)
+            else:
+                AtlasParser._region_entry(region, key, values, line_no)
+
+        for at, region in enumerate(atlas.regions):
+            if region.orig_width == 0 and region.orig_height == 0:
+                # not trimmed
+                region.orig_width, region.orig_height = region.width, region.height
+            atlas.index.setdefault((region.name, region.index), at)
+        return atlas
+
+    @staticmethod
+    def _page_entry(page: AtlasPage, key: str, values: List[str], line_no: int):
+        if key == 'size':
+            page.width, page.height = _ints(values, 2, line_no)
+        elif key == 'format':
+            page.format = values[0]
+        elif key == 'filter':
+            page.min_filter = values[0]
+            page.mag_filter = values[-1]
+        elif key == 'repeat':
+            page.repeat = values[0]
+        elif key == 'pma':
+            page.pma = values[0] == 'true'
+
+    @staticmethod
+    def _region_entry(region: AtlasRegion, key: str, values: List[str], line_no: int):
+        if key == 'xy':
+            region.x, region.y = _ints(values, 2, line_no)
+        elif key == 'size':
+            region.width, region.height = _ints(values, 2, line_no)
+        elif key == 'bounds':
+            region.x, region.y, region.width, region.height = _ints(values, 4, line_no)
+        elif key == 'offset':
+            region.offset_x, region.offset_y = _ints(values, 2, line_no)
+        elif key == 'orig':
+            region.orig_width, region.orig_height = _ints(values, 2, line_no)
+        elif key == 'offsets':
+            region.offset_x, region.offset_y, region.orig_width, region.orig_height = _ints(values, 4, line_no)
+        elif key == 'rotate':
+            if values[0] == 'true':
+                region.degrees = 90
+            elif values[0] == 'false':
+                region.degrees = 0
+            else:
+                region.degrees = _ints(values, 1, line_no)[0] % 360
+        elif key == 'index':
+            region.index = _ints(values, 1, line_no)[0]
+
+
+# turns a packed region back, the packer turned it counter-clockwise by `degrees`
+_RESTORE = {90: Image.ROTATE_270, 180: Image.ROTATE_180, 270: Image.ROTATE_90}
+
+
+def restore_region(page_image: Image.Image, region: AtlasRegion):
+    """The region as it was before packing: unrotated, at its offset in a transparent picture of its `orig` size."""
+    packed = page_image.crop(region.crop_rect)
+    if region.degrees in _RESTORE:
+        packed = packed.transpose(_RESTORE[region.degrees])
+    if packed.mode != 'RGBA':
+        packed = packed.convert('RGBA')
+    if region.paste_at == (0, 0) and packed.size == (region.orig_width, region.orig_height):
+        return packed
+    image = Image.new('RGBA', (region.orig_width, region.orig_height), (0, 0, 0, 0))
+    image.paste(packed, region.paste_at)
+    return image
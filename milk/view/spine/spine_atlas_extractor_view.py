@@ -1,15 +1,15 @@
-import re
-from os import makedirs, walk
-from os.path import dirname, exists, isdir, join, splitext
-from shutil import rmtree
+from os.path import isdir, join, splitext
 
-from PIL import Image
 from PyQt5.QtCore import Qt
 
 from milk.cmm import Cmm
-from milk.conf import LangUI, settings, signals, UIDef, UserKey
+from milk.conf import Lang, LangUI, settings, signals, UIDef, UserKey
 from milk.gui import GUI
+from milk.image_output import DEFAULT_PRESET, output_preset
+from milk.scanner import scan_files
 from milk.thread_runner import ThreadRunner
+from milk.view.texture.conf import OutputPresets
+from .spine_extractor import SpineBatchExtractor
 
 
 class _View(GUI.View):
@@ -26,6 +26,9 @@ class _View(GUI.View):
             readonly=True,
             placeholder=LangUI.atlas_extractor_ui_edit_output_dir)
         self.ui_btn_parse = GUI.create_push_btn(LangUI.atlas_extractor_ui_btn_parse)
+        self.ui_check_incremental = GUI.create_check_box(LangUI.atlas_extractor_ui_incremental)
+        self.ui_lab_output_format = GUI.create_label(LangUI.atlas_extractor_ui_lab_output_format)
+        self.ui_combo_output_format = GUI.create_combo_box([Lang.get(name) for _, name in OutputPresets])
         self.ui_act_locate_dir = GUI.set_folder_action_for_line_edit(self.ui_edit_atlas_locate_dir)
         self.ui_act_output_dir = GUI.set_folder_action_for_line_edit(self.ui_edit_atlas_output_dir)
 
@@ -41,6 +44,13 @@ class _View(GUI.View):
                 GUI.GridItem(self.ui_lab_output_dir, 0, 1),
                 GUI.GridItem(self.ui_edit_atlas_output_dir, 1, 2),
             ),
+            (
+                GUI.GridItem(self.ui_lab_output_format, 0, 1),
+                GUI.GridItem(self.ui_combo_output_format, 1, 2),
+            ),
+            (
+                GUI.GridItem(self.ui_check_incremental, 0, 3),
+            ),
             (
                 GUI.GridItem(self.ui_btn_parse, 0, 3),
             )
@@ -52,8 +62,9 @@ class SpineAtlasExtractorView(_View):
     def __init__(self):
         super(SpineAtlasExtractorView, self).__init__()
 
-        self.setFixedSize(500, 118)
+        self.setFixedSize(500, 176)
         self.setWindowTitle(LangUI.atlas_extractor_title)
+        self.extractor = None
 
         self.setup_window_code(UIDef.ImageSpineAtlasExtractor.value)
         self.setup_rect_key(UserKey.SpineAtlasExtractor.window_rect)
@@ -65,11 +76,17 @@ class SpineAtlasExtractorView(_View):
         self.ui_edit_atlas_output_dir.textChanged.connect(self.on_sync_atlas_output_dir)
         self.ui_act_locate_dir.triggered.connect(self.on_choose_locate_dir)
         self.ui_act_output_dir.triggered.connect(self.on_choose_output_dir)
+        self.ui_check_incremental.stateChanged.connect(self.on_sync_incremental)
+        self.ui_combo_output_format.currentIndexChanged.connect(self.on_sync_output_format)
         self.ui_btn_parse.clicked.connect(self.on_parse)
 
     def setup_preferences(self):
         self.ui_edit_atlas_locate_dir.setText(self.atlas_locate_dir())
         self.ui_edit_atlas_output_dir.setText(self.atlas_output_dir())
+        self.ui_check_incremental.setChecked(self.incremental())
+        presets = [preset for preset, _ in OutputPresets]
+        preset = self.output_preset()
+        self.ui_combo_output_format.setCurrentIndex(presets.index(preset) if preset in presets else 0)
 
     @staticmethod
     def atlas_locate_dir():
@@ -79,6 +96,20 @@ class SpineAtlasExtractorView(_View):
     def atlas_output_dir():
         return settings.value(UserKey.SpineAtlasExtractor.atlas_out_dir, "", str)
 
+    @staticmethod
+    def incremental():
+        return settings.value(UserKey.SpineAtlasExtractor.incremental, True, bool)
+
+    @staticmethod
+    def output_preset():
+        return settings.value(UserKey.ImageOutput.preset, DEFAULT_PRESET, str)
+
+    def on_sync_output_format(self, index: int):
+        settings.setValue(UserKey.ImageOutput.preset, OutputPresets[index][0])
+
+    def on_sync_incremental(self):
+        settings.setValue(UserKey.SpineAtlasExtractor.incremental, self.ui_check_incremental.isChecked())
+
     def on_sync_atlas_locate_dir(self):
         settings.setValue(UserKey.SpineAtlasExtractor.atlas_locate_dir, self.ui_edit_atlas_locate_dir.text())
         self.ui_edit_atlas_locate_dir.setCursorPosition(0)
@@ -121,96 +152,50 @@ class SpineAtlasExtractorView(_View):
         self._parse(atlas_locate_dir, atlas_out_dir)
 
     def _parse(self, locate, out):
-        file_no = []
-        for root, dirs, files in walk(locate):
-            for name in files:
-                dir_name = splitext(name)[0]
-                ext = splitext(name)[-1]
-                if ext == '.atlas':
-                    src_file = join(root, name)
-                    dst_dir = join(out, dir_name)
-                    file_no.append((src_file, dst_dir))
+        file_no = [(entry.path, join(out, splitext(entry.name)[0])) for entry in scan_files([locate], ('.atlas',))]
         if len(file_no) <= 0:
             signals.logger_error.emit(LangUI.msg_atlas_not_found)
-        else:
-            def on_running():
-                if len(file_no) == 0:
-                    runner.stop(tid)
-                    self.reset_ui(True)
-                    signals.logger_info.emit(LangUI.msg_all_extracted.format(locate))
-                    signals.window_switch_to_main.emit()
-                    return
-                src, dst = file_no.pop()
-                self._parse_file(src, dst)
-
-            runner = ThreadRunner()
-            tid = runner.start(runner=on_running)
+            self.reset_ui(True)
+            return
+
+        extractor = SpineBatchExtractor(incremental=self.ui_check_incremental.isChecked(),
+                                        output=output_preset(self.output_preset()))
+        extractor.start(file_no)
+        self.extractor = extractor
+
+        def on_running():
+            if self.extractor is not extractor:
+                runner.stop(tid)
+                return
+            for result in extractor.poll():
+                if result.skipped:
+                    signals.logger_info.emit(LangUI.msg_one_unchanged.format(result.atlas_path))
+                elif result.ok:
+                    signals.logger_info.emit(LangUI.msg_one_extracted_timing.format(
+                        result.atlas_path, result.regions, result.unchanged, result.removed, result.elapsed))
+                    if result.regions > 0 or result.removed > 0:
+                        Cmm.open_external_file(result.out_dir)
+                else:
+                    signals.logger_error.emit('{0}: {1}'.format(result.atlas_path, result.error))
+            if extractor.finished():
+                decoded = extractor.page_cache.decoded
+                extractor.shutdown()
+                signals.logger_info.emit(LangUI.msg_all_extracted_timing.format(
+                    locate, extractor.total(), extractor.regions(), extractor.elapsed(),
+                    extractor.regions_per_second(), decoded))
+                self.extractor = None
+                self.reset_ui(True)
+                signals.window_switch_to_main.emit()
+                runner.stop(tid)
+
+        runner = ThreadRunner()
+        tid = runner.start(runner=on_running)
 
     def reset_ui(self, ok: bool):
         self.ui_btn_parse.setEnabled(ok)
 
-    # noinspection PyMethodMayBeStatic
-    def _parse_file(self, src_file, dst_dir):
-        if exists(dst_dir):
-            rmtree(dst_dir)
-        makedirs(dst_dir, exist_ok=True)
-
-        root = dirname(src_file)
-        src_image = None
-        src_atlas = open(src_file, 'r')
-
-        src_atlas.seek(0, 2)
-        total = src_atlas.tell()
-        src_atlas.seek(0)
-
-        try:
-            while True:
-                line = src_atlas.readline().strip('\n')
-                if src_atlas.tell() == total:
-                    break
-
-                match1 = re.match(r'.*\.[png|jpg]', line)
-                if match1:
-                    png_file = join(root, line)
-                    src_image = Image.open(png_file)
-                    for x in range(4):
-                        src_atlas.readline()
-
-                match2 = re.match(r'^[^\s]+', line)
-                if not match1 and match2:
-                    name = line.strip('\n')
-                    rotate = src_atlas.readline().split(':')[1].strip('\n').strip(' ') == 'true'
-                    xy = src_atlas.readline().split(':')[1].strip('\n').strip(' ')
-                    size = src_atlas.readline().split(':')[1].strip('\n').strip(' ')
-                    # orig = src_atlas.readline().split(':')[1].strip('\n').strip(' ')
-                    # offset = src_atlas.readline().split(':')[1].strip('\n').strip(' ')
-                    src_atlas.readline()
-
-                    width = int(size.split(',')[0])
-                    height = int(size.split(',')[1])
-                    if rotate:
-                        width, height = height, width
-
-                    ltx = int(xy.split(',')[0])
-                    lty = int(xy.split(',')[1])
-                    rbx = ltx + width
-                    rby = lty + height
-
-                    split_image = Image.new("RGBA", (width, height), (0, 0, 0, 0))
-                    frame = src_image.crop((ltx, lty, rbx, rby))
-                    split_image.paste(frame, (0, 0, width, height))
-
-                    levels = name.split('/')
-                    fixed_path = dst_dir
-                    for i in range(len(levels) - 1):
-                        full_path = join(fixed_path, levels[i])
-                        if not exists(full_path):
-                            makedirs(full_path, exist_ok=True)
-                        fixed_path = full_path
-                    split_image.save(join(dst_dir, name + '.png'))
-            signals.logger_info.emit(LangUI.msg_one_extracted.format(src_file))
-            Cmm.open_external_file(dst_dir)
-        except Exception as e:
-            signals.logger_error.emit(str(e))
-        finally:
-            src_atlas.close()
+    def closeEvent(self, event):
+        if self.extractor is not None:
+            self.extractor.shutdown(cancel=True, wait=False)
+            self.extractor = None
+        super(SpineAtlasExtractorView, self).closeEvent(event)
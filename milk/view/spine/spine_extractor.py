@@ -0,0 +1,369 @@
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
+from hashlib import sha1
+from os import cpu_count, makedirs
+from os.path import abspath, dirname, exists, join
+from queue import Empty, SimpleQueue
+from shutil import rmtree
+from threading import Lock, Thread
+from time import perf_counter
+from typing import Dict, List, Optional, Tuple
+
+from PIL import Image
+
+from milk.image_output import ImageOutput
+from milk.view.texture.frame_extractor import AtlasBuffer
+from .atlas_manifest import AtlasManifest, file_hash, file_stamp, region_key
+from .atlas_parser import AtlasParser, AtlasRegion, restore_region
+
+# regions handed to a worker at once
+BATCH_SIZE = 32
+# decoded pages kept for the atlases still to come, pages shared by several atlases are decoded once
+PAGE_CACHE_LIMIT = 8
+# pages kept open in a worker
+WORKER_PAGE_LIMIT = 4
+
+
+def region_target(dst_dir: str, region: AtlasRegion, output: ImageOutput):
+    return join(dst_dir, region.output_name + output.extension)
+
+
+_pages: Dict[str, Image.Image] = OrderedDict()
+
+
+def restore_in_worker(buffer: AtlasBuffer, regions: List[AtlasRegion], dst_dir: str, output: ImageOutput):
+    """Save `regions` cut from the page in `buffer`, ([(output name, file hash, stamp)], errors)."""
+    page_image = _pages.get(buffer.where)
+    if page_image is None:
+        pixels = buffer.open()
+        page_image = pixels.to_image(pixels.pixels)
+        _pages[buffer.where] = page_image
+        while len(_pages) > WORKER_PAGE_LIMIT:
+            _pages.popitem(last=False)
+    else:
+        _pages.move_to_end(buffer.where)
+    written = []
+    errors = []
+    for region in regions:
+        save_at = region_target(dst_dir, region, output)
+        try:
+            data = output.save(restore_region(page_image, region), save_at)
+            written.append((region.output_name, sha1(data).hexdigest(), file_stamp(save_at)))
+        except Exception as e:
+            errors.append('{}: {}: {}'.format(save_at, e.__class__.__name__, e))
+    return written, errors
+
+
+class PageCache:
+    """
+    Pages decoded into `AtlasBuffer`s, by path. A page in use by queued batches is never dropped,
+    the least recently used idle ones are once there are more than `limit`.
+    """
+
+    def __init__(self, limit: int = PAGE_CACHE_LIMIT):
+        self.limit = limit
+        self._pages: Dict[str, Tuple[AtlasBuffer, float]] = OrderedDict()
+        self._users: Dict[str, int] = dict()
+        self._lock = Lock()
+        self.decoded = 0
+        self.reused = 0
+
+    def acquire(self, where: str):
+        where = abspath(where)
+        with self._lock:
+            page = self._pages.get(where)
+            if page is not None:
+                self._pages.move_to_end(where)
+                self._users[where] += 1
+                self.reused += 1
+                return page[0]
+        # decoded outside of the lock, only the submit thread acquires
+        begin = perf_counter()
+        buffer = AtlasBuffer.create(where)
+        with self._lock:
+            self._pages[where] = (buffer, perf_counter() - begin)
+            self._users[where] = 1
+            self.decoded += 1
+            self._evict()
+        return buffer
+
+    def release(self, buffer: AtlasBuffer):
+        with self._lock:
+            for where, (cached, _) in self._pages.items():
+                if cached is buffer:
+                    self._users[where] -= 1
+                    break
+            self._evict()
+
+    def _evict(self):
+        idle = [where for where in self._pages if self._users[where] <= 0]
+        while len(self._pages) > self.limit and idle:
+            where = idle.pop(0)
+            buffer, _ = self._pages.pop(where)
+            self._users.pop(where)
+            buffer.remove()
+
+    def clear(self):
+        with self._lock:
+            for buffer, _ in self._pages.values():
+                buffer.remove()
+            self._pages.clear()
+            self._users.clear()
+
+
+class SpineAtlasResult:
+    def __init__(self, atlas_path: str, out_dir: str, ok: bool, regions: int = 0, failed: int = 0,
+                 elapsed: float = 0.0, error: str = None, unchanged: int = 0, removed: int = 0,
+                 skipped: bool = False):
+        self.atlas_path = atlas_path
+        self.out_dir = out_dir
+        self.ok = ok
+        self.regions = regions
+        self.failed = failed
+        self.elapsed = elapsed
+        self.error = error
+        self.unchanged = unchanged
+        self.removed = removed
+        self.skipped = skipped
+
+
+class _Plan:
+    """What is left to do for an atlas: the regions to write by page, the rest being up to date."""
+
+    def __init__(self, atlas_path: str, out_dir: str, output: ImageOutput):
+        self.atlas_path = atlas_path
+        self.out_dir = out_dir
+        self.begin = perf_counter()
+        self.manifest = AtlasManifest(output.extension, output.signature())
+        # output name -> region key
+        self.keys: Dict[str, str] = dict()
+        self.batches: List[Tuple[str, List[AtlasRegion]]] = []
+        self.unchanged = 0
+        self.removed = 0
+        self.skipped = False
+
+
+class _Running:
+    def __init__(self, plan: _Plan):
+        self.plan = plan
+        self.done = 0
+        self.saved = 0
+        self.failed = 0
+        self.errors: List[str] = []
+
+
+class SpineBatchExtractor:
+    """
+    Extract the regions of many Spine atlases: every page is decoded once into a shared cache,
+    regions are restored and saved in batches by one process pool, results are collected per atlas by `poll`.
+    With `incremental` an `AtlasManifest` in each output folder tells which outputs are still up to date,
+    only the others are written and only outputs of regions gone from the atlas are deleted;
+    otherwise the output folder is cleared first, as a full extraction.
+    """
+
+    def __init__(self, max_workers: int = None, page_cache: PageCache = None, incremental: bool = True,
+                 output: ImageOutput = None):
+        self._max_workers = max_workers or cpu_count() or 1
+        self.incremental = incremental
+        self.output = output or ImageOutput()
+        self.page_cache = page_cache if page_cache is not None else PageCache()
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._futures: Dict[Future, Tuple[_Running, AtlasBuffer, int]] = dict()
+        self._results: SimpleQueue = SimpleQueue()
+        self._lock = Lock()
+        self._total = 0
+        self._collected = 0
+        self._regions = 0
+        self._stopped = False
+        self._thread: Optional[Thread] = None
+        self._begin = 0.0
+
+    def start(self, jobs: List[Tuple[str, str]]):
+        """`jobs` are (atlas path, output folder) pairs."""
+        self._total = len(jobs)
+        self._collected = 0
+        self._regions = 0
+        self._begin = perf_counter()
+        if self._total == 0:
+            return
+        self._thread = Thread(target=self._submit, args=(jobs,), daemon=True)
+        self._thread.start()
+
+    def _plan(self, atlas_path: str, dst_dir: str):
+        plan = _Plan(atlas_path, dst_dir, self.output)
+        if self.incremental:
+            previous = AtlasManifest.load(dst_dir)
+            if previous.extension != self.output.extension:
+                # written in another format, none of the outputs can be kept
+                plan.removed = previous.remove_stale(dst_dir, ())
+        else:
+            previous = AtlasManifest()
+            if exists(dst_dir):
+                rmtree(dst_dir)
+        atlas_hash = file_hash(atlas_path)
+        if atlas_hash == previous.atlas_hash and previous.output == self.output.signature() and \
+                previous.pages_unchanged(dirname(atlas_path)) and previous.complete(dst_dir):
+            plan.unchanged = len(previous.outputs)
+            plan.skipped = True
+            return plan
+
+        atlas = AtlasParser.parse(atlas_path)
+        plan.manifest.atlas_hash = atlas_hash
+        for page in atlas.pages:
+            page_path = atlas.page_path(page)
+            page_hash = plan.manifest.page_hash(page.name, page_path, previous)
+            todo = []
+            for region in atlas.page_regions(page):
+                name = region.output_name
+                key = region_key(region, page_hash, self.output.signature())
+                plan.keys[name] = key
+                if previous.intact(dst_dir, name, key):
+                    plan.manifest.outputs[name] = previous.outputs[name]
+                    plan.unchanged += 1
+                else:
+                    todo.append(region)
+            for i in range(0, len(todo), BATCH_SIZE):
+                plan.batches.append((page_path, todo[i:i + BATCH_SIZE]))
+        plan.manifest.regions = len(plan.keys)
+        plan.removed += previous.remove_stale(dst_dir, plan.keys)
+
+        # every folder once, not per region and path segment
+        makedirs(dst_dir, exist_ok=True)
+        folders = {dirname(region_target(dst_dir, region, self.output))
+                   for _, regions in plan.batches for region in regions}
+        for folder in sorted(folders):
+            makedirs(folder, exist_ok=True)
+        return plan
+
+    def _submit(self, jobs: List[Tuple[str, str]]):
+        for atlas_path, dst_dir in jobs:
+            if self._stopped:
+                return
+            try:
+                plan = self._plan(atlas_path, dst_dir)
+                if not plan.batches and not plan.skipped:
+                    plan.manifest.save(dst_dir)
+            except Exception as e:
+                self._results.put(SpineAtlasResult(atlas_path, dst_dir, False,
+                                                   error='{}: {}'.format(e.__class__.__name__, e)))
+                continue
+            if not plan.batches:
+                self._results.put(SpineAtlasResult(atlas_path, dst_dir, True, elapsed=perf_counter() - plan.begin,
+                                                   unchanged=plan.unchanged, removed=plan.removed,
+                                                   skipped=plan.skipped))
+                continue
+
+            running = _Running(plan)
+            for page_path, regions in plan.batches:
+                try:
+                    buffer = self.page_cache.acquire(page_path)
+                except Exception as e:
+                    self._batch_done(running, [], len(regions), ['{}: {}: {}'.format(
+                        page_path, e.__class__.__name__, e)])
+                    continue
+                with self._lock:
+                    if self._stopped:
+                        self.page_cache.release(buffer)
+                        return
+                    if self._executor is None:
+                        self._executor = ProcessPoolExecutor(max_workers=self._max_workers)
+                    future = self._executor.submit(restore_in_worker, buffer, regions, dst_dir, self.output)
+                    self._futures[future] = (running, buffer, len(regions))
+                future.add_done_callback(self._on_done)
+
+    def _on_done(self, future: Future):
+        with self._lock:
+            running, buffer, size = self._futures.pop(future, (None, None, 0))
+        if running is None:
+            return
+        self.page_cache.release(buffer)
+        if future.cancelled():
+            self._batch_done(running, [], size, [])
+        elif future.exception() is not None:
+            error = future.exception()
+            self._batch_done(running, [], size, ['{}: {}'.format(error.__class__.__name__, error)])
+        else:
+            written, errors = future.result()
+            self._batch_done(running, written, len(errors), errors)
+
+    def _batch_done(self, running: _Running, written: List[Tuple], failed: int, errors: List[str]):
+        plan = running.plan
+        with self._lock:
+            running.done += 1
+            running.saved += len(written)
+            running.failed += failed
+            running.errors.extend(errors)
+            for name, output_hash, stamp in written:
+                plan.manifest.record(name, plan.keys[name], output_hash, stamp)
+            finished = running.done == len(plan.batches)
+        if not finished:
+            return
+        error = '\n'.join(running.errors) or None
+        try:
+            # failed outputs are not recorded, they are written again next time
+            plan.manifest.save(plan.out_dir)
+        except OSError as e:
+            error = '\n'.join(filter(None, (error, '{}: {}'.format(e.__class__.__name__, e))))
+        self._results.put(SpineAtlasResult(plan.atlas_path, plan.out_dir, error is None,
+                                           regions=running.saved, failed=running.failed,
+                                           elapsed=perf_counter() - plan.begin, error=error,
+                                           unchanged=plan.unchanged, removed=plan.removed))
+
+    def poll(self, limit: int = 64, wait: bool = False):
+        results = []
+        while len(results) < limit:
+            try:
+                if wait and not results:
+                    results.append(self._results.get(timeout=0.1))
+                else:
+                    results.append(self._results.get_nowait())
+            except Empty:
+                break
+        self._collected += len(results)
+        self._regions += sum(result.regions for result in results)
+        return results
+
+    def run(self, jobs: List[Tuple[str, str]]):
+        """Extract all `jobs` and block until done, for headless use."""
+        self.start(jobs)
+        results = []
+        while not self.finished():
+            results.extend(self.poll(wait=True))
+        self.shutdown()
+        return results
+
+    def total(self):
+        return self._total
+
+    def finished(self):
+        return self._collected >= self._total
+
+    def regions(self):
+        return self._regions
+
+    def elapsed(self):
+        return perf_counter() - self._begin
+
+    def regions_per_second(self):
+        return self._regions / max(self.elapsed(), 1e-9)
+
+    def shutdown(self, cancel: bool = False, wait: bool = True):
+        """Without `wait` the pool is joined and the page cache cleared by another thread, for callers on the GUI."""
+        with self._lock:
+            self._stopped = True
+            executor, self._executor = self._executor, None
+        if wait:
+            self._close(self._thread, executor, self.page_cache, cancel)
+        else:
+            Thread(target=self._close, args=(self._thread, executor, self.page_cache, cancel)).start()
+
+    @staticmethod
+    def _close(thread: Optional[Thread], executor: Optional[ProcessPoolExecutor], page_cache: PageCache,
+               cancel: bool):
+        # the submit thread stops at the next atlas or batch, a page it is decoding still ends up in the cache
+        if thread is not None:
+            thread.join()
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=cancel)
+        # the workers have unmapped the pages by now, which Windows wants before the files can go
+        page_cache.clear()
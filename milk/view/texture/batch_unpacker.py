@@ -0,0 +1,302 @@
+from concurrent.futures import Future, ProcessPoolExecutor
+from itertools import islice
+from os import cpu_count, stat
+from os.path import basename, dirname, exists, isdir, join, normpath, relpath, splitext
+from queue import Empty, SimpleQueue
+from threading import BoundedSemaphore, Lock, Thread
+from time import perf_counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from milk.image_output import ImageOutput
+from milk.scanner import scan_files
+from .frame_extractor import AtlasBuffer, BATCH_SIZE, extract_in_worker
+from .plist_parser import FrameTable, PlistFrame, PlistParser
+
+TEXTURE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp')
+
+
+class AtlasJob:
+    """One plist atlas to unpack: where its texture is and which folder its frames go to."""
+
+    def __init__(self, plist_path: str, out_dir: str):
+        self.plist_path = plist_path
+        self.out_dir = out_dir
+        self.texture_path: Optional[str] = None
+        self.frames = FrameTable()
+
+
+class AtlasResult:
+    def __init__(self, job: AtlasJob, ok: bool, skipped: bool = False, frames: int = 0, failed: int = 0,
+                 error: str = None):
+        self.plist_path = job.plist_path
+        self.texture_path = job.texture_path
+        self.out_dir = job.out_dir
+        self.ok = ok
+        self.skipped = skipped
+        self.frames = frames
+        self.failed = failed
+        self.error = error
+
+
+def find_atlases(paths: Iterable[str], out_root: str = None):
+    """
+    Every `.plist` under `paths` as an `AtlasJob`. Frames go to a folder named after the plist, next to it,
+    or under `out_root` in the same layout as below the path it was found in.
+    """
+    jobs = []
+    for path in paths:
+        if isdir(path):
+            found = [entry.path for entry in scan_files([path], ('.plist',))]
+            base = path
+        else:
+            found = [path]
+            base = dirname(path)
+        for plist_path in found:
+            stem = splitext(basename(plist_path))[0]
+            if out_root is None:
+                out_dir = join(dirname(plist_path), stem)
+            else:
+                out_dir = join(out_root, relpath(dirname(plist_path), base), stem)
+            jobs.append(AtlasJob(normpath(plist_path), normpath(out_dir)))
+    return jobs
+
+
+def find_texture(plist_path: str, texture_name: Optional[str]):
+    """The texture named by the plist metadata, else a picture with the same name as the plist."""
+    folder = dirname(plist_path)
+    if texture_name:
+        where = join(folder, texture_name)
+        if exists(where):
+            return where
+    stem = splitext(plist_path)[0]
+    for ext in TEXTURE_EXTENSIONS:
+        if exists(stem + ext):
+            return stem + ext
+    return None
+
+
+def is_unpacked(job: AtlasJob, output: ImageOutput = None):
+    """Whether every frame of `job` was written by `output` after both the plist and the texture last changed."""
+    output = output or ImageOutput()
+    changed_at = max(stat(job.plist_path).st_mtime, stat(job.texture_path).st_mtime)
+    for frame in job.frames:
+        try:
+            if stat(output.target(join(job.out_dir, frame.name))).st_mtime < changed_at:
+                return False
+        except OSError:
+            return False
+    return True
+
+
+class _Running:
+    def __init__(self, job: AtlasJob, buffer: AtlasBuffer):
+        self.job = job
+        self.buffer = buffer
+        self.batches = 0
+        self.done = 0
+        self.failed = 0
+        self.errors: List[str] = []
+        # set once the last batch was submitted, the atlas is finished when every batch is done by then
+        self.submitted = False
+
+
+class TextureBatchUnpacker:
+    """
+    Unpack many plist atlases: atlases already unpacked since their inputs last changed are skipped,
+    the frames of the others are cut by one process pool shared by all atlases. When there are no earlier outputs
+    to compare with, the frames are submitted in batches while the plist is still being read.
+    Results are collected per atlas by `poll` as they finish.
+    With `trim` the pictures lose their fully transparent border, see `extract_frame`.
+    """
+
+    def __init__(self, max_workers: int = None, force: bool = False, output: ImageOutput = None,
+                 trim: bool = False):
+        self._max_workers = max_workers or cpu_count() or 1
+        self._force = force
+        self.output = output or ImageOutput()
+        self.trim = trim
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._futures: Dict[Future, Tuple[_Running, int]] = dict()
+        # atlases decoded ahead of the pool, each holds a raw pixel file until its frames are written
+        self._pending = BoundedSemaphore(self._max_workers + 1)
+        self._results: SimpleQueue = SimpleQueue()
+        self._lock = Lock()
+        self._total = 0
+        self._collected = 0
+        self._frames = 0
+        self._stopped = False
+        self._begin = 0.0
+
+    def start(self, jobs: List[AtlasJob]):
+        self._total = len(jobs)
+        self._collected = 0
+        self._frames = 0
+        self._begin = perf_counter()
+        if self._total == 0:
+            return
+        Thread(target=self._submit, args=(jobs,), daemon=True).start()
+
+    def _frames_of(self, job: AtlasJob) -> Optional[Iterable[PlistFrame]]:
+        """
+        The frames to cut for `job`, None when it is skipped. They are streamed from the plist when nothing has to
+        be compared with earlier outputs and the texture is known before the frames are read.
+        """
+        if self._force or not exists(job.out_dir):
+            hint = PlistParser.texture_hint(job.plist_path)
+            job.texture_path = find_texture(job.plist_path, hint) if hint else None
+            if job.texture_path is not None:
+                job.frames = FrameTable()
+                return self._stream(job)
+        data = PlistParser.parse(job.plist_path)
+        job.frames = data.get("frames")
+        job.texture_path = find_texture(job.plist_path, data.get("texture"))
+        if job.texture_path is None:
+            raise FileNotFoundError('No texture for {}'.format(job.plist_path))
+        if not self._force and is_unpacked(job, self.output):
+            self._results.put(AtlasResult(job, True, skipped=True, frames=len(job.frames)))
+            return None
+        if not job.frames:
+            self._results.put(AtlasResult(job, True))
+            return None
+        return job.frames
+
+    @staticmethod
+    def _stream(job: AtlasJob):
+        for frame in PlistParser.iter_frames(job.plist_path):
+            job.frames.append(frame)
+            yield frame
+
+    def _submit(self, jobs: List[AtlasJob]):
+        for job in jobs:
+            try:
+                frames = self._frames_of(job)
+                if frames is None:
+                    continue
+                self._pending.acquire()
+                if self._stopped:
+                    return
+                try:
+                    buffer = AtlasBuffer.create(job.texture_path)
+                except BaseException:
+                    self._pending.release()
+                    raise
+            except Exception as e:
+                self._results.put(AtlasResult(job, False, error='{}: {}'.format(e.__class__.__name__, e)))
+                continue
+
+            running = _Running(job, buffer)
+            frames = iter(frames)
+            while True:
+                try:
+                    batch = list(islice(frames, BATCH_SIZE))
+                except Exception as e:
+                    # a plist which turns out broken halfway, the frames read before it are still cut
+                    running.errors.append('{}: {}'.format(e.__class__.__name__, e))
+                    batch = []
+                if not batch:
+                    break
+                with self._lock:
+                    if self._stopped:
+                        # the batches already submitted are cancelled or finishing, none reports this atlas
+                        buffer.remove()
+                        return
+                    if self._executor is None:
+                        self._executor = ProcessPoolExecutor(max_workers=self._max_workers)
+                    future = self._executor.submit(extract_in_worker, buffer, batch, job.out_dir, self.output,
+                                                   self.trim)
+                    self._futures[future] = (running, len(batch))
+                    running.batches += 1
+                future.add_done_callback(self._on_done)
+            with self._lock:
+                running.submitted = True
+                finished = running.done == running.batches
+            if finished:
+                self._finish(running)
+
+    def _on_done(self, future: Future):
+        with self._lock:
+            running, size = self._futures.pop(future, (None, 0))
+        if running is None:
+            return
+        if future.cancelled():
+            failed, errors = size, []
+        elif future.exception() is not None:
+            error = future.exception()
+            failed, errors = size, ['{}: {}'.format(error.__class__.__name__, error)]
+        else:
+            failed = 0
+            errors = []
+            for result in future.result():
+                if not result.ok:
+                    failed += 1
+                    errors.append('{}: {}'.format(result.target, result.error))
+        with self._lock:
+            running.done += 1
+            running.failed += failed
+            running.errors.extend(errors)
+            finished = running.submitted and running.done == running.batches
+        if finished:
+            self._finish(running)
+
+    def _finish(self, running: _Running):
+        running.buffer.remove()
+        self._pending.release()
+        job = running.job
+        ok = running.failed == 0 and not running.errors
+        self._results.put(AtlasResult(job, ok, frames=len(job.frames) - running.failed, failed=running.failed,
+                                      error='\n'.join(running.errors) or None))
+
+    def poll(self, limit: int = 64, wait: bool = False):
+        results = []
+        while len(results) < limit:
+            try:
+                if wait and not results:
+                    results.append(self._results.get(timeout=0.1))
+                else:
+                    results.append(self._results.get_nowait())
+            except Empty:
+                break
+        self._collected += len(results)
+        self._frames += sum(result.frames for result in results if not result.skipped)
+        return results
+
+    def run(self, jobs: List[AtlasJob]):
+        """Unpack all `jobs` and block until done, for headless use."""
+        self.start(jobs)
+        results = []
+        while not self.finished():
+            results.extend(self.poll(wait=True))
+        self.shutdown()
+        return results
+
+    def total(self):
+        return self._total
+
+    def finished(self):
+        return self._collected >= self._total
+
+    def frames(self):
+        """Frames written so far, skipped atlases not included."""
+        return self._frames
+
+    def elapsed(self):
+        return perf_counter() - self._begin
+
+    def frames_per_second(self):
+        return self._frames / max(self.elapsed(), 1e-9)
+
+    def shutdown(self, cancel: bool = False, wait: bool = True):
+        """Without `wait` the pool is joined by another thread, for callers on the GUI."""
+        with self._lock:
+            self._stopped = True
+            executor, self._executor = self._executor, None
+        # wakes the submit thread if it waits for a free slot, it sees the stop and returns
+        try:
+            self._pending.release()
+        except ValueError:
+            pass
+        if executor is not None:
+            if wait:
+                executor.shutdown(wait=True, cancel_futures=cancel)
+            else:
+                Thread(target=executor.shutdown, kwargs={'wait': True, 'cancel_futures': cancel}).start()
@@ -18,6 +18,42 @@ class UnpackerMenus:
                 "trigger": "on_save_one",
                 "hotkey": "Ctrl+Shift+S"
             },
+            {
+                "name": "texture_unpacker:menu_file:item_file_unpack_dir",
+                "icon": ResMap.img_folder_open,
+                "trigger": "on_unpack_dir",
+                "hotkey": "Ctrl+O"
+            },
         )
 
-    all = (MenuFile,)
+    class MenuOutput:
+        Name = "texture_unpacker:menu_output"
+        Actions = (
+            {
+                "name": "texture_unpacker:menu_output:item_png",
+                "trigger": "on_output_png",
+            },
+            {
+                "name": "texture_unpacker:menu_output:item_png_fast",
+                "trigger": "on_output_png_fast",
+            },
+            {
+                "name": "texture_unpacker:menu_output:item_png_small",
+                "trigger": "on_output_png_small",
+            },
+            {
+                "name": "texture_unpacker:menu_output:item_raw",
+                "trigger": "on_output_raw",
+            },
+        )
+
+    all = (MenuFile, MenuOutput)
+
+
+# `milk.image_output.OUTPUT_PRESETS` and their names
+OutputPresets = (
+    ("png", "texture_unpacker:menu_output:item_png"),
+    ("png-fast", "texture_unpacker:menu_output:item_png_fast"),
+    ("png-small", "texture_unpacker:menu_output:item_png_small"),
+    ("raw", "texture_unpacker:menu_output:item_raw"),
+)
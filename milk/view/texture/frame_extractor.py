@@ -0,0 +1,431 @@
+import mmap
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
+from os import close, cpu_count, makedirs, remove
+from os.path import dirname, join
+from queue import Empty, SimpleQueue
+from tempfile import mkstemp
+from itertools import islice
+from threading import local, Lock, Thread
+from time import perf_counter
+from typing import Dict, Iterable, Iterator, List, Optional, Sized, Tuple
+
+import numpy
+from PIL import Image
+
+from milk.image_output import ImageOutput
+from .plist_parser import PlistFrame
+
+# below this many frames the work is done in the submit thread, a process pool costs more to start
+INLINE_LIMIT = 16
+# frames handed to a worker at once, fewer round trips without starving the other workers at the end
+BATCH_SIZE = 64
+# atlases kept mapped in a worker, a shared pool may be working on several at a time
+MAPPED_LIMIT = 4
+
+
+def image_mode(image: Image.Image):
+    return "RGBA" if (image.mode in ('RGBA', 'LA') or (
+            image.mode == 'P' and 'transparency' in image.info)) else "RGB"
+
+
+class AtlasBuffer:
+    """
+    The atlas decoded once into a raw pixel file, which every worker maps read-only instead of decoding the png again.
+    Only the path, mode and size travel to the workers. RGB is stored padded as RGBX, so every pixel is 32 bits.
+    """
+
+    def __init__(self, where: str, mode: str, size: Tuple[int, int]):
+        self.where = where
+        self.mode = mode
+        self.size = size
+
+    @staticmethod
+    def create(image_path: str, temp_dir: str = None):
+        fd, where = mkstemp(prefix='.atlas-', suffix='.raw', dir=temp_dir)
+        close(fd)
+        try:
+            with Image.open(image_path) as image:
+                mode = 'RGBA' if image_mode(image) == 'RGBA' else 'RGBX'
+                pixels = image if image.mode == mode else image.convert(mode)
+                with open(where, 'wb') as f:
+                    f.write(pixels.tobytes())
+                return AtlasBuffer(where, mode, pixels.size)
+        except BaseException:
+            remove(where)
+            raise
+
+    def open(self):
+        """The pixels over a read-only mapping of the file."""
+        with open(self.where, 'rb') as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        width, height = self.size
+        return AtlasPixels(numpy.frombuffer(data, numpy.uint32).reshape(height, width), self.mode)
+
+    def remove(self):
+        try:
+            remove(self.where)
+        except OSError:
+            pass
+
+
+class FrameResult:
+    def __init__(self, name: str, target: str, ok: bool, error: str = None):
+        self.name = name
+        self.target = target
+        self.ok = ok
+        self.error = error
+
+
+class AtlasPixels:
+    """
+    The pixels of an atlas as a (height, width) array of 32 bits words, one RGBA or RGBX pixel each,
+    so a frame is cut, turned and placed a pixel at a time rather than a byte at a time.
+    """
+
+    def __init__(self, pixels: numpy.ndarray, mode: str):
+        self.pixels = pixels
+        self.mode = mode
+
+    @staticmethod
+    def of(image: Image.Image):
+        mode = 'RGBA' if image_mode(image) == 'RGBA' else 'RGBX'
+        pixels = numpy.asarray(image if image.mode == mode else image.convert(mode))
+        return AtlasPixels(pixels.view(numpy.uint32).reshape(pixels.shape[:2]), mode)
+
+    def to_image(self, pixels: numpy.ndarray):
+        """`pixels` (contiguous, from this atlas) as an image sharing its memory, RGBX is converted to RGB."""
+        height, width = pixels.shape
+        image = Image.frombuffer(self.mode, (width, height), pixels, 'raw', self.mode, 0, 1)
+        return image if self.mode == 'RGBA' else image.convert('RGB')
+
+
+def alpha_bbox(pixels: numpy.ndarray):
+    """(left, top, right, bottom) of the RGBA `pixels` which are not fully transparent, None when there are none."""
+    alpha = pixels.view(numpy.uint8).reshape(pixels.shape + (4,))[:, :, 3]
+    rows = numpy.flatnonzero(alpha.any(axis=1))
+    if rows.size == 0:
+        return None
+    columns = numpy.flatnonzero(alpha.any(axis=0))
+    return int(columns[0]), int(rows[0]), int(columns[-1]) + 1, int(rows[-1]) + 1
+
+
+_local = local()
+# rotated frames are copied in square tiles, a whole-frame transposed copy misses the cache on every pixel
+_ROTATE_TILE = 128
+
+
+def _canvas(height: int, width: int):
+    # one growing buffer per thread, every frame is written into it instead of a new image
+    size = height * width
+    buffer = getattr(_local, 'canvas', None)
+    if buffer is None or buffer.size < size:
+        buffer = _local.canvas = numpy.empty(max(size, 1 << 18), numpy.uint32)
+    return buffer[:size].reshape(height, width)
+
+
+def _rotate_into(out: numpy.ndarray, region: numpy.ndarray):
+    # out = rot90(region), counter-clockwise
+    h, w = region.shape
+    for r in range(0, h, _ROTATE_TILE):
+        for c in range(0, w, _ROTATE_TILE):
+            tile = region[r:r + _ROTATE_TILE, c:c + _ROTATE_TILE]
+            out[w - c - tile.shape[1]:w - c, r:r + tile.shape[0]] = numpy.rot90(tile)
+
+
+def reconstruct(atlas: AtlasPixels, frame: PlistFrame):
+    """
+    The untrimmed picture of `frame`, as 32 bits pixels like those of `atlas`.
+    The array is a view on a buffer reused by the next call in the same thread, copy it to keep it.
+    """
+    region = atlas.pixels[frame.y:frame.y + frame.h, frame.x:frame.x + frame.w]
+    if region.shape != (frame.h, frame.w):
+        # the rect runs out of the atlas, what is missing is transparent
+        padded = numpy.zeros((frame.h, frame.w), numpy.uint32)
+        padded[:region.shape[0], :region.shape[1]] = region
+        region = padded
+    h, w = (frame.w, frame.h) if frame.rotated else (frame.h, frame.w)
+    out = _canvas(frame.sh, frame.sw)
+    x0, y0 = max(frame.ox, 0), max(frame.oy, 0)
+    x1, y1 = min(frame.ox + w, frame.sw), min(frame.oy + h, frame.sh)
+    if (x0, y0, x1, y1) != (0, 0, frame.sw, frame.sh) or (w, h) != (frame.sw, frame.sh):
+        out.fill(0)
+    if x1 <= x0 or y1 <= y0:
+        return out
+    if frame.rotated:
+        # stored turned 90 degrees clockwise
+        if (x0, y0, x1, y1) == (frame.ox, frame.oy, frame.ox + w, frame.oy + h):
+            _rotate_into(out[y0:y1, x0:x1], region)
+            return out
+        region = numpy.rot90(region)
+    out[y0:y1, x0:x1] = region[y0 - frame.oy:y1 - frame.oy, x0 - frame.ox:x1 - frame.ox]
+    return out
+
+
+def reconstruct_frames(atlas: AtlasPixels, frames: Iterable[PlistFrame]):
+    """(frame, pixels) for each frame without encoding anything, for in-memory checks like unpack -> repack."""
+    for frame in frames:
+        yield frame, reconstruct(atlas, frame)
+
+
+def extract_frame(atlas: AtlasPixels, frame: PlistFrame, save_at: str, output: ImageOutput = None,
+                  trim: bool = False):
+    """
+    Write `frame` at `save_at`, which already has the extension of `output`, a default png when not given.
+    With `trim` its fully transparent border is cut off, a frame with nothing visible is written whole.
+    """
+    pixels = reconstruct(atlas, frame)
+    if trim and atlas.mode == 'RGBA':
+        bbox = alpha_bbox(pixels)
+        if bbox is not None:
+            left, top, right, bottom = bbox
+            pixels = numpy.ascontiguousarray(pixels[top:bottom, left:right])
+    makedirs(dirname(save_at) or '.', exist_ok=True)
+    (output or ImageOutput()).save(atlas.to_image(pixels), save_at)
+
+
+def extract_frames(atlas: AtlasPixels, frames: List[PlistFrame], out_dir: str, output: ImageOutput = None,
+                   trim: bool = False):
+    output = output or ImageOutput()
+    results = []
+    for frame in frames:
+        name = frame.name
+        save_at = output.target(join(out_dir, name))
+        try:
+            extract_frame(atlas, frame, save_at, output, trim)
+            results.append(FrameResult(name, save_at, True))
+        except Exception as e:
+            results.append(FrameResult(name, save_at, False, '{}: {}'.format(e.__class__.__name__, e)))
+    return results
+
+
+_mapped: Dict[str, AtlasPixels] = OrderedDict()
+
+
+def extract_in_worker(buffer: AtlasBuffer, frames: List[PlistFrame], out_dir: str, output: ImageOutput = None,
+                      trim: bool = False):
+    atlas = _mapped.get(buffer.where)
+    if atlas is None:
+        atlas = buffer.open()
+        _mapped[buffer.where] = atlas
+        while len(_mapped) > MAPPED_LIMIT:
+            _mapped.popitem(last=False)
+    else:
+        _mapped.move_to_end(buffer.where)
+    return extract_frames(atlas, frames, out_dir, output, trim)
+
+
+class FrameExtractor:
+    """
+    Save the frames of a texture atlas as pictures. The atlas is decoded once, large atlases are shared with
+    a process pool through an `AtlasBuffer` and cut in batches, results are collected by `poll` as they finish.
+    With `trim` the pictures lose their fully transparent border, see `extract_frame`.
+    """
+
+    def __init__(self, max_workers: int = None, inline_limit: int = INLINE_LIMIT, output: ImageOutput = None,
+                 trim: bool = False):
+        self._max_workers = max_workers or cpu_count() or 1
+        self._inline_limit = inline_limit
+        self.output = output or ImageOutput()
+        self.trim = trim
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._futures: Dict[Future, List[PlistFrame]] = dict()
+        self._buffer: Optional[AtlasBuffer] = None
+        self._results: SimpleQueue = SimpleQueue()
+        self._lock = Lock()
+        self._out_dir = ''
+        self._total = 0
+        self._collected = 0
+        self._error: Optional[str] = None
+        self._submitting = False
+        self._stopped = False
+        self._begin = 0.0
+
+    def start(self, image_path: str, frames: Iterable[PlistFrame], out_dir: str):
+        """
+        `frames` may be any iterable, like `PlistParser.iter_frames`, frames are sent to the pool while more are
+        still being read. An error raised by the iterable ends the submission and is kept for `error`.
+        """
+        self._out_dir = out_dir
+        self._total = 0
+        self._collected = 0
+        self._error = None
+        self._submitting = True
+        self._begin = perf_counter()
+        Thread(target=self._submit, args=(image_path, frames), daemon=True).start()
+
+    def _take(self, frames: Iterator[PlistFrame], count: Optional[int]):
+        batch = list(islice(frames, count))
+        with self._lock:
+            self._total += len(batch)
+        return batch
+
+    def _fail_all(self, frames: List[PlistFrame], error: str):
+        for frame in frames:
+            name = frame.name
+            self._results.put(FrameResult(name, self.output.target(join(self._out_dir, name)), False, error))
+
+    def _extract_inline(self, image_path: str, frames: List[PlistFrame]):
+        try:
+            with Image.open(image_path) as image:
+                atlas = AtlasPixels.of(image)
+                for result in extract_frames(atlas, frames, self._out_dir, self.output, self.trim):
+                    self._results.put(result)
+        except Exception as e:
+            self._fail_all(frames, '{}: {}'.format(e.__class__.__name__, e))
+
+    def _submit(self, image_path: str, frames: Iterable[PlistFrame]):
+        workers = self._max_workers
+        size = BATCH_SIZE
+        if isinstance(frames, Sized) and len(frames) > 0:
+            workers = min(workers, len(frames))
+            size = max(1, min(BATCH_SIZE, -(-len(frames) // (workers * 4))))
+        frames = iter(frames)
+        try:
+            batch = self._take(frames, self._inline_limit + 1)
+            if len(batch) <= self._inline_limit:
+                self._extract_inline(image_path, batch)
+                return
+            try:
+                buffer = AtlasBuffer.create(image_path)
+            except Exception as e:
+                self._fail_all(batch + self._take(frames, None), '{}: {}'.format(e.__class__.__name__, e))
+                return
+            with self._lock:
+                if self._stopped:
+                    buffer.remove()
+                    return
+                self._buffer = buffer
+                self._executor = ProcessPoolExecutor(max_workers=workers)
+            while batch:
+                for i in range(0, len(batch), size):
+                    with self._lock:
+                        if self._stopped:
+                            return
+                        future = self._executor.submit(extract_in_worker, buffer, batch[i:i + size], self._out_dir,
+                                                       self.output, self.trim)
+                        self._futures[future] = batch[i:i + size]
+                    future.add_done_callback(self._on_done)
+                batch = self._take(frames, size)
+        except Exception as e:
+            self._error = '{}: {}'.format(e.__class__.__name__, e)
+        finally:
+            self._submitting = False
+
+    def _on_done(self, future: Future):
+        with self._lock:
+            batch = self._futures.pop(future, None)
+        if future.cancelled() or batch is None:
+            return
+        error = future.exception()
+        if error is not None:
+            self._fail_all(batch, '{}: {}'.format(error.__class__.__name__, error))
+        else:
+            for result in future.result():
+                self._results.put(result)
+
+    def poll(self, limit: int = 256, wait: bool = False):
+        results = []
+        while len(results) < limit:
+            try:
+                if wait and not results:
+                    results.append(self._results.get(timeout=0.1))
+                else:
+                    results.append(self._results.get_nowait())
+            except Empty:
+                break
+        self._collected += len(results)
+        return results
+
+    def run(self, image_path: str, frames: Iterable[PlistFrame], out_dir: str):
+        """Extract all `frames` and block until done, for headless use."""
+        self.start(image_path, frames, out_dir)
+        results = []
+        while not self.finished():
+            results.extend(self.poll(wait=True))
+        self.shutdown()
+        return results
+
+    def total(self):
+        return self._total
+
+    def collected(self):
+        return self._collected
+
+    def finished(self):
+        return not self._submitting and self._collected >= self._total
+
+    def error(self):
+        """Why reading the frames stopped early, if it did."""
+        return self._error
+
+    def elapsed(self):
+        return perf_counter() - self._begin
+
+    def shutdown(self, cancel: bool = False, wait: bool = True):
+        """Without `wait` the pool is joined and the atlas buffer removed by another thread, for callers on the GUI."""
+        with self._lock:
+            self._stopped = True
+            executor, self._executor = self._executor, None
+            buffer, self._buffer = self._buffer, None
+        if wait:
+            self._close(executor, buffer, cancel)
+        else:
+            Thread(target=self._close, args=(executor, buffer, cancel)).start()
+
+    @staticmethod
+    def _close(executor: Optional[ProcessPoolExecutor], buffer: Optional[AtlasBuffer], cancel: bool):
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=cancel)
+        # the workers have unmapped the atlas by now, which Windows wants before the file can go
+        if buffer is not None:
+            buffer.remove()
+
+
+if __name__ == '__main__':
+    import sys
+    from tempfile import TemporaryDirectory
+
+    from milk.image_output import OUTPUT_PRESETS
+    from milk.view.texture.plist_parser import PlistParser
+
+    # python -m milk.view.texture.frame_extractor <plist> <png>, or a generated 4096x4096 sheet of 2000 frames
+    with TemporaryDirectory() as temp:
+        if len(sys.argv) > 2:
+            sheet_path, sheet_frames = sys.argv[2], PlistParser.parse(sys.argv[1]).get("frames")
+        else:
+            sheet_path = join(temp, 'sheet.png')
+            Image.effect_noise((4096, 4096), 64).convert('RGBA').save(sheet_path, compress_level=1)
+            sheet_frames = []
+            for n in range(2000):
+                x, y = (n % 45) * 90, (n // 45) * 90
+                rotated = n % 3 == 0
+                w, h = (60, 80) if rotated else (80, 60)
+                sheet_frames.append(PlistFrame('f{}.png'.format(n), rotated, x, y, w, h, 5, 5, 90, 70))
+
+        # unpack -> repack in memory: every frame put back where it was cut from gives the atlas region again
+        with Image.open(sheet_path) as sheet:
+            sheet_pixels = AtlasPixels.of(sheet)
+        sheet_frames = list(sheet_frames)
+        begin = perf_counter()
+        same = 0
+        for sheet_frame, picture in reconstruct_frames(sheet_pixels, sheet_frames):
+            ph, pw = (sheet_frame.w, sheet_frame.h) if sheet_frame.rotated else (sheet_frame.h, sheet_frame.w)
+            placed = picture[sheet_frame.oy:sheet_frame.oy + ph, sheet_frame.ox:sheet_frame.ox + pw]
+            if sheet_frame.rotated:
+                placed = numpy.rot90(placed, -1)
+            same += numpy.array_equal(placed, sheet_pixels.pixels[sheet_frame.y:sheet_frame.y + sheet_frame.h,
+                                                                  sheet_frame.x:sheet_frame.x + sheet_frame.w])
+        print('round trip: {}/{} frames identical in {:.3f}s'.format(same, len(sheet_frames), perf_counter() - begin))
+
+        for jobs in sorted({1, cpu_count() or 1}):
+            extractor = FrameExtractor(max_workers=jobs, inline_limit=0)
+            done = extractor.run(sheet_path, sheet_frames, join(temp, 'out{}'.format(jobs)))
+            print('{} workers: {} frames, {} failed, {:.2f}s'.format(
+                jobs, len(done), sum(not r.ok for r in done), extractor.elapsed()))
+
+        for preset, output in OUTPUT_PRESETS.items():
+            extractor = FrameExtractor(inline_limit=0, output=output)
+            done = extractor.run(sheet_path, sheet_frames, join(temp, preset))
+            print('{}: {} frames, {} failed, {:.2f}s'.format(
+                preset, len(done), sum(not r.ok for r in done), extractor.elapsed()))
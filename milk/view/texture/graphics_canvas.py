@@ -1,21 +1,39 @@
 from os.path import abspath, basename, dirname, exists, join
 
-from PyQt5.QtCore import pyqtSignal, pyqtSlot, QRectF
-from PyQt5.QtGui import QBrush, QColor, QPen, QPixmap
+from PyQt5.QtCore import pyqtSignal, pyqtSlot, QRectF, Qt
+from PyQt5.QtGui import QBrush, QColor, QPen
 from PyQt5.QtWidgets import QGraphicsScene, QGraphicsSceneDragDropEvent, QGraphicsView
 
-from milk.conf import LangUI
+from milk.conf import LangUI, signals
+from .tiled_image import ImagePyramid, PyramidLoader, TiledImageItem
+
+ZOOM_STEP = 1.25
+ZOOM_MIN = 1 / 64
+ZOOM_MAX = 16
 
 
 class ResizableGraphicsView(QGraphicsView):
     resize_event = pyqtSignal()
 
+    def __init__(self):
+        super(ResizableGraphicsView, self).__init__()
+        self.setDragMode(QGraphicsView.ScrollHandDrag)
+        self.setTransformationAnchor(QGraphicsView.AnchorUnderMouse)
+        self.setAlignment(Qt.AlignLeft | Qt.AlignTop)
+
     @pyqtSlot()
     def resizeEvent(self, evt):
         # noinspection PyUnresolvedReferences
         self.resize_event.emit()
         evt.accept()
 
+    def wheelEvent(self, evt):
+        step = ZOOM_STEP if evt.angleDelta().y() > 0 else 1 / ZOOM_STEP
+        zoom = self.transform().m11() * step
+        if ZOOM_MIN <= zoom <= ZOOM_MAX:
+            self.scale(step, step)
+        evt.accept()
+
 
 class DroppableGraphicsScene(QGraphicsScene):
     image_dropped = pyqtSignal(str)
@@ -31,18 +49,29 @@ class DroppableGraphicsScene(QGraphicsScene):
         self.image_path = None
         self.plist_path = None
         self.__selected_rect = None
+        self.__image_item = None
+        self.__loader = PyramidLoader()
+        # noinspection PyUnresolvedReferences
+        self.__loader.loaded.connect(self.__on_image_loaded)
+        # noinspection PyUnresolvedReferences
+        self.__loader.failed.connect(self.__on_image_failed)
         self.reset(True)
 
     def click_rect(self, rect: QRectF):
-        if self.__selected_rect:
-            self.removeItem(self.__selected_rect)
-            self.__selected_rect = None
-        pen = QPen(QColor("#00000000"))
-        brush = QBrush(QColor(193, 44, 31, 80))
-        self.__selected_rect = self.addRect(rect, pen=pen, brush=brush)
+        if self.__selected_rect is None:
+            pen = QPen(QColor("#00000000"))
+            brush = QBrush(QColor(193, 44, 31, 80))
+            self.__selected_rect = self.addRect(rect, pen=pen, brush=brush)
+            self.__selected_rect.setZValue(1)
+        else:
+            self.__selected_rect.setRect(rect)
+        self.__selected_rect.ensureVisible()
 
     def __resize(self):
-        self.setSceneRect(0, 0, self.image_view.width(), self.image_view.height())
+        rect = QRectF(0, 0, self.image_view.width(), self.image_view.height())
+        if self.__image_item is not None:
+            rect = rect.united(self.__image_item.boundingRect())
+        self.setSceneRect(rect)
 
     def dragEnterEvent(self, event):
         urls = event.mimeData().urls()
@@ -87,13 +116,33 @@ class DroppableGraphicsScene(QGraphicsScene):
     def __apply_image(self):
         if self.image_path and self.plist_path and exists(self.plist_path) and exists(self.image_path):
             self.reset()
-            self.addPixmap(QPixmap(self.image_path))
+            # decoded and scaled down off the GUI thread, the tip stays until it is ready
+            self.addText(LangUI.texture_unpacker_ui_loading.format(self.image_path))
+            self.__loader.load(self.image_path)
         else:
             self.reset(True)
 
+    def __on_image_loaded(self, ticket: int, pyramid: ImagePyramid):
+        if ticket != self.__loader.ticket:
+            return
+        self.clear()
+        self.__selected_rect = None
+        self.__image_item = TiledImageItem(pyramid)
+        self.addItem(self.__image_item)
+        self.__resize()
+
+    def __on_image_failed(self, ticket: int, error: str):
+        if ticket != self.__loader.ticket:
+            return
+        signals.logger_error.emit('{0}: {1}'.format(self.image_path, error))
+        self.reset(True)
+
     def reset(self, force: bool = False):
+        self.__loader.cancel()
         self.clear()
         self.__selected_rect = None
+        self.__image_item = None
+        self.image_view.resetTransform()
         if force:
             self.plist_path = None
             self.image_path = None
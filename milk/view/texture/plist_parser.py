@@ -1,7 +1,88 @@
+import mmap
 import plistlib
-from pprint import pprint
 import re
 from os.path import exists
+from typing import Dict, List, Optional
+from xml.etree.ElementTree import iterparse, ParseError
+from xml.sax.saxutils import unescape
+
+BINARY_PLIST_HEADER = b'bplist'
+
+# '{{1,2},{3,4}}' -> '1,2,3,4'
+_BRACES = str.maketrans('', '', '{} ')
+
+_TEXTURE_KEY = b'<key>textureFileName</key>'
+_TEXTURE_VALUE = re.compile(rb'<key>textureFileName</key>\s*<string>([^<]*)</string>')
+
+
+class PlistFrame:
+    """One frame of an atlas: where it is cut from the texture (x, y, w, h, already swapped when rotated),
+    where it goes in its untrimmed picture (ox, oy) and the size of that picture (sw, sh)."""
+
+    __slots__ = ('name', 'rotated', 'x', 'y', 'w', 'h', 'ox', 'oy', 'sw', 'sh')
+
+    def __init__(self, name: str, rotated: bool, x: int, y: int, w: int, h: int, ox: int, oy: int, sw: int, sh: int):
+        self.name = name
+        self.rotated = rotated
+        self.x = x
+        self.y = y
+        self.w = w
+        self.h = h
+        self.ox = ox
+        self.oy = oy
+        self.sw = sw
+        self.sh = sh
+
+    @property
+    def source_size(self):
+        return self.sw, self.sh
+
+    @property
+    def offset(self):
+        return self.ox, self.oy
+
+    @property
+    def frame_rect(self):
+        return self.x, self.y, self.w, self.h
+
+    @property
+    def crop_rect(self):
+        return self.x, self.y, self.x + self.w, self.y + self.h
+
+    def __getstate__(self):
+        return tuple(getattr(self, key) for key in self.__slots__)
+
+    def __setstate__(self, state):
+        for key, value in zip(self.__slots__, state):
+            setattr(self, key, value)
+
+
+class FrameTable:
+    """The frames of an atlas in plist order, with a name index."""
+
+    def __init__(self):
+        self.frames: List[PlistFrame] = []
+        self.index: Dict[str, int] = dict()
+
+    def append(self, frame: PlistFrame):
+        self.index[frame.name] = len(self.frames)
+        self.frames.append(frame)
+
+    def find(self, name: str):
+        at = self.index.get(name)
+        return self.frames[at] if at is not None else None
+
+    def names(self):
+        return [frame.name for frame in self.frames]
+
+    def __len__(self):
+        return len(self.frames)
+
+    def __iter__(self):
+        return iter(self.frames)
+
+    def __getitem__(self, item):
+        return self.frames[item]
 
 
 class PlistParser:
@@ -19,103 +100,164 @@ class PlistParser:
 
     @staticmethod
     def parse(plist_path):
-        if not exists(plist_path):
-            raise PlistParser.FileNotFoundException("No such file: {0}".format(plist_path))
-
-        try:
-            with open(plist_path, 'rb') as f:
-                plist_dict = plistlib.load(f)
-        except plistlib.InvalidFileException:
+        reader = PlistReader(plist_path)
+        frames = FrameTable()
+        for frame in reader:
+            frames.append(frame)
+        if len(frames) == 0:
             raise PlistParser.InvalidFileException("Invalid plist file: {0}".format(plist_path))
+        return {
+            "frames": frames,
+            "texture": reader.texture
+        }
 
-        try:
-            if isinstance(plist_dict, dict) and plist_dict.get("frames") and plist_dict.get(
-                    "metadata"):
-                metadata = plist_dict.get("metadata")
-                plist_format = metadata.get("format")
-                texture_name = metadata.get("textureFileName")
-                plist_frames = plist_dict.get("frames")
-
-                if plist_format not in (0, 1, 2, 3):
-                    raise PlistParser.InvalidFormatException("Invalid plist format: {0}".format(plist_format))
-
-                result = {
-                    "frames": [],
-                    "texture": texture_name
-                }
-
-                if plist_format == 0:
-                    PlistParser.__parse_format_0(result, plist_frames)
-                elif plist_format == 1 or plist_format == 2:
-                    PlistParser.__parse_format_1x2(result, plist_frames)
-                elif plist_format == 3:
-                    PlistParser.__parse_format_3(result, plist_frames)
-
-                return result
-            else:
-                raise PlistParser.InvalidFileException("Invalid plist file: {0}".format(plist_path))
-        except ValueError:
-            raise PlistParser.FloatNotSupportException("Not support float value in frame")
+    @staticmethod
+    def iter_frames(plist_path):
+        """The frames of `plist_path` as they are read, see `PlistReader`."""
+        return iter(PlistReader(plist_path))
 
     @staticmethod
-    def __parse_format_0(result: dict, plist_frames: dict):
-        for (name, config) in plist_frames.items():
+    def texture_hint(plist_path: str) -> Optional[str]:
+        """
+        The `textureFileName` of an xml plist, found without parsing it: the metadata usually comes after
+        the frames, this tells the texture before `iter_frames` has read them. None for binary plists.
+        """
+        with open(plist_path, 'rb') as f:
             try:
-                ow = int(config.get("originalWidth", 0))
-                oh = int(config.get("originalHeight", 0))
-                sx = int(config.get("x", 0))
-                sy = int(config.get("y", 0))
-                ox = int(config.get("offsetX", 0))
-                oy = int(config.get("offsetY", 0))
-                result["frames"].append({
-                    "name": name,
-                    "rotated": False,
-                    "source_size": (ow, oh),
-                    "offset": (ox, oy),
-                    "frame_rect": (sx, sy, ow, oh),
-                    "crop_rect": (sx, sy, sx + ow, sy + oh)
-                })
-            except Exception as e:
-                print("parse format 0: ", e)
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                return None
+        with data:
+            if data[:len(BINARY_PLIST_HEADER)] == BINARY_PLIST_HEADER:
+                return None
+            at = data.rfind(_TEXTURE_KEY)
+            m = _TEXTURE_VALUE.match(data, at) if at >= 0 else None
+            return unescape(m.group(1).decode('utf-8')) if m is not None else None
 
-    @staticmethod
-    def __parse_format_1x2(result: dict, plist_frames: dict):
-        for (name, config) in plist_frames.items():
-            fx, fy, fw, fh = PlistParser.__extract_frame_field(config.get("frame"))
-            cx, cy = PlistParser.__extract_frame_field(config.get("offset"))
-            sw, sh = PlistParser.__extract_frame_field(config.get("sourceSize"))
-            rotated = config.get("rotated", False)
-            frame = PlistParser.__get_format1x2x3(name, rotated, fx, fy, fw, fh, cx, cy, sw, sh)
-            result["frames"].append(frame)
 
-    @staticmethod
-    def __parse_format_3(result: dict, plist_frames: dict):
-        for (name, config) in plist_frames.items():
-            fx, fy, fw, fh = PlistParser.__extract_frame_field(config.get("textureRect"))
-            cx, cy = PlistParser.__extract_frame_field(config.get("spriteOffset"))
-            sw, sh = PlistParser.__extract_frame_field(config.get("spriteSourceSize"))
-            rotated = config.get("textureRotated", False)
-            frame = PlistParser.__get_format1x2x3(name, rotated, fx, fy, fw, fh, cx, cy, sw, sh)
-            result["frames"].append(frame)
-        pprint("__parse_format_3: ")
-        pprint(result)
+def rect_field(text: str):
+    try:
+        return tuple(int(x) for x in text.translate(_BRACES).split(','))
+    except ValueError:
+        raise PlistParser.FloatNotSupportException("Not support float value in frame: {0}".format(text))
 
-    @staticmethod
-    def __get_format1x2x3(name, rotated, fx, fy, fw, fh, cx, cy, sw, sh):
-        ow, oh = (fh, fw) if rotated else (fw, fh)
 
-        return {
-            "name": name,
-            "rotated": rotated,
-            "source_size": (sw, sh),
-            "offset": (int(sw / 2 + cx - fw / 2), int(sh / 2 - cy - fh / 2)),
-            "frame_rect": (fx, fy, ow, oh),
-            "crop_rect": (fx, fy, fx + ow, fy + oh)
-        }
+def _value(elem):
+    tag = elem.tag
+    if tag == 'string':
+        return elem.text or ''
+    if tag == 'integer':
+        return int(elem.text)
+    if tag == 'real':
+        return float(elem.text)
+    if tag == 'true':
+        return True
+    if tag == 'false':
+        return False
+    if tag == 'dict':
+        children = list(elem)
+        return {children[i].text: _value(children[i + 1]) for i in range(0, len(children) - 1, 2)}
+    if tag == 'array':
+        return [_value(child) for child in elem]
+    return elem.text
 
-    @staticmethod
-    def __extract_frame_field(text):
+
+def _frame(name: str, config: dict):
+    if "textureRect" in config:
+        fx, fy, fw, fh = rect_field(config.get("textureRect"))
+        cx, cy = rect_field(config.get("spriteOffset"))
+        sw, sh = rect_field(config.get("spriteSourceSize"))
+        rotated = config.get("textureRotated", False)
+    elif "frame" in config:
+        fx, fy, fw, fh = rect_field(config.get("frame"))
+        cx, cy = rect_field(config.get("offset"))
+        sw, sh = rect_field(config.get("sourceSize"))
+        rotated = config.get("rotated", False)
+    else:
+        ow = int(config.get("originalWidth", 0))
+        oh = int(config.get("originalHeight", 0))
+        sx = int(config.get("x", 0))
+        sy = int(config.get("y", 0))
+        ox = int(config.get("offsetX", 0))
+        oy = int(config.get("offsetY", 0))
+        return PlistFrame(name, False, sx, sy, ow, oh, ox, oy, ow, oh)
+    ow, oh = (fh, fw) if rotated else (fw, fh)
+    return PlistFrame(name, rotated, fx, fy, ow, oh, int(sw / 2 + cx - fw / 2), int(sh / 2 - cy - fh / 2), sw, sh)
+
+
+class PlistReader:
+    """
+    Read the frames of a TexturePacker / Cocos2d-x plist one by one, an xml plist is streamed with `iterparse`
+    and each frame is dropped from the tree once converted, a binary plist is loaded at once.
+    The format is told by the keys of each frame, since `metadata` usually comes after `frames`;
+    `texture` and `format` are set once the metadata was read, and the metadata is checked after the last frame.
+    """
+
+    def __init__(self, plist_path: str):
+        if not exists(plist_path):
+            raise PlistParser.FileNotFoundException("No such file: {0}".format(plist_path))
+        self.plist_path = plist_path
+        self.texture: Optional[str] = None
+        self.format: Optional[int] = None
+
+    def __iter__(self):
+        with open(self.plist_path, 'rb') as f:
+            binary = f.read(len(BINARY_PLIST_HEADER)) == BINARY_PLIST_HEADER
+            f.seek(0)
+            if binary:
+                items, metadata = self._read_binary(f)
+            else:
+                items, metadata = self._read_xml(f), None
+            try:
+                for name, config in items:
+                    yield _frame(name, config)
+            except ParseError:
+                raise PlistParser.InvalidFileException("Invalid plist file: {0}".format(self.plist_path))
+        if metadata is not None:
+            self._set_metadata(metadata)
+        if self.format is None:
+            raise PlistParser.InvalidFileException("Invalid plist file: {0}".format(self.plist_path))
+
+    def _read_binary(self, f):
         try:
-            return (int(x) for x in re.sub(r"[{}]", "", text).split(','))
-        except Exception as e:
-            print("Fuck!", e)
+            plist_dict = plistlib.load(f)
+        except plistlib.InvalidFileException:
+            raise PlistParser.InvalidFileException("Invalid plist file: {0}".format(self.plist_path))
+        if not isinstance(plist_dict, dict) or not isinstance(plist_dict.get("frames"), dict):
+            raise PlistParser.InvalidFileException("Invalid plist file: {0}".format(self.plist_path))
+        return plist_dict.get("frames").items(), plist_dict.get("metadata")
+
+    def _read_xml(self, f):
+        # depth 1 <plist>, 2 the top <dict>, 3 its keys and values, 4 the keys and values of `frames`
+        depth = 0
+        top_key = None
+        name = None
+        frames = None
+        for event, elem in iterparse(f, events=('start', 'end')):
+            if event == 'start':
+                depth += 1
+                if depth == 3 and elem.tag == 'dict' and top_key == 'frames':
+                    frames = elem
+                continue
+            if depth == 3:
+                if elem.tag == 'key':
+                    top_key = elem.text
+                elif elem.tag == 'dict' and top_key == 'metadata':
+                    self._set_metadata(_value(elem))
+                    elem.clear()
+            elif depth == 4 and frames is not None and top_key == 'frames':
+                if elem.tag == 'key':
+                    name = elem.text
+                elif elem.tag == 'dict':
+                    yield name, _value(elem)
+                    frames.clear()
+            depth -= 1
+
+    def _set_metadata(self, metadata):
+        if not isinstance(metadata, dict):
+            raise PlistParser.InvalidFileException("Invalid plist file: {0}".format(self.plist_path))
+        plist_format = metadata.get("format")
+        if plist_format not in (0, 1, 2, 3):
+            raise PlistParser.InvalidFormatException("Invalid plist format: {0}".format(plist_format))
+        self.format = plist_format
+        self.texture = metadata.get("textureFileName")
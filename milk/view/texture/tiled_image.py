@@ -0,0 +1,182 @@
+from collections import OrderedDict
+from math import floor, log2
+from threading import Thread
+from typing import List, Optional
+
+from PyQt5.QtCore import QObject, QRectF, Qt, pyqtSignal
+from PyQt5.QtGui import QImage, QImageReader, QPainter, QPixmap
+from PyQt5.QtWidgets import QGraphicsItem, QStyleOptionGraphicsItem
+
+# side of a tile, in pixels of its level
+TILE_SIZE = 512
+# bytes of tile pixmaps kept, a quarter of level 0 of an 8192x8192 atlas, the rest are uploaded again when they
+# come back into view; the tiles of the last paint are kept even beyond, not to upload them on every paint
+TILE_CACHE_BYTES = 64 << 20
+
+
+class ImagePyramid:
+    """
+    A picture and its mipmaps, each level half the size of the one before, down to a single tile.
+    Levels finer than the displayed one can be dropped, they are decoded again from `where` when zoomed back in.
+    """
+
+    def __init__(self, where: str, levels: List[QImage]):
+        self.where = where
+        # None once dropped, the last level is always kept
+        self.levels: List[Optional[QImage]] = levels
+        self.width = levels[0].width()
+        self.height = levels[0].height()
+
+    @staticmethod
+    def load(where: str):
+        reader = QImageReader(where)
+        image = reader.read()
+        if image.isNull():
+            raise IOError(reader.errorString())
+        image = image.convertToFormat(QImage.Format_ARGB32_Premultiplied)
+        levels = [image]
+        while max(image.width(), image.height()) > TILE_SIZE:
+            image = image.scaled(max(1, image.width() // 2), max(1, image.height() // 2),
+                                 Qt.IgnoreAspectRatio, Qt.SmoothTransformation)
+            levels.append(image)
+        return ImagePyramid(where, levels)
+
+    def level_for(self, level_of_detail: float):
+        """The smallest level which still has at least one pixel per screen pixel."""
+        if level_of_detail <= 0:
+            return len(self.levels) - 1
+        return min(len(self.levels) - 1, max(0, floor(log2(1 / level_of_detail))))
+
+    def decoded(self, level: int):
+        """`level` when it is decoded, else the closest coarser one."""
+        while self.levels[level] is None:
+            level += 1
+        return level
+
+    def drop_finer(self, level: int):
+        for i in range(level):
+            self.levels[i] = None
+
+    def restore(self, other: 'ImagePyramid'):
+        """Take back the dropped levels from `other`, a new load of the picture, False if it changed size since."""
+        if (other.width, other.height) != (self.width, self.height):
+            return False
+        for i, image in enumerate(other.levels):
+            if self.levels[i] is None:
+                self.levels[i] = image
+        return True
+
+
+def _bytes_of(pixmap: QPixmap):
+    return pixmap.width() * pixmap.height() * pixmap.depth() // 8
+
+
+class PyramidLoader(QObject):
+    """Decode pictures and build their mipmaps on a background thread, only the latest request is delivered."""
+
+    loaded = pyqtSignal(int, object)
+    failed = pyqtSignal(int, str)
+
+    def __init__(self):
+        super(PyramidLoader, self).__init__()
+        self.ticket = 0
+
+    def load(self, where: str):
+        self.ticket += 1
+        Thread(target=self._load, args=(self.ticket, where), daemon=True).start()
+        return self.ticket
+
+    def cancel(self):
+        self.ticket += 1
+
+    def _load(self, ticket: int, where: str):
+        try:
+            pyramid = ImagePyramid.load(where)
+        except Exception as e:
+            if ticket == self.ticket:
+                # noinspection PyUnresolvedReferences
+                self.failed.emit(ticket, str(e))
+            return
+        if ticket == self.ticket:
+            # noinspection PyUnresolvedReferences
+            self.loaded.emit(ticket, pyramid)
+
+
+class TiledImageItem(QGraphicsItem):
+    """
+    Paint an `ImagePyramid`: at each zoom only the level matching the level of detail is used,
+    and only its tiles within the exposed rect are turned into pixmaps, the most recent ones being cached.
+    Finer levels are dropped while zoomed out, zooming back in paints the coarser level scaled up
+    until the picture is decoded again in the background.
+    """
+
+    def __init__(self, pyramid: ImagePyramid):
+        super(TiledImageItem, self).__init__()
+        self.pyramid = pyramid
+        self._tiles = OrderedDict()
+        self._tile_bytes = 0
+        self._reloading = False
+        # a reload which failed or found the picture changed is not retried, the coarser level stays
+        self._loader = PyramidLoader()
+        self._loader.loaded.connect(self._on_reloaded)
+        self.setFlag(QGraphicsItem.ItemUsesExtendedStyleOption)
+
+    def _on_reloaded(self, ticket: int, pyramid: ImagePyramid):
+        if ticket != self._loader.ticket:
+            return
+        if self.pyramid.restore(pyramid):
+            self._reloading = False
+            self.update()
+
+    def boundingRect(self):
+        return QRectF(0, 0, self.pyramid.width, self.pyramid.height)
+
+    def _tile(self, level: int, column: int, row: int) -> QPixmap:
+        key = (level, column, row)
+        pixmap = self._tiles.get(key)
+        if pixmap is not None:
+            self._tiles.move_to_end(key)
+            return pixmap
+        image = self.pyramid.levels[level]
+        pixmap = QPixmap.fromImage(image.copy(column * TILE_SIZE, row * TILE_SIZE, TILE_SIZE, TILE_SIZE))
+        self._tiles[key] = pixmap
+        self._tile_bytes += _bytes_of(pixmap)
+        return pixmap
+
+    def _trim(self, keep: int):
+        """Drop the least recently painted tiles down to `TILE_CACHE_BYTES`, or `keep` bytes if more."""
+        while self._tile_bytes > max(TILE_CACHE_BYTES, keep) and self._tiles:
+            _, pixmap = self._tiles.popitem(last=False)
+            self._tile_bytes -= _bytes_of(pixmap)
+
+    def paint(self, painter: QPainter, option: QStyleOptionGraphicsItem, widget=None):
+        level_of_detail = option.levelOfDetailFromTransform(painter.worldTransform())
+        wanted = self.pyramid.level_for(level_of_detail)
+        self.pyramid.drop_finer(wanted)
+        level = self.pyramid.decoded(wanted)
+        if level != wanted and not self._reloading:
+            self._reloading = True
+            self._loader.load(self.pyramid.where)
+        image = self.pyramid.levels[level]
+        # item pixels per level pixel, per axis since halving rounds down
+        sx = self.pyramid.width / image.width()
+        sy = self.pyramid.height / image.height()
+        exposed = option.exposedRect.intersected(self.boundingRect())
+        if exposed.isEmpty():
+            return
+        if wanted > 0 or level_of_detail < 1:
+            painter.setRenderHint(QPainter.SmoothPixmapTransform)
+
+        first_column = max(0, int(exposed.left() / sx) // TILE_SIZE)
+        last_column = min((image.width() - 1) // TILE_SIZE, int(exposed.right() / sx) // TILE_SIZE)
+        first_row = max(0, int(exposed.top() / sy) // TILE_SIZE)
+        last_row = min((image.height() - 1) // TILE_SIZE, int(exposed.bottom() / sy) // TILE_SIZE)
+        painted = 0
+        for row in range(first_row, last_row + 1):
+            for column in range(first_column, last_column + 1):
+                pixmap = self._tile(level, column, row)
+                painted += _bytes_of(pixmap)
+                target = QRectF(column * TILE_SIZE * sx, row * TILE_SIZE * sy,
+                                pixmap.width() * sx, pixmap.height() * sy)
+                painter.drawPixmap(target, pixmap, QRectF(pixmap.rect()))
+        self._trim(painted)
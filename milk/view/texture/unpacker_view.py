@@ -1,15 +1,16 @@
-from os import remove
-from os.path import exists, join
 from typing import Optional
 
-from PIL import Image
-from PyQt5.QtCore import QRectF, Qt
+from PyQt5.QtCore import pyqtSignal, QRectF, Qt
 from PyQt5.QtWidgets import QAction, QListWidgetItem, QMenu
 
 from milk.cmm import Cmm
-from milk.conf import LangUI, settings, signals, UIDef, UserKey
+from milk.conf import Lang, LangUI, settings, signals, UIDef, UserKey
 from milk.gui import GUI
-from .conf import UnpackerMenus
+from milk.image_output import DEFAULT_PRESET, output_preset
+from milk.thread_runner import ThreadRunner
+from .batch_unpacker import find_atlases, TextureBatchUnpacker
+from .conf import OutputPresets, UnpackerMenus
+from .frame_extractor import FrameExtractor
 from .graphics_canvas import DroppableGraphicsScene, ResizableGraphicsView
 from .plist_parser import PlistParser
 
@@ -35,10 +36,15 @@ class _View(GUI.View):
 
 
 class TextureUnpackerView(_View):
+    extract_progress = pyqtSignal(int, int)
+    extract_finished = pyqtSignal(str)
+
     def __init__(self):
         super(TextureUnpackerView, self).__init__()
 
         self.plist_data: Optional[dict] = None
+        self.frame_extractor: Optional[FrameExtractor] = None
+        self.batch_unpacker: Optional[TextureBatchUnpacker] = None
         self.setWindowTitle(LangUI.texture_unpacker_title)
 
         self.setup_rect_key(UserKey.TextureUnpacker.window_rect)
@@ -49,11 +55,31 @@ class TextureUnpackerView(_View):
         self.ui_graphics_scene.image_dropped.connect(self.on_image_dropped)
         self.ui_list_img.itemClicked.connect(self.on_select_part)
         self.ui_list_img.customContextMenuRequested.connect(self.on_request_list_menu)
+        # noinspection PyUnresolvedReferences
+        self.extract_progress.connect(self.on_extract_progress)
+        # noinspection PyUnresolvedReferences
+        self.extract_finished.connect(self.on_extract_finished)
+
+    @staticmethod
+    def image_output():
+        return output_preset(settings.value(UserKey.ImageOutput.preset, DEFAULT_PRESET, str))
 
     @staticmethod
-    def get_image_mode(src_image):
-        return "RGBA" if (src_image.mode in ('RGBA', 'LA') or (
-                src_image.mode == 'P' and 'transparency' in src_image.info)) else "RGB"
+    def set_output_preset(preset: str):
+        settings.setValue(UserKey.ImageOutput.preset, preset)
+        signals.logger_info.emit(LangUI.image_output_changed.format(Lang.get(dict(OutputPresets)[preset])))
+
+    def on_output_png(self):
+        self.set_output_preset('png')
+
+    def on_output_png_fast(self):
+        self.set_output_preset('png-fast')
+
+    def on_output_png_small(self):
+        self.set_output_preset('png-small')
+
+    def on_output_raw(self):
+        self.set_output_preset('raw')
 
     # noinspection PyBroadException
     def extract_picture(self, choose_dir, filename):
@@ -61,53 +87,48 @@ class TextureUnpackerView(_View):
             return
         self.extract(choose_dir, filename)
 
-    # noinspection PyBroadException
     def extract(self, choose_dir, filename=None):
-        src_image = None
-        try:
-            src_image = Image.open(self.ui_graphics_scene.image_path)
-            mode = self.get_image_mode(src_image)
-            frames = self.plist_data.get("frames")
-            if filename is not None:
-                for frame in frames:
-                    name = frame.get("name")
-                    if name == filename:
-                        # print("extract 1: ", mode, name, frame)
-                        self.extract_frame(choose_dir, mode, src_image, frame, name)
-                        break
-            else:
-                for frame in frames:
-                    name = frame.get("name")
-                    # print("extract 2: ", mode, name, frame)
-                    self.extract_frame(choose_dir, mode, src_image, frame, name)
-        except Exception:
-            # print("extract failed: ", e)
-            pass
-        finally:
-            if src_image is not None:
-                src_image.close()
-            Cmm.open_external_file(choose_dir)
-
-    @staticmethod
-    def extract_frame(choose_dir, mode, src_image, frame, name):
-        ox, oy = frame.get("offset")
-        rotated = frame.get("rotated")
-        sw, sh = frame.get("source_size")
-        ltx, lty, rbx, rby = frame.get("crop_rect")
-        save_at = join(choose_dir, name)
-
-        if exists(save_at):
-            remove(save_at)
-
-        dst_image = Image.new(mode, (sw, sh), (0, 0, 0, 0))
-        crop_frame = src_image.crop((ltx, lty, rbx, rby))
-        if rotated:
-            crop_frame = crop_frame.rotate(90, expand=1)
-        dst_image.paste(crop_frame, (ox, oy), mask=0)
-        dst_image.save(save_at)
-        dst_image.close()
-
-        # print(frame)
+        frames = self.plist_data.get("frames")
+        if filename is not None:
+            frame = frames.find(filename)
+            frames = [frame] if frame is not None else []
+        else:
+            frames = frames.frames
+        if self.frame_extractor is not None:
+            self.frame_extractor.shutdown(cancel=True, wait=False)
+        extractor = FrameExtractor(output=self.image_output())
+        extractor.start(self.ui_graphics_scene.image_path, frames, choose_dir)
+        self.frame_extractor = extractor
+
+        def on_running():
+            if self.frame_extractor is not extractor:
+                runner.stop(tid)
+                return
+            for result in extractor.poll():
+                if not result.ok:
+                    signals.logger_error.emit('{0}: {1}'.format(result.target, result.error))
+            # noinspection PyUnresolvedReferences
+            self.extract_progress.emit(extractor.collected(), extractor.total())
+            if extractor.finished():
+                extractor.shutdown(wait=False)
+                if extractor.error() is not None:
+                    signals.logger_error.emit(extractor.error())
+                signals.logger_info.emit(LangUI.texture_unpacker_finished.format(extractor.total(),
+                                                                                 extractor.elapsed()))
+                self.frame_extractor = None
+                # noinspection PyUnresolvedReferences
+                self.extract_finished.emit(choose_dir)
+                runner.stop(tid)
+
+        runner = ThreadRunner()
+        tid = runner.start(runner=on_running)
+
+    def on_extract_progress(self, done: int, total: int):
+        self.setWindowTitle(LangUI.texture_unpacker_progress.format(LangUI.texture_unpacker_title, done, total))
+
+    def on_extract_finished(self, choose_dir: str):
+        self.setWindowTitle(LangUI.texture_unpacker_title)
+        Cmm.open_external_file(choose_dir)
 
     def on_request_list_menu(self, position):
         pop_menu = QMenu()
@@ -129,6 +150,46 @@ class TextureUnpackerView(_View):
             settings.setValue(UserKey.TextureUnpacker.last_save_at, choose_dir)
             self.extract(choose_dir)
 
+    def on_unpack_dir(self):
+        if self.batch_unpacker is not None:
+            return
+
+        last_dir = settings.value(UserKey.TextureUnpacker.last_unpack_dir, Cmm.user_picture_dir(), str)
+        unpack_dir = GUI.dialog_for_directory_selection(self, LangUI.texture_unpacker_ui_unpack_dir, last_dir)
+        if unpack_dir is None:
+            return
+        settings.setValue(UserKey.TextureUnpacker.last_unpack_dir, unpack_dir)
+        last_dir = settings.value(UserKey.TextureUnpacker.last_save_at, Cmm.user_picture_dir(), str)
+        choose_dir = GUI.dialog_for_directory_selection(self, LangUI.texture_unpacker_ui_save_dir, last_dir)
+        if choose_dir is None:
+            return
+        settings.setValue(UserKey.TextureUnpacker.last_save_at, choose_dir)
+
+        unpacker = TextureBatchUnpacker(output=self.image_output())
+        unpacker.start(find_atlases([unpack_dir], choose_dir))
+        self.batch_unpacker = unpacker
+
+        def on_running():
+            if self.batch_unpacker is not unpacker:
+                runner.stop(tid)
+                return
+            for result in unpacker.poll():
+                if result.skipped:
+                    signals.logger_info.emit('{0}: {1}'.format(result.plist_path, LangUI.texture_unpacker_batch_skipped))
+                elif result.ok:
+                    signals.logger_info.emit('{0} -> {1}'.format(result.plist_path, result.out_dir))
+                else:
+                    signals.logger_error.emit('{0}: {1}'.format(result.plist_path, result.error))
+            if unpacker.finished():
+                unpacker.shutdown(wait=False)
+                signals.logger_info.emit(LangUI.texture_unpacker_batch_finished.format(
+                    unpacker.total(), unpacker.frames(), unpacker.elapsed(), unpacker.frames_per_second()))
+                self.batch_unpacker = None
+                runner.stop(tid)
+
+        runner = ThreadRunner()
+        tid = runner.start(runner=on_running)
+
     def on_save_one(self):
         cur_row = self.ui_list_img.currentRow()
         cur_item = self.ui_list_img.item(cur_row)
@@ -160,21 +221,23 @@ class TextureUnpackerView(_View):
     def refresh_list_widget(self):
         self.ui_list_img.clear()
         if self.plist_data is not None:
-            frames = self.plist_data.get("frames")
-            names = (frame.get("name") for frame in frames)
-            self.ui_list_img.addItems(names)
+            self.ui_list_img.addItems(self.plist_data.get("frames").names())
 
     def on_select_part(self, item: QListWidgetItem):
         try:
             name = item.text()
             if self.plist_data:
-                frames = self.plist_data.get("frames")
-                for frame in frames:
-                    if frame.get("name") == name:
-                        # print("locate " + name + " ...")
-                        x, y, w, h = frame.get("frame_rect")
-                        rect = QRectF(x, y, w, h)
-                        self.ui_graphics_scene.click_rect(rect)
-                        break
+                frame = self.plist_data.get("frames").find(name)
+                if frame is not None:
+                    self.ui_graphics_scene.click_rect(QRectF(frame.x, frame.y, frame.w, frame.h))
         except Exception as e:
             print(e)
+
+    def closeEvent(self, event):
+        if self.frame_extractor is not None:
+            self.frame_extractor.shutdown(cancel=True, wait=False)
+            self.frame_extractor = None
+        if self.batch_unpacker is not None:
+            self.batch_unpacker.shutdown(cancel=True, wait=False)
+            self.batch_unpacker = None
+        super(TextureUnpackerView, self).closeEvent(event)
@@ -150,6 +150,12 @@ SHARED_VOCABULARY_NAME = 'shared_vocabulary.txt'
 
 TRANSLATOR_DEVICE = 'cpu'
 
+# source tokens of the sentences translated together, longest sentence times their count
+TRANSLATE_BATCH_TOKENS = 2048
+
+# threads one batch is computed with, the other cores translate other batches meanwhile
+TRANSLATE_INTRA_THREADS = 4
+
 DETECT_CHARS_LIMIT = 100
 
 URL_M2M_100_418M = 'https://pretrained-nmt-models.s3.us-west-2.amazonaws.com/CTranslate2/m2m100/m2m100_ct2_418m.zip'
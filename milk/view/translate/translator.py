@@ -1,18 +1,18 @@
 from os import cpu_count
 from os.path import exists, isdir, isfile, join
-from typing import Optional
+from typing import List, Optional
 
 from ctranslate2 import contains_model, Translator
 from fasttext import FastText, load_model
 from indicnlp.tokenize.sentence_tokenize import sentence_split
-from numpy import array, array_split
 from pysbd import Segmenter
 from sentence_splitter import split_text_into_sentences
 from sentencepiece import SentencePieceProcessor
 
 from milk.conf import LangUI
 from milk.gui import GUI
-from .conf import BeamSize, DETECT_CHARS_LIMIT, SHARED_VOCABULARY_NAME, SupportLanguages, TRANSLATOR_DEVICE
+from .conf import BeamSize, DETECT_CHARS_LIMIT, SHARED_VOCABULARY_NAME, SupportLanguages, TRANSLATE_BATCH_TOKENS, \
+    TRANSLATE_INTRA_THREADS, TRANSLATOR_DEVICE
 
 
 def paragraph_tokenizer(text, language="en"):
@@ -41,14 +41,14 @@ def paragraph_tokenizer(text, language="en"):
 
     breaks = []
     sentences = []
+    segmenter = Segmenter(language=language, clean=True) if language in languages_pysbd else None
 
     for paragraph in paragraphs:
         if paragraph == "\n":
             breaks.append("\n")
         else:
             paragraph_sentences = []
-            if language in languages_pysbd:
-                segmenter = Segmenter(language=language, clean=True)
+            if segmenter is not None:
                 paragraph_sentences = segmenter.segment(paragraph)
             elif language in languages_splitter:
                 paragraph_sentences = split_text_into_sentences(paragraph, language)
@@ -89,6 +89,22 @@ def paragraph_detokenizer(sentences: list[str], breaks):
     return text
 
 
+def token_batches(tokens: List[List[str]], budget: int = TRANSLATE_BATCH_TOKENS):
+    """Indexes of `tokens`, longest first, in batches of about the same length whose padded size fits `budget`."""
+    order = sorted(range(len(tokens)), key=lambda i: len(tokens[i]), reverse=True)
+    batches = []
+    batch = []
+    for i in order:
+        # the first of a batch is its longest, every other one is padded to it
+        if batch and len(tokens[batch[0]]) * (len(batch) + 1) > budget:
+            batches.append(batch)
+            batch = []
+        batch.append(i)
+    if batch:
+        batches.append(batch)
+    return batches
+
+
 class ModelTranslator:
     def __init__(self):
         self.c_model_at: str = ''
@@ -100,8 +116,9 @@ class ModelTranslator:
         self.f_prediction: Optional[FastText._FastText] = None
         self.v_m2m_100: bool = False
         self.beam_size: int = BeamSize.Standard
-        self.inter_threads = cpu_count()
-        self.intra_threads = int(self.inter_threads / 2)
+        # batches in flight at once, and threads for each, together as many as there are cores
+        self.intra_threads = min(TRANSLATE_INTRA_THREADS, cpu_count() or 1)
+        self.inter_threads = max(1, (cpu_count() or 1) // self.intra_threads)
 
     @staticmethod
     def dump(msg: str):
@@ -198,34 +215,34 @@ class ModelTranslator:
             return
 
         sentences, breaks = paragraph_tokenizer(text, source_code)
-        n_splits = round((len(sentences) / 8) + 0.5)
-        splits = array_split(array(sentences), n_splits)
-        splits = [split.tolist() for split in splits]
-        results = []
-        for split in splits:
-            tgt_prefix = [[target_code]] * len(split)
-            src_prefix = source_code
-            start_pos = 6
-            max_batch_size = 1024
-
-            sentence_tokens = self.s_processor.Encode(split, out_type=str)
-            sentence_tokens = [[src_prefix] + token for token in sentence_tokens]
-            translation_tokens = self.c_translator.translate_batch(
-                source=sentence_tokens,
+        if len(sentences) == 0:
+            return ''
+
+        # all sentences are tokenized at once, then translated in batches of similar length,
+        # every batch is queued before the first is waited for, so the workers translate them side by side
+        sentence_tokens = self.s_processor.Encode(sentences, out_type=str)
+        sentence_tokens = [[source_code] + tokens for tokens in sentence_tokens]
+        batches = token_batches(sentence_tokens)
+        pending = [
+            self.c_translator.translate_batch(
+                source=[sentence_tokens[i] for i in batch],
                 beam_size=self.beam_size,
-                max_batch_size=max_batch_size,
+                max_batch_size=TRANSLATE_BATCH_TOKENS,
+                batch_type='tokens',
+                asynchronous=True,
                 replace_unknowns=True,
                 repetition_penalty=1.2,
-                target_prefix=tgt_prefix,
+                target_prefix=[[target_code]] * len(batch),
             )
-            translations_so_far = [
-                ' '.join(tokens[0]['tokens']).replace(' ', '').replace('▁', ' ')[start_pos:].strip()
-                for tokens in translation_tokens
-            ]
-            # [print(tokens) for tokens in translation_tokens]
-            translations_formatted = paragraph_detokenizer(translations_so_far, breaks)
-            results.append(translations_formatted)
-        return '\n'.join(results)
+            for batch in batches
+        ]
+        translations = [''] * len(sentences)
+        for batch, results in zip(batches, pending):
+            for i, result in zip(batch, results):
+                # the first token is the target language prefix
+                tokens = result.result().hypotheses[0][1:]
+                translations[i] = ''.join(tokens).replace('▁', ' ').strip()
+        return paragraph_detokenizer(translations, breaks)
 
     def auto_translate(self, target_code: str, text: str):
         source_codes = self.detect_language(text)
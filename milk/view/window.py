@@ -1,19 +1,23 @@
+from importlib import import_module
+from time import perf_counter
+from typing import Union
+
 from PyQt5.QtWidgets import QApplication, QMainWindow
 
 from milk.cmm import Cmm
 from milk.conf import LangUI, Settings, signals, UIDef
 from milk.gui import GUI
 from milk.view.about_me.about_me_view import AboutMeView
-from milk.view.lua.encoding_detection_view import EncodingDetectionView
 from milk.view.main.main_view import MainView
-from milk.view.spine.spine_atlas_extractor_view import SpineAtlasExtractorView
-from milk.view.texture.unpacker_view import TextureUnpackerView
-from milk.view.translate.translate_view import TranslateView
-from milk.view.wallpaper.wallpaper_view import WallPaperView
-from milk.view.weread.weread import WeRead
-from milk.view.lua.syntax_inspection_view import SyntaxInspectionView
-from milk.view.lua.source_minifier_view import SourceMinifierView
-from milk.view.lua.element_extractor_view import ElementExtractorView
+
+
+def load_view_class(path: str):
+    # views are imported on first use, some pull in heavy dependencies (ctranslate2, QtWebEngine, ...)
+    module_name, class_name = path.rsplit('.', 1)
+    start = perf_counter()
+    view_class = getattr(import_module(module_name), class_name)
+    signals.logger_debug.emit('{0} 加载耗时 {1:.0f}ms.'.format(class_name, (perf_counter() - start) * 1000))
+    return view_class
 
 
 class Window(QMainWindow):
@@ -72,20 +76,22 @@ class Window(QMainWindow):
         AboutMeView(self).exec()
 
     def on_menu_tools_weread(self):
-        self.open_menu(UIDef.ToolsWeRead, WeRead)
+        self.open_menu(UIDef.ToolsWeRead, 'milk.view.weread.weread.WeRead')
 
     def on_menu_tools_translate(self):
-        self.open_menu(UIDef.ToolsTranslate, TranslateView)
+        self.open_menu(UIDef.ToolsTranslate, 'milk.view.translate.translate_view.TranslateView')
 
     @staticmethod
     def on_menu_exit_app():
         QApplication.exit()
 
-    def open_menu(self, ui: UIDef, class_obj):
+    def open_menu(self, ui: UIDef, class_obj: Union[str, type]):
         win = self.windows[ui.name]
         if win is not None:
             win.activateWindow()
             return
+        if isinstance(class_obj, str):
+            class_obj = load_view_class(class_obj)
         self.windows[ui.name] = class_obj()
         self.windows[ui.name].show()
 
@@ -102,13 +108,13 @@ class Window(QMainWindow):
         pass
 
     def on_menu_image_texture_unpacker(self):
-        self.open_menu(UIDef.ImageTextureUnpacker, TextureUnpackerView)
+        self.open_menu(UIDef.ImageTextureUnpacker, 'milk.view.texture.unpacker_view.TextureUnpackerView')
 
     def on_menu_image_spine_atlas_extractor(self):
-        self.open_menu(UIDef.ImageSpineAtlasExtractor, SpineAtlasExtractorView)
+        self.open_menu(UIDef.ImageSpineAtlasExtractor, 'milk.view.spine.spine_atlas_extractor_view.SpineAtlasExtractorView')
 
     def on_menu_tools_random_wallpaper(self):
-        self.open_menu(UIDef.ToolsWallpaper, WallPaperView)
+        self.open_menu(UIDef.ToolsWallpaper, 'milk.view.wallpaper.wallpaper_view.WallPaperView')
 
     @staticmethod
     def open_api_document(url: str):
@@ -159,16 +165,16 @@ class Window(QMainWindow):
         Window.open_api_document("https://go.dev/doc/")
 
     def on_menu_lua_encoding(self):
-        self.open_menu(UIDef.LuaEncodingChecker, EncodingDetectionView)
+        self.open_menu(UIDef.LuaEncodingChecker, 'milk.view.lua.encoding_detection_view.EncodingDetectionView')
 
     def on_menu_lua_compress(self):
-        self.open_menu(UIDef.LuaMinifier, SourceMinifierView)
+        self.open_menu(UIDef.LuaMinifier, 'milk.view.lua.source_minifier_view.SourceMinifierView')
 
     def on_menu_lua_grammar(self):
-        self.open_menu(UIDef.LuaGrammarChecker, SyntaxInspectionView)
+        self.open_menu(UIDef.LuaGrammarChecker, 'milk.view.lua.syntax_inspection_view.SyntaxInspectionView')
 
     def on_menu_lua_extractor(self):
-        self.open_menu(UIDef.LuaExtractor, ElementExtractorView)
+        self.open_menu(UIDef.LuaExtractor, 'milk.view.lua.element_extractor_view.ElementExtractorView')
 
     def closeEvent(self, evt):
         for key, win in self.windows.items():
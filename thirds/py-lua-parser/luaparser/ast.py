@@ -6,12 +6,21 @@ from luaparser.builder import Builder
 from luaparser.utils.visitor import *
 from antlr4.error.ErrorListener import ErrorListener
 import json
-from typing import Generator
+from typing import Callable, Dict, Generator, Optional, Tuple
 
 
-def parse(source: str) -> Chunk:
-    """Parse Lua source to a Chunk."""
-    return Builder(source).process()
+def parse(
+    source: str, lexer: str = "antlr", compact: bool = False, packrat: bool = False
+) -> Chunk:
+    """Parse Lua source to a Chunk.
+
+    Args:
+        source: Lua source code
+        lexer: "antlr" (default) or "fast", a regex lexer producing the same tokens several times faster
+        compact: with the fast lexer, build a tree taking several times less memory, to be read, not extended
+        packrat: memoize the rules the parser backtracks over, see ``Builder``
+    """
+    return Builder(source, lexer, compact, packrat).process()
 
 
 def get_token_stream(source: str) -> CommonTokenStream:
@@ -78,55 +87,73 @@ class ASTVisitor:
                     tree_visitor(node)
 
                 # add childs
-                children = [
-                    attr for attr in node.__dict__.keys() if not attr.startswith("_")
-                ]
-                for child in children:
-                    node_stack.append(node.__dict__[child])
+                for attr, child in node.attributes().items():
+                    if not attr.startswith("_"):
+                        node_stack.append(child)
             elif isinstance(node, list):
                 # append node list in reversal order
                 for n in reversed(node):
                     node_stack.append(n)
 
 
+# (visitor class, node class) -> (enter handler, exit handler), either may be None
+_VISIT_HANDLERS: Dict[
+    Tuple[type, type], Tuple[Optional[Callable], Optional[Callable]]
+] = {}
+_EXIT = object()
+
+
+def _visit_handler(visitor_class: type, node_class: type, prefix: str):
+    # if no visitor method is found for the node type, search in its parent type
+    while node_class is not object:
+        handler = getattr(visitor_class, prefix + node_class.__name__, None)
+        if handler is not None:
+            return handler
+        node_class = node_class.__bases__[0]
+    return None
+
+
+def _visit_handlers(visitor_class: type, node_class: type):
+    key = (visitor_class, node_class)
+    handlers = _VISIT_HANDLERS.get(key)
+    if handlers is None:
+        handlers = (
+            _visit_handler(visitor_class, node_class, "enter_"),
+            _visit_handler(visitor_class, node_class, "exit_"),
+        )
+        _VISIT_HANDLERS[key] = handlers
+    return handlers
+
+
 class ASTRecursiveVisitor:
-    def visit(self, node):
-        if isinstance(node, Node):
-            # call enter node method
-            # if no visitor method found for this arg type,
-            # search in parent arg type:
-            parent_type = node.__class__
-            while parent_type != object:
-                name = "enter_" + parent_type.__name__
-                tree_visitor = getattr(self, name, None)
-                if tree_visitor:
-                    tree_visitor(node)
-                    break
-                else:
-                    parent_type = parent_type.__bases__[0]
-
-            # visit all object public attributes:
-            children = [
-                attr for attr in node.__dict__.keys() if not attr.startswith("_")
-            ]
-            for child in children:
-                self.visit(node.__dict__[child])
-
-            # call exit node method
-            # if no visitor method found for this arg type,
-            # search in parent arg type:
-            parent_type = node.__class__
-            while parent_type != object:
-                name = "exit_" + parent_type.__name__
-                tree_visitor = getattr(self, name, None)
-                if tree_visitor:
-                    tree_visitor(node)
-                    break
-                else:
-                    parent_type = parent_type.__bases__[0]
-        elif isinstance(node, list):
-            for n in node:
-                self.visit(n)
+    """Call ``enter_<Node>`` before and ``exit_<Node>`` after the children of each node, depth first.
+
+    The walk uses an explicit stack, so deeply nested sources do not hit the recursion limit, and the
+    handlers are looked up once per visitor class and node class.
+    """
+
+    def visit(self, node):
+        visitor_class = self.__class__
+        stack = [node]
+        while stack:
+            item = stack.pop()
+            if item is _EXIT:
+                node = stack.pop()
+                on_exit = _visit_handlers(visitor_class, node.__class__)[1]
+                if on_exit is not None:
+                    on_exit(self, node)
+            elif isinstance(item, Node):
+                on_enter = _visit_handlers(visitor_class, item.__class__)[0]
+                if on_enter is not None:
+                    on_enter(self, item)
+                stack.append(item)
+                stack.append(_EXIT)
+                for name in reversed(child_names(item.__class__)):
+                    child = getattr(item, name)
+                    if isinstance(child, (Node, list, tuple)):
+                        stack.append(child)
+            elif isinstance(item, (list, tuple)):
+                stack.extend(reversed(item))
 
 
 class WalkVisitor:
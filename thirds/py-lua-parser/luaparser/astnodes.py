@@ -1,21 +1,33 @@
 """
-    ``astnodes`` module
-    ===================
+``astnodes`` module
+===================
 
-    Contains all Ast Node definitions.
+Contains all Ast Node definitions.
 """
+
 from enum import Enum
-from typing import List, Optional
+from typing import Dict, List, Optional, Tuple
 
 from antlr4.Token import CommonToken
 
 Comments = Optional[List["Comment"]]
 
 
+COMMENT_FIELDS = ("comments", "tail_comments")
+# comment lists of a compact tree, see `compact_tree`
+EMPTY_COMMENTS = ()
+
+
+def _equal_values(v1, v2) -> bool:
+    if v1 is EMPTY_COMMENTS or v2 is EMPTY_COMMENTS:
+        return not v1 and not v2
+    return v1 == v2
+
+
 def _equal_dicts(d1, d2, ignore_keys):
     ignored = set(ignore_keys)
     for k1, v1 in d1.items():
-        if k1 not in ignored and (k1 not in d2 or d2[k1] != v1):
+        if k1 not in ignored and (k1 not in d2 or not _equal_values(d2[k1], v1)):
             return False
     for k2, v2 in d2.items():
         if k2 not in ignored and k2 not in d1:
@@ -23,9 +35,39 @@ def _equal_dicts(d1, d2, ignore_keys):
     return True
 
 
+_ATTRIBUTES: Dict[type, Tuple[str, ...]] = {}
+
+
+def attribute_names(cls: type) -> Tuple[str, ...]:
+    """Slot names of a node class, those of its base classes first, the order ``__init__`` assigns them in."""
+    names = _ATTRIBUTES.get(cls)
+    if names is None:
+        names = tuple(
+            name
+            for klass in reversed(cls.__mro__)
+            for name in klass.__dict__.get("__slots__", ())
+        )
+        _ATTRIBUTES[cls] = names
+    return names
+
+
+_CHILDREN: Dict[type, Tuple[str, ...]] = {}
+
+
+def child_names(cls: type) -> Tuple[str, ...]:
+    """The public ones of ``attribute_names``, those a visitor walks into."""
+    names = _CHILDREN.get(cls)
+    if names is None:
+        names = tuple(name for name in attribute_names(cls) if not name.startswith("_"))
+        _CHILDREN[cls] = names
+    return names
+
+
 class Node:
     """Base class for AST node."""
 
+    __slots__ = ("_name", "comments", "tail_comments", "_first_token", "_last_token")
+
     def __init__(
         self,
         name: str,
@@ -63,6 +105,23 @@ class Node:
             self._last_token = self._last_token.clone()
             self._last_token.source = CommonToken.EMPTY_SOURCE
 
+    def attributes(self) -> Dict[str, any]:
+        """Attributes of the node by name, in the order they are assigned.
+
+        Nodes keep their attributes in ``__slots__``, a tree holds many of them,
+        this is what ``__dict__`` would have held.
+        """
+        values = {}
+        for name in attribute_names(self.__class__):
+            try:
+                values[name] = getattr(self, name)
+            except AttributeError:
+                # never assigned
+                pass
+        # subclasses declaring no __slots__ of their own still have a __dict__
+        values.update(getattr(self, "__dict__", ()))
+        return values
+
     @property
     def display_name(self) -> str:
         return self._name
@@ -70,7 +129,7 @@ class Node:
     def __eq__(self, other) -> bool:
         if isinstance(self, other.__class__):
             return _equal_dicts(
-                self.__dict__, other.__dict__, ["_first_token", "_last_token"]
+                self.attributes(), other.attributes(), ["_first_token", "_last_token"]
             )
         return False
 
@@ -122,7 +181,7 @@ class Node:
             self._name: {
                 **{
                     k: v
-                    for k, v in self.__dict__.items()
+                    for k, v in self.attributes().items()
                     if not k.startswith("_") and v
                 },
                 **{
@@ -135,6 +194,8 @@ class Node:
 
 
 class Comment(Node):
+    __slots__ = ("s", "is_multi_line")
+
     def __init__(self, s: str, is_multi_line: bool = False, **kwargs):
         super().__init__("Comment", **kwargs)
         self.s: str = s
@@ -144,14 +205,20 @@ class Comment(Node):
 class Statement(Node):
     """Base class for Lua statement."""
 
+    __slots__ = ()
+
 
 class Expression(Node):
     """Define a Lua expression."""
 
+    __slots__ = ()
+
 
 class Block(Node):
     """Define a Lua Block."""
 
+    __slots__ = ("body",)
+
     def __init__(self, body: List[Statement], **kwargs):
         super().__init__("Block", **kwargs)
         self.body: List[Statement] = body
@@ -164,6 +231,8 @@ class Chunk(Node):
         body (`Block`): Chunk body.
     """
 
+    __slots__ = ("body",)
+
     def __init__(self, body: Block, **kwargs):
         super(Chunk, self).__init__("Chunk", **kwargs)
         self.body = body
@@ -177,6 +246,8 @@ Left Hand Side expression.
 class Lhs(Expression):
     """Define a Lua Left Hand Side expression."""
 
+    __slots__ = ()
+
 
 class Name(Lhs):
     """Define a Lua name expression.
@@ -185,6 +256,8 @@ class Name(Lhs):
         id (`string`): Id.
     """
 
+    __slots__ = ("id",)
+
     def __init__(self, identifier: str, **kwargs):
         super(Name, self).__init__("Name", **kwargs)
         self.id: str = identifier
@@ -203,6 +276,8 @@ class Index(Lhs):
         value (`string`): Id.
     """
 
+    __slots__ = ("idx", "value", "notation")
+
     def __init__(
         self,
         idx: Expression,
@@ -230,6 +305,8 @@ class Assign(Statement):
 
     """
 
+    __slots__ = ("targets", "values")
+
     def __init__(self, targets: List[Node], values: List[Node], **kwargs):
         super().__init__("Assign", **kwargs)
         self.targets: List[Node] = targets
@@ -244,6 +321,8 @@ class LocalAssign(Assign):
         values (`list<Node>`): List of values.
     """
 
+    __slots__ = ()
+
     def __init__(self, targets: List[Node], values: List[Node], **kwargs):
         super().__init__(targets, values, **kwargs)
         self._name: str = "LocalAssign"
@@ -257,6 +336,8 @@ class While(Statement):
         body (`Block`): List of statements to execute.
     """
 
+    __slots__ = ("test", "body")
+
     def __init__(self, test: Expression, body: Block, **kwargs):
         super().__init__("While", **kwargs)
         self.test: Expression = test
@@ -270,6 +351,8 @@ class Do(Statement):
         body (`Block`): List of statements to execute.
     """
 
+    __slots__ = ("body",)
+
     def __init__(self, body: Block, **kwargs):
         super().__init__("Do", **kwargs)
         self.body: Block = body
@@ -283,6 +366,8 @@ class Repeat(Statement):
         body (`Block`): List of statements to execute.
     """
 
+    __slots__ = ("body", "test")
+
     def __init__(self, body: Block, test: Expression, **kwargs):
         super().__init__("Repeat", **kwargs)
         self.body: Block = body
@@ -298,6 +383,8 @@ class ElseIf(Statement):
         orelse (`list<Statement> or ElseIf`): List of statements or ElseIf if test if false.
     """
 
+    __slots__ = ("test", "body", "orelse")
+
     def __init__(self, test: Node, body: Block, orelse, **kwargs):
         super().__init__("ElseIf", **kwargs)
         self.test: Node = test
@@ -314,6 +401,8 @@ class If(Statement):
         orelse (`list<Statement> or ElseIf`): List of statements or ElseIf if test if false.
     """
 
+    __slots__ = ("test", "body", "orelse")
+
     def __init__(
         self, test: Expression, body: Block, orelse: List[Statement] or ElseIf, **kwargs
     ):
@@ -330,6 +419,8 @@ class Label(Statement):
         id (`Name`): Label name.
     """
 
+    __slots__ = ("id",)
+
     def __init__(self, label_id: Name, **kwargs):
         super(Label, self).__init__("Label", **kwargs)
         self.id: Name = label_id
@@ -342,6 +433,8 @@ class Goto(Statement):
         label (`Name`): Label node.
     """
 
+    __slots__ = ("label",)
+
     def __init__(self, label: Name, **kwargs):
         super(Goto, self).__init__("Goto", **kwargs)
         self.label: Name = label
@@ -350,6 +443,8 @@ class Goto(Statement):
 class SemiColon(Statement):
     """Define the semi-colon lua statement."""
 
+    __slots__ = ()
+
     def __init__(self, **kwargs):
         super(SemiColon, self).__init__("SemiColon", **kwargs)
 
@@ -357,6 +452,8 @@ class SemiColon(Statement):
 class Break(Statement):
     """Define the break lua statement."""
 
+    __slots__ = ()
+
     def __init__(self, **kwargs):
         super(Break, self).__init__("Break", **kwargs)
 
@@ -368,6 +465,8 @@ class Return(Statement):
         values (`list<Expression>`): Values to return.
     """
 
+    __slots__ = ("values",)
+
     def __init__(self, values, **kwargs):
         super(Return, self).__init__("Return", **kwargs)
         self.values = values
@@ -384,6 +483,8 @@ class Fornum(Statement):
         body (`Block`): List of statements to execute.
     """
 
+    __slots__ = ("target", "start", "stop", "step", "body")
+
     def __init__(
         self,
         target: Name,
@@ -410,6 +511,8 @@ class Forin(Statement):
         targets (`list<Name>`): Start index value.
     """
 
+    __slots__ = ("body", "iter", "targets")
+
     def __init__(
         self, body: Block, iter: List[Expression], targets: List[Name], **kwargs
     ):
@@ -427,6 +530,8 @@ class Call(Statement):
         args (`list<Expression>`): Function call arguments.
     """
 
+    __slots__ = ("func", "args")
+
     def __init__(self, func: Expression, args: List[Expression], **kwargs):
         super(Call, self).__init__("Call", **kwargs)
         self.func: Expression = func
@@ -442,6 +547,8 @@ class Invoke(Statement):
         args (`list<Expression>`): Function call arguments.
     """
 
+    __slots__ = ("source", "func", "args")
+
     def __init__(
         self, source: Expression, func: Expression, args: List[Expression], **kwargs
     ):
@@ -460,6 +567,8 @@ class Function(Statement):
         body (`Block`): List of statements to execute.
     """
 
+    __slots__ = ("name", "args", "body")
+
     def __init__(self, name: Expression, args: List[Expression], body: Block, **kwargs):
         super(Function, self).__init__("Function", **kwargs)
         self.name: Expression = name
@@ -476,6 +585,8 @@ class LocalFunction(Statement):
         body (`list<Statement>`): List of statements to execute.
     """
 
+    __slots__ = ("name", "args", "body")
+
     def __init__(self, name: Expression, args: List[Expression], body: Block, **kwargs):
         super(LocalFunction, self).__init__("LocalFunction", **kwargs)
         self.name: Expression = name
@@ -493,6 +604,8 @@ class Method(Statement):
         body (`Block`): List of statements to execute.
     """
 
+    __slots__ = ("source", "name", "args", "body")
+
     def __init__(
         self,
         source: Expression,
@@ -520,6 +633,8 @@ class Method(Statement):
 class Nil(Expression):
     """Define the Lua nil expression."""
 
+    __slots__ = ()
+
     def __init__(self, **kwargs):
         super(Nil, self).__init__("Nil", **kwargs)
 
@@ -527,6 +642,8 @@ class Nil(Expression):
 class TrueExpr(Expression):
     """Define the Lua true expression."""
 
+    __slots__ = ()
+
     def __init__(self, **kwargs):
         super(TrueExpr, self).__init__("True", **kwargs)
 
@@ -534,6 +651,8 @@ class TrueExpr(Expression):
 class FalseExpr(Expression):
     """Define the Lua false expression."""
 
+    __slots__ = ()
+
     def __init__(self, **kwargs):
         super(FalseExpr, self).__init__("False", **kwargs)
 
@@ -548,6 +667,8 @@ class Number(Expression):
         n (`int|float`): Numeric value.
     """
 
+    __slots__ = ("n",)
+
     def __init__(self, n: NumberType, **kwargs):
         super(Number, self).__init__("Number", **kwargs)
         self.n: NumberType = n
@@ -556,6 +677,8 @@ class Number(Expression):
 class Varargs(Expression):
     """Define the Lua Varargs expression (...)."""
 
+    __slots__ = ()
+
     def __init__(self, **kwargs):
         super(Varargs, self).__init__("Varargs", **kwargs)
 
@@ -574,6 +697,8 @@ class String(Expression):
         delimiter (`StringDelimiter`): The string delimiter
     """
 
+    __slots__ = ("s", "delimiter")
+
     def __init__(
         self,
         s: str,
@@ -593,6 +718,8 @@ class Field(Expression):
         value (`Expression`): Value.
     """
 
+    __slots__ = ("key", "value", "between_brackets")
+
     def __init__(
         self,
         key: Expression,
@@ -613,6 +740,8 @@ class Table(Expression):
         fields (`list<Field>`): Table fields.
     """
 
+    __slots__ = ("fields",)
+
     def __init__(self, fields: List[Field], **kwargs):
         super().__init__("Table", **kwargs)
         self.fields: List[Field] = fields
@@ -621,6 +750,8 @@ class Table(Expression):
 class Dots(Expression):
     """Define the Lua dots (...) expression."""
 
+    __slots__ = ()
+
     def __init__(self, **kwargs):
         super().__init__("Dots", **kwargs)
 
@@ -633,6 +764,8 @@ class AnonymousFunction(Expression):
         body (`Block`): List of statements to execute.
     """
 
+    __slots__ = ("args", "body")
+
     def __init__(self, args: List[Expression], body: Block, **kwargs):
         super(AnonymousFunction, self).__init__("AnonymousFunction", **kwargs)
         self.args: List[Expression] = args
@@ -647,6 +780,8 @@ class AnonymousFunction(Expression):
 class Op(Expression):
     """Base class for Lua operators."""
 
+    __slots__ = ()
+
 
 class BinaryOp(Op):
     """Base class for Lua 'Left Op Right' Operators.
@@ -656,6 +791,8 @@ class BinaryOp(Op):
         right (`Expression`): Right expression.
     """
 
+    __slots__ = ("left", "right")
+
     def __init__(self, name, left: Expression, right: Expression, **kwargs):
         super(BinaryOp, self).__init__(name, **kwargs)
         self.left: Expression = left
@@ -670,6 +807,8 @@ class BinaryOp(Op):
 class AriOp(BinaryOp):
     """Base class for Arithmetic Operators"""
 
+    __slots__ = ()
+
 
 class AddOp(AriOp):
     """Add expression.
@@ -679,6 +818,8 @@ class AddOp(AriOp):
         right (`Expression`): Right expression.
     """
 
+    __slots__ = ()
+
     def __init__(self, left: Expression, right: Expression, **kwargs):
         super().__init__("AddOp", left, right, **kwargs)
 
@@ -691,6 +832,8 @@ class SubOp(AriOp):
         right (`Expression`): Right expression.
     """
 
+    __slots__ = ()
+
     def __init__(self, left: Expression, right: Expression, **kwargs):
         super().__init__("SubOp", left, right, **kwargs)
 
@@ -703,6 +846,8 @@ class MultOp(AriOp):
         right (`Expression`): Right expression.
     """
 
+    __slots__ = ()
+
     def __init__(self, left: Expression, right: Expression, **kwargs):
         super().__init__("MultOp", left, right, **kwargs)
 
@@ -715,6 +860,8 @@ class FloatDivOp(AriOp):
         right (`Expression`): Right expression.
     """
 
+    __slots__ = ()
+
     def __init__(self, left: Expression, right: Expression, **kwargs):
         super().__init__("FloatDivOp", left, right, **kwargs)
 
@@ -727,6 +874,8 @@ class FloorDivOp(AriOp):
         right (`Expression`): Right expression.
     """
 
+    __slots__ = ()
+
     def __init__(self, left: Expression, right: Expression, **kwargs):
         super().__init__("FloorDivOp", left, right, **kwargs)
 
@@ -739,6 +888,8 @@ class ModOp(AriOp):
         right (`Expression`): Right expression.
     """
 
+    __slots__ = ()
+
     def __init__(self, left: Expression, right: Expression, **kwargs):
         super().__init__("ModOp", left, right, **kwargs)
 
@@ -751,6 +902,8 @@ class ExpoOp(AriOp):
         right (`Expression`): Right expression.
     """
 
+    __slots__ = ()
+
     def __init__(self, left: Expression, right: Expression, **kwargs):
         super().__init__("ExpoOp", left, right, **kwargs)
 
@@ -763,6 +916,8 @@ class ExpoOp(AriOp):
 class BitOp(BinaryOp):
     """Base class for bitwise Operators."""
 
+    __slots__ = ()
+
 
 class BAndOp(BitOp):
     """Bitwise and expression.
@@ -772,6 +927,8 @@ class BAndOp(BitOp):
         right (`Expression`): Right expression.
     """
 
+    __slots__ = ()
+
     def __init__(self, left: Expression, right: Expression, **kwargs):
         super().__init__("BAndOp", left, right, **kwargs)
 
@@ -784,6 +941,8 @@ class BOrOp(BitOp):
         right (`Expression`): Right expression.
     """
 
+    __slots__ = ()
+
     def __init__(self, left: Expression, right: Expression, **kwargs):
         super().__init__("BOrOp", left, right, **kwargs)
 
@@ -796,6 +955,8 @@ class BXorOp(BitOp):
         right (`Expression`): Right expression.
     """
 
+    __slots__ = ()
+
     def __init__(self, left: Expression, right: Expression, **kwargs):
         super().__init__("BXorOp", left, right, **kwargs)
 
@@ -808,6 +969,8 @@ class BShiftROp(BitOp):
         right (`Expression`): Right expression.
     """
 
+    __slots__ = ()
+
     def __init__(self, left: Expression, right: Expression, **kwargs):
         super().__init__("BShiftROp", left, right, **kwargs)
 
@@ -820,6 +983,8 @@ class BShiftLOp(BitOp):
         right (`Expression`): Right expression.
     """
 
+    __slots__ = ()
+
     def __init__(self, left: Expression, right: Expression, **kwargs):
         super().__init__("BShiftLOp", left, right, **kwargs)
 
@@ -832,6 +997,8 @@ class BShiftLOp(BitOp):
 class RelOp(BinaryOp):
     """Base class for Lua relational operators."""
 
+    __slots__ = ()
+
 
 class LessThanOp(RelOp):
     """Less than expression.
@@ -841,6 +1008,8 @@ class LessThanOp(RelOp):
         right (`Expression`): Right expression.
     """
 
+    __slots__ = ()
+
     def __init__(self, left: Expression, right: Expression, **kwargs):
         super().__init__("RLtOp", left, right, **kwargs)
 
@@ -853,6 +1022,8 @@ class GreaterThanOp(RelOp):
         right (`Expression`): Right expression.
     """
 
+    __slots__ = ()
+
     def __init__(self, left: Expression, right: Expression, **kwargs):
         super().__init__("RGtOp", left, right, **kwargs)
 
@@ -865,6 +1036,8 @@ class LessOrEqThanOp(RelOp):
         right (`Expression`): Right expression.
     """
 
+    __slots__ = ()
+
     def __init__(self, left: Expression, right: Expression, **kwargs):
         super().__init__("RLtEqOp", left, right, **kwargs)
 
@@ -877,6 +1050,8 @@ class GreaterOrEqThanOp(RelOp):
         right (`Expression`): Right expression.
     """
 
+    __slots__ = ()
+
     def __init__(self, left: Expression, right: Expression, **kwargs):
         super().__init__("RGtEqOp", left, right, **kwargs)
 
@@ -889,6 +1064,8 @@ class EqToOp(RelOp):
         right (`Expression`): Right expression.
     """
 
+    __slots__ = ()
+
     def __init__(self, left: Expression, right: Expression, **kwargs):
         super().__init__("REqOp", left, right, **kwargs)
 
@@ -901,6 +1078,8 @@ class NotEqToOp(RelOp):
         right (`Expression`): Right expression.
     """
 
+    __slots__ = ()
+
     def __init__(self, left: Expression, right: Expression, **kwargs):
         super().__init__("RNotEqOp", left, right, **kwargs)
 
@@ -913,6 +1092,8 @@ class NotEqToOp(RelOp):
 class LoOp(BinaryOp):
     """Base class for logical operators."""
 
+    __slots__ = ()
+
 
 class AndLoOp(LoOp):
     """Logical and expression.
@@ -922,6 +1103,8 @@ class AndLoOp(LoOp):
         right (`Expression`): Right expression.
     """
 
+    __slots__ = ()
+
     def __init__(self, left: Expression, right: Expression, **kwargs):
         super().__init__("LAndOp", left, right, **kwargs)
 
@@ -934,6 +1117,8 @@ class OrLoOp(LoOp):
         right (`Expression`): Right expression.
     """
 
+    __slots__ = ()
+
     def __init__(self, left: Expression, right: Expression, **kwargs):
         super().__init__("LOrOp", left, right, **kwargs)
 
@@ -951,6 +1136,8 @@ class Concat(BinaryOp):
         right (`Expression`): Right expression.
     """
 
+    __slots__ = ()
+
     def __init__(self, left: Expression, right: Expression, **kwargs):
         super().__init__("Concat", left, right, **kwargs)
 
@@ -967,6 +1154,8 @@ class UnaryOp(Expression):
         operand (`Expression`): Operand.
     """
 
+    __slots__ = ("operand",)
+
     def __init__(self, name: str, operand: Expression, **kwargs):
         super().__init__(name, **kwargs)
         self.operand = operand
@@ -979,6 +1168,8 @@ class UMinusOp(UnaryOp):
         operand (`Expression`): Operand.
     """
 
+    __slots__ = ()
+
     def __init__(self, operand: Expression, **kwargs):
         super().__init__("UMinusOp", operand, **kwargs)
 
@@ -990,6 +1181,8 @@ class UBNotOp(UnaryOp):
         operand (`Expression`): Operand.
     """
 
+    __slots__ = ()
+
     def __init__(self, operand: Expression, **kwargs):
         super().__init__("UBNotOp", operand, **kwargs)
 
@@ -1001,6 +1194,8 @@ class ULNotOp(UnaryOp):
         operand (`Expression`): Operand.
     """
 
+    __slots__ = ()
+
     def __init__(self, operand: Expression, **kwargs):
         super().__init__("ULNotOp", operand, **kwargs)
 
@@ -1013,5 +1208,40 @@ class ULNotOp(UnaryOp):
 class ULengthOP(UnaryOp):
     """Length operator."""
 
+    __slots__ = ()
+
     def __init__(self, operand: Expression, **kwargs):
         super().__init__("ULengthOp", operand, **kwargs)
+
+
+# fields of comment lists, empty for most nodes, which then share one immutable instance in a compact tree
+INTERN_MAX_LENGTH = 64
+
+
+def compact_tree(root: Node) -> Node:
+    """Shrink a parsed tree in place, the tree is meant to be read afterwards, not extended.
+
+    Empty comment lists are replaced by one shared empty tuple, equal short strings (names, string
+    literals) share one object, and the tokens lose their index in the token stream, which is gone by then.
+    """
+    strings: Dict[str, str] = {}
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        for token in (node._first_token, node._last_token):
+            if token is not None:
+                token.tokenIndex = -1
+        for key in attribute_names(node.__class__):
+            if key.startswith("_"):
+                continue
+            value = getattr(node, key, None)
+            if isinstance(value, Node):
+                stack.append(value)
+            elif isinstance(value, list):
+                if not value and key in COMMENT_FIELDS:
+                    setattr(node, key, EMPTY_COMMENTS)
+                else:
+                    stack.extend([item for item in value if isinstance(item, Node)])
+            elif isinstance(value, str) and len(value) <= INTERN_MAX_LENGTH:
+                setattr(node, key, strings.setdefault(value, value))
+    return root
@@ -4,6 +4,7 @@ import re
 from antlr4 import InputStream, CommonTokenStream
 
 from luaparser.astnodes import *
+from luaparser.fastlexer import LuaFastLexer
 from luaparser.parser.LuaLexer import LuaLexer
 from typing import List, Tuple
 from antlr4.Token import Token
@@ -176,6 +177,30 @@ def _listify(obj):
         return obj
 
 
+# rules that are re-entered at the same token index when ``Builder`` backtracks,
+# ``parse_stat`` for example tries ``parse_assignment`` first and then parses the very same ``parse_var`` again.
+PACKRAT_RULES = (
+    "parse_var",
+    "parse_callee",
+    "parse_tail",
+    "parse_expr",
+    "parse_function_literal",
+    "parse_table_constructor",
+)
+
+
+class PackratStats:
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.tokens_skipped = 0
+
+    def __str__(self):
+        return "packrat: {} hits, {} misses, {} tokens not re-parsed".format(
+            self.hits, self.misses, self.tokens_skipped
+        )
+
+
 class Builder:
     CLOSING_TOKEN = [Tokens.END, Tokens.CBRACE, Tokens.CPAR]
 
@@ -197,8 +222,37 @@ class Builder:
         Tokens.EQ,
     ]
 
-    def __init__(self, source):
-        self._stream = CommonTokenStream(LuaLexer(InputStream(source)))
+    def __init__(
+        self,
+        source,
+        lexer: str = "antlr",
+        compact: bool = False,
+        packrat: bool = False,
+    ):
+        """
+
+        Args:
+            source: Lua source code
+            lexer: "antlr" for the generated lexer, "fast" for the regex one of ``fastlexer``,
+                both produce the same tokens
+            compact: build a tree taking several times less memory, see ``compact_tree``,
+                needs the fast lexer
+            packrat: memoize the results of ``PACKRAT_RULES`` by (rule, arguments, token index, pending
+                hidden state), so backtracking replays a rule instead of parsing the same tokens again.
+                It pays off on calls nested in the arguments of calls, like
+                ``f(function() g(function() ... end) end)``, and costs a little on everything else.
+                The expected tokens of a replayed rule are not reported again, so syntax errors may
+                list fewer alternatives.
+        """
+        if lexer == "antlr":
+            if compact:
+                raise ValueError("Compact mode needs the fast lexer")
+            self._stream = CommonTokenStream(LuaLexer(InputStream(source)))
+        elif lexer == "fast":
+            self._stream = CommonTokenStream(LuaFastLexer(source, compact))
+        else:
+            raise ValueError("Unknown lexer: " + str(lexer))
+        self.compact: bool = compact
         # contains a list of CommonTokens
         self._line_count: int = 0
         self._right_index: int = 0
@@ -219,16 +273,72 @@ class Builder:
         self._hidden_handled: bool = False
         self._hidden_handled_stack: List[bool] = []
 
+        self.packrat: bool = packrat
+        self.packrat_stats = PackratStats()
+        self._memo = {}
+        if packrat:
+            for rule in PACKRAT_RULES:
+                setattr(self, rule, self._memoize(rule, getattr(self, rule)))
+
+    def _memoize(self, rule: str, parse):
+        memo = self._memo
+        stats = self.packrat_stats
+
+        def memoized(*args):
+            stream = self._stream
+            start = stream.index
+            pending = tuple(self.comments)
+            key = (rule, args, start, self._hidden_handled, tuple(map(id, pending)))
+            entry = memo.get(key)
+            if entry is not None:
+                result, index, right_index, hidden_handled, comments, text, kind, _ = (
+                    entry
+                )
+                stats.hits += 1
+                stats.tokens_skipped += index - start
+                stream.seek(index)
+                if result:
+                    # a failed rule has restored the right index it was entered with, which may differ from this one
+                    self._right_index = right_index
+                self._hidden_handled = hidden_handled
+                self.comments = list(comments)
+                self.text = text
+                self.type = kind
+                return result
+
+            stats.misses += 1
+            result = parse(*args)
+            # the pending comments are kept alive with the entry so their ids in the key can not be reused
+            memo[key] = (
+                result,
+                stream.index,
+                self._right_index,
+                self._hidden_handled,
+                tuple(self.comments),
+                self.text,
+                self.type,
+                pending,
+            )
+            return result
+
+        return memoized
+
     @property
     def _LT(self) -> CommonToken:
         """Last token that was consumed in next_i*_* method."""
         return self._stream.LT(-1)
 
     def process(self) -> Chunk:
-        node = self.parse_chunk()
+        try:
+            node = self.parse_chunk()
+        finally:
+            # the memo keeps every node ever built alive, including those of abandoned alternatives
+            self._memo.clear()
 
         if not node:
             raise SyntaxException("Expecting a chunk")
+        if self.compact:
+            compact_tree(node)
         return node
 
     def save(self):
@@ -0,0 +1,324 @@
+"""
+``fastlexer`` module
+====================
+
+A regex driven Lua lexer producing the same tokens as the generated ANTLR ``LuaLexer``, several times faster.
+Select it with ``ast.parse(source, lexer="fast")``.
+"""
+
+import re
+from bisect import bisect_left
+from sys import intern, stderr
+from typing import Iterator, List, Tuple
+
+from antlr4.Token import CommonToken, Token
+
+from luaparser.parser.LuaLexer import LuaLexer as Tokens
+
+# (type, channel, start, stop, line, column, text)
+RawToken = Tuple[int, int, int, int, int, int, str]
+
+KEYWORDS = {
+    "and": Tokens.AND,
+    "break": Tokens.BREAK,
+    "do": Tokens.DO,
+    "else": Tokens.ELSE,
+    "elseif": Tokens.ELSEIF,
+    "end": Tokens.END,
+    "false": Tokens.FALSE,
+    "for": Tokens.FOR,
+    "function": Tokens.FUNCTION,
+    "goto": Tokens.GOTO,
+    "if": Tokens.IF,
+    "in": Tokens.IN,
+    "local": Tokens.LOCAL,
+    "nil": Tokens.NIL,
+    "not": Tokens.NOT,
+    "or": Tokens.OR,
+    "repeat": Tokens.REPEAT,
+    "return": Tokens.RETURN,
+    "then": Tokens.THEN,
+    "true": Tokens.TRUE,
+    "until": Tokens.UNTIL,
+    "while": Tokens.WHILE,
+}
+
+OPERATORS = {
+    "...": Tokens.VARARGS,
+    "..": Tokens.CONCAT,
+    ".": Tokens.DOT,
+    "==": Tokens.EQ,
+    "=": Tokens.ASSIGN,
+    "~=": Tokens.NEQ,
+    "~": Tokens.BITNOT,
+    "<=": Tokens.LTEQ,
+    "<<": Tokens.BITRLEFT,
+    "<": Tokens.LT,
+    ">=": Tokens.GTEQ,
+    ">>": Tokens.BITRSHIFT,
+    ">": Tokens.GT,
+    "//": Tokens.FLOOR,
+    "/": Tokens.DIV,
+    "::": Tokens.COLCOL,
+    ":": Tokens.COL,
+    "+": Tokens.ADD,
+    "-": Tokens.MINUS,
+    "*": Tokens.MULT,
+    "%": Tokens.MOD,
+    "^": Tokens.POW,
+    "#": Tokens.LENGTH,
+    "&": Tokens.BITAND,
+    "|": Tokens.BITOR,
+    "(": Tokens.OPAR,
+    ")": Tokens.CPAR,
+    "{": Tokens.OBRACE,
+    "}": Tokens.CBRACE,
+    "[": Tokens.OBRACK,
+    "]": Tokens.CBRACK,
+    ",": Tokens.COMMA,
+    ";": Tokens.SEMCOL,
+}
+
+# Alternatives are tried in order, so every longer token has to come before its prefixes.
+# The rules mirror the ANTLR grammar behind `luaparser.parser.LuaLexer`, including its quirks:
+# line comments stop before the line break, `--[==` without a second bracket is a line comment,
+# and short strings may not contain raw line breaks.
+_ESCAPE = r"""\\(?:[abfnrtvz"'\\]|\r?\n|\r|[0-9]{1,3}|x[0-9a-fA-F]{2})"""
+SCANNER = re.compile(
+    "|".join(
+        (
+            r"(?P<NEWLINE>[\r\n\f]+)",
+            r"(?P<SPACE>[ \t]+)",
+            r"(?P<NAME>[A-Za-z_][A-Za-z0-9_]*)",
+            r"(?P<COMMENT>--\[(?P<c>=*)\[.*?\](?P=c)\])",
+            r"(?P<LINE_COMMENT>--(?:\[=*(?:[^=\[\r\n][^\r\n]*)?|[^\[\r\n][^\r\n]*)?)",
+            r"(?P<NUMBER>0[xX][0-9a-fA-F]+(?:\.[0-9a-fA-F]*)?(?:[pP][+-]?[0-9]+)?"
+            r"|[0-9]+\.[0-9]*(?:[eE][+-]?[0-9]+)?"
+            r"|\.[0-9]+(?:[eE][+-]?[0-9]+)?"
+            r"|[0-9]+(?:[eE][+-]?[0-9]+)?)",
+            r'(?P<STRING>"(?:'
+            + _ESCAPE
+            + r'''|[^\\"\r\n])*"'''
+            + r"|'(?:"
+            + _ESCAPE
+            + r"""|[^\\'\r\n])*'"""
+            + r"|\[(?P<s>=*)\[.*?\](?P=s)\])",
+            r"(?P<SHEBANG>#![^\r\n]*)",
+            r"(?P<OP>\.\.\.|\.\.|==|~=|<=|<<|>=|>>|//|::|[-+*/%^#&~|<>=(){}\[\];:,.])",
+            r"(?P<ERROR>.)",
+        )
+    ),
+    re.DOTALL,
+)
+
+_HIDDEN = {
+    "NEWLINE": Tokens.NEWLINE,
+    "SPACE": Tokens.SPACE,
+    "COMMENT": Tokens.COMMENT,
+    "LINE_COMMENT": Tokens.LINE_COMMENT,
+    "SHEBANG": Tokens.SHEBANG,
+}
+
+_MULTI_LINE = ("NEWLINE", "COMMENT", "STRING")
+
+_HIDDEN_TYPES = frozenset(_HIDDEN.values())
+
+_LINE_BREAK = re.compile("\n")
+
+
+def tokenize(source: str) -> Iterator[RawToken]:
+    """Scan Lua source into raw token tuples, hidden-channel tokens (spaces, newlines, comments) included."""
+    line = 1
+    line_start = 0
+    hidden = Token.HIDDEN_CHANNEL
+    default = Token.DEFAULT_CHANNEL
+    for m in SCANNER.finditer(source):
+        kind = m.lastgroup
+        text = m.group()
+        start = m.start()
+        stop = m.end() - 1
+        column = start - line_start
+        if kind == "NAME":
+            yield KEYWORDS.get(
+                text, Tokens.NAME
+            ), default, start, stop, line, column, text
+            continue
+        if kind == "OP":
+            yield OPERATORS[text], default, start, stop, line, column, text
+        elif kind == "NUMBER":
+            yield Tokens.NUMBER, default, start, stop, line, column, text
+        elif kind == "STRING":
+            yield Tokens.STRING, default, start, stop, line, column, text
+        elif kind == "ERROR":
+            # reported like the ANTLR console error listener does
+            print(
+                "line {}:{} token recognition error at: {!r}".format(
+                    line, column, text
+                ),
+                file=stderr,
+            )
+        else:
+            yield _HIDDEN[kind], hidden, start, stop, line, column, text
+        if kind in _MULTI_LINE:
+            breaks = text.count("\n")
+            if breaks > 0:
+                line += breaks
+                line_start = start + text.rindex("\n") + 1
+
+
+class LuaToken:
+    """A slotted stand-in for `CommonToken`, with the attributes the token stream and `luaparser` use."""
+
+    __slots__ = (
+        "source",
+        "type",
+        "channel",
+        "start",
+        "stop",
+        "tokenIndex",
+        "line",
+        "column",
+        "text",
+    )
+
+    def __init__(
+        self,
+        kind: int,
+        channel: int,
+        start: int,
+        stop: int,
+        line: int,
+        column: int,
+        text: str,
+    ):
+        self.source = CommonToken.EMPTY_SOURCE
+        self.type = kind
+        self.channel = channel
+        self.start = start
+        self.stop = stop
+        self.tokenIndex = -1
+        self.line = line
+        self.column = column
+        self.text = text
+
+    def clone(self):
+        token = LuaToken(
+            self.type,
+            self.channel,
+            self.start,
+            self.stop,
+            self.line,
+            self.column,
+            self.text,
+        )
+        token.tokenIndex = self.tokenIndex
+        return token
+
+    def getTokenSource(self):
+        return self.source[0]
+
+    def getInputStream(self):
+        return self.source[1]
+
+    __str__ = CommonToken.__str__
+
+
+class CompactLuaToken:
+    """A token of compact mode, never copied: every AST node holding it shares the one instance made by the lexer.
+
+    It only keeps its type, start offset and text. The channel follows from the type, the stop offset
+    from the text, and line and column from the offsets of the line breaks, one list for the whole source.
+    Nodes clone their first and last tokens otherwise, which with the positions dominates the memory of a tree.
+    """
+
+    __slots__ = ("type", "start", "tokenIndex", "text", "_breaks")
+
+    def __init__(self, kind: int, start: int, text: str, breaks: List[int]):
+        self.type = kind
+        self.start = start
+        self.tokenIndex = -1
+        self.text = text
+        self._breaks = breaks
+
+    @property
+    def source(self):
+        return CommonToken.EMPTY_SOURCE
+
+    @source.setter
+    def source(self, value):
+        # nodes detach the tokens they hold from their stream, these never hold one
+        pass
+
+    @property
+    def channel(self) -> int:
+        return (
+            Token.HIDDEN_CHANNEL
+            if self.type in _HIDDEN_TYPES
+            else Token.DEFAULT_CHANNEL
+        )
+
+    @property
+    def stop(self) -> int:
+        return self.start + len(self.text) - 1
+
+    @property
+    def line(self) -> int:
+        return bisect_left(self._breaks, self.start) + 1
+
+    @property
+    def column(self) -> int:
+        before = bisect_left(self._breaks, self.start)
+        return self.start - (self._breaks[before - 1] + 1 if before > 0 else 0)
+
+    def clone(self):
+        return self
+
+    def getTokenSource(self):
+        return None
+
+    def getInputStream(self):
+        return None
+
+    __str__ = CommonToken.__str__
+
+
+def line_breaks(source: str) -> List[int]:
+    """Offsets of the "\\n" of `source`, the line of an offset is the number of them before it, plus one."""
+    return [m.start() for m in _LINE_BREAK.finditer(source)]
+
+
+class LuaFastLexer:
+    """
+    A regex driven replacement of the ANTLR `LuaLexer`, usable as the token source of a `CommonTokenStream`.
+    It yields the same token types, channels, char ranges and line/column info as the generated lexer.
+    In compact mode it yields `CompactLuaToken`s and interns names.
+    """
+
+    def __init__(self, source: str, compact: bool = False):
+        self._source = source
+        self._tokens = tokenize(source)
+        self._breaks = line_breaks(source) if compact else None
+        self._eof = None
+
+    def getSourceName(self):
+        return "<fast>"
+
+    def nextToken(self):
+        if self._eof is not None:
+            return self._eof
+        for kind, channel, start, stop, line, column, text in self._tokens:
+            if self._breaks is not None:
+                if kind == Tokens.NAME:
+                    text = intern(text)
+                return CompactLuaToken(kind, start, text, self._breaks)
+            return LuaToken(kind, channel, start, stop, line, column, text)
+        self._eof = self._make_eof()
+        return self._eof
+
+    def _make_eof(self):
+        size = len(self._source)
+        line = self._source.count("\n") + 1
+        column = size - (self._source.rfind("\n") + 1)
+        return LuaToken(
+            Token.EOF, Token.DEFAULT_CHANNEL, size, size - 1, line, column, "<EOF>"
+        )
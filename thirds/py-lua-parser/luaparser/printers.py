@@ -65,7 +65,7 @@ class PythonStyleVisitor:
             if is_list:
                 return "{} 1 key"
             key_count = len(
-                [attr for attr in node.__dict__.keys() if not attr.startswith("_")]
+                [attr for attr in node.attributes().keys() if not attr.startswith("_")]
             )
             res += "{} " + str(key_count) + " "
             if key_count > 1:
@@ -107,7 +107,7 @@ class PythonStyleVisitor:
                 k += 1
             self.dedent()
 
-        for attr, attrValue in node.__dict__.items():
+        for attr, attrValue in node.attributes().items():
             if not attr.startswith(("_", "comments")):
                 if isinstance(attrValue, Node) or isinstance(attrValue, list):
                     res += (
@@ -201,7 +201,7 @@ class HTMLStyleVisitor:
         xml_node = ElementTree.Element(node.display_name)
 
         # attributes
-        for attr, attrValue in node.__dict__.items():
+        for attr, attrValue in node.attributes().items():
             if not attr.startswith("_") and attrValue is not None:
                 xml_attr = ElementTree.SubElement(xml_node, attr)
                 child_node = self.visit(attrValue)
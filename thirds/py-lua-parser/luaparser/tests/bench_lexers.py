@@ -0,0 +1,64 @@
+"""
+Tokens/sec of the ANTLR and the fast lexer, not collected by pytest.
+
+    python -m luaparser.tests.bench_lexers [LUA_FILE_OR_DIR...]
+
+The corpus is the Lua sources of the test suite, see ``test_fast_lexer.corpus``,
+plus the given files, sources the ANTLR lexer reports errors for are left out.
+"""
+
+import sys
+from os import walk
+from os.path import isdir, join
+from time import perf_counter
+
+from luaparser.tests.test_fast_lexer import antlr_tokens, corpus, fast_tokens
+
+# the suite sources are short, they are repeated to time something meaningful
+REPEAT = 20
+
+
+def lua_files(paths):
+    for path in paths:
+        if isdir(path):
+            for root, _, files in walk(path):
+                for file in sorted(files):
+                    if file.endswith(".lua"):
+                        yield join(root, file)
+        else:
+            yield path
+
+
+def read(path):
+    with open(path, encoding="utf-8", errors="replace") as f:
+        return f.read()
+
+
+def main(paths):
+    suite = [text for _, text in corpus() if antlr_tokens(text)[1] == 0]
+    given = [text for text in map(read, lua_files(paths)) if antlr_tokens(text)[1] == 0]
+    source = "\n".join(["\n".join(suite)] * REPEAT + given)
+    print(
+        "{} suite sources x{}, {} files, {} chars".format(
+            len(suite), REPEAT, len(given), len(source)
+        )
+    )
+    rates = dict()
+    for name, tokens_of in (
+        ("antlr", lambda s: antlr_tokens(s)[0]),
+        ("fast", fast_tokens),
+    ):
+        begin = perf_counter()
+        count = len(tokens_of(source))
+        cost = perf_counter() - begin
+        rates[name] = count / cost
+        print(
+            "{:>5}: {} tokens in {:.3f}s, {:.0f} tokens/sec".format(
+                name, count, cost, rates[name]
+            )
+        )
+    print("fast / antlr: {:.1f}x".format(rates["fast"] / rates["antlr"]))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
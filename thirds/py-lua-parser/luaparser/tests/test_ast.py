@@ -1,5 +1,6 @@
 from luaparser.utils import tests
 from luaparser import ast
+from luaparser.builder import Builder
 from luaparser.astnodes import *
 import textwrap
 
@@ -48,6 +49,64 @@ class AstTestCase(tests.TestCase):
         NumberVisitor().visit(tree)
         self.assertTrue(called)
 
+    def test_recursive_visitor_order(self):
+        src = "local a = f(1, {b = -2})"
+        events = []
+
+        class Recorder(ast.ASTRecursiveVisitor):
+            def enter_Node(self, node):
+                events.append("enter " + node.display_name)
+
+            def exit_Expression(self, node):
+                events.append("exit " + node.display_name)
+
+        Recorder().visit(ast.parse(src))
+        self.assertEqual(
+            [
+                "enter Chunk",
+                "enter Block",
+                "enter LocalAssign",
+                "enter Name",
+                "exit Name",
+                "enter Call",
+                "enter Name",
+                "exit Name",
+                "enter Number",
+                "exit Number",
+                "enter Table",
+                "enter Field",
+                "enter Name",
+                "exit Name",
+                "enter UMinusOp",
+                "enter Number",
+                "exit Number",
+                "exit UMinusOp",
+                "exit Field",
+                "exit Table",
+            ],
+            events,
+        )
+
+    def test_recursive_visitor_depth(self):
+        node = Number(1)
+        for _ in range(5000):
+            node = UMinusOp(node)
+        count = 0
+
+        class Counter(ast.ASTRecursiveVisitor):
+            def enter_Expression(self, node):
+                nonlocal count
+                count += 1
+
+        Counter().visit(node)
+        self.assertEqual(5001, count)
+
+    def test_packrat(self):
+        src = "f(function() g(function() h(function() return 1 end) end) end)"
+        builder = Builder(src, packrat=True)
+        self.assertEqual(ast.parse(src), builder.process())
+        self.assertGreater(builder.packrat_stats.hits, 0)
+
     def test_parse_error(self):
         src = textwrap.dedent(
             """
@@ -0,0 +1,140 @@
+import ast as py_ast
+import textwrap
+from os import listdir
+from os.path import dirname, join
+
+from antlr4 import CommonTokenStream, InputStream
+from antlr4.error.ErrorListener import ErrorListener
+
+from luaparser import ast
+from luaparser.fastlexer import LuaFastLexer
+from luaparser.parser.LuaLexer import LuaLexer
+from luaparser.utils import tests
+
+
+class _ErrorCounter(ErrorListener):
+    def __init__(self):
+        self.count = 0
+
+    def syntaxError(self, recognizer, offending_symbol, line, column, msg, e):
+        self.count += 1
+
+
+def antlr_tokens(source: str):
+    lexer = LuaLexer(InputStream(source))
+    lexer.removeErrorListeners()
+    errors = _ErrorCounter()
+    lexer.addErrorListener(errors)
+    stream = CommonTokenStream(lexer)
+    stream.fill()
+    return stream.tokens, errors.count
+
+
+def fast_tokens(source: str):
+    stream = CommonTokenStream(LuaFastLexer(source))
+    stream.fill()
+    return stream.tokens
+
+
+def describe(token):
+    return (
+        token.type,
+        token.channel,
+        token.start,
+        token.stop,
+        token.line,
+        token.column,
+        token.text,
+    )
+
+
+def corpus():
+    """String literals of the other test modules, most of them are Lua sources."""
+    here = dirname(__file__)
+    for name in sorted(listdir(here)):
+        if name.startswith("test_") and name.endswith(".py"):
+            with open(join(here, name), encoding="utf-8") as f:
+                for node in py_ast.walk(py_ast.parse(f.read())):
+                    if isinstance(node, py_ast.Constant) and isinstance(
+                        node.value, str
+                    ):
+                        yield name, node.value
+
+
+EDGE_CASES = [
+    "local a = 0x1F + 0xA.8p1 + 3.e2 + .5 + 1e-3 + 7",
+    "a = [==[ long\n]] string ]==] .. [[x]]",
+    "--[==[ long\ncomment ]==]\n-- line\n--[= not long\nx = 1",
+    "s = 'it\\'s' .. \"tab\\t\\x41\\65\\\n\"",
+    "#!/usr/bin/lua\nreturn a // b >> 1 << 2 ~= c ~ d :: e ::",
+    "t = {...} goto e ::e:: a.b:c(d)[1] = #t",
+    "x = 1\r\ny = 2\rz = 3\n\n\f",
+]
+
+
+class FastLexerTestCase(tests.TestCase):
+    def assert_same_tokens(self, where: str, source: str):
+        expected, errors = antlr_tokens(source)
+        self.assertEqual(0, errors, where)
+        self.assertEqual(
+            [describe(t) for t in expected],
+            [describe(t) for t in fast_tokens(source)],
+            where,
+        )
+
+    def test_corpus_tokens(self):
+        checked = 0
+        for where, source in corpus():
+            expected, errors = antlr_tokens(source)
+            if errors > 0:
+                # not Lua, the generated lexer reports errors on it
+                continue
+            self.assertEqual(
+                [describe(t) for t in expected],
+                [describe(t) for t in fast_tokens(source)],
+                where,
+            )
+            checked += 1
+        self.assertGreater(checked, 100)
+
+    def test_edge_case_tokens(self):
+        for source in EDGE_CASES:
+            self.assert_same_tokens(source, source)
+
+    def test_same_tree(self):
+        source = textwrap.dedent("""
+            -- comment
+            local function f(a, b, ...)
+                for i = 1, 10, 2 do a = a + i end
+                return { [1] = "x", y = 0x10, f = function() return ... end }
+            end
+            if f(1) then print'x' elseif not f then return end
+            """)
+        self.assertEqual(ast.parse(source), ast.parse(source, lexer="fast"))
+
+    def test_corpus_trees(self):
+        for where, source in corpus():
+            if antlr_tokens(source)[1] > 0:
+                continue
+            try:
+                expected = ast.parse(source)
+            except Exception:
+                continue
+            self.assertEqual(expected, ast.parse(source, lexer="fast"), where)
+
+    def test_compact_tree(self):
+        source = "local t = { a = 'x', b = 'x', [1] = 2.5 } -- tail\nreturn t.a"
+        tree = ast.parse(source, lexer="fast", compact=True)
+        self.assertEqual(ast.parse(source), tree)
+        self.assertEqual(ast.to_lua_source(ast.parse(source)), ast.to_lua_source(tree))
+        name = tree.body.body[0].targets[0]
+        self.assertFalse(hasattr(name, "__dict__"))
+        self.assertEqual((1, 6), (name.first_token.line, name.first_token.column))
+
+    def test_compact_needs_fast_lexer(self):
+        with self.assertRaises(ValueError):
+            ast.parse("a = 1", compact=True)
+
+    def test_unknown_lexer(self):
+        with self.assertRaises(ValueError):
+            ast.parse("a = 1", lexer="yacc")